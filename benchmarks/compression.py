@@ -0,0 +1,67 @@
+"""
+compare the bytes on the wire and the end-to-end latency of queries and writes
+with and without compression, against a local stand-in server.
+
+    pip install -e . && python benchmarks/compression.py --rows 1000000 --repeat 5
+
+on loopback the latency mostly shows the CPU cost of compression. the bytes on the wire
+are what a slow link (e.g. across availability zones) pays for.
+"""
+import argparse
+import statistics
+import time
+
+import pymarketstore as pymkts
+from standin import CountingProxy, ohlcv, serve_grpc, serve_rpc
+
+
+def run(client: pymkts.Client, proxy: CountingProxy, repeat: int, rows: int):
+    records = ohlcv(rows, seed=1)
+    params = pymkts.Params('BENCH', '1Min', 'OHLCV')
+    results = {}
+    for op, call in (('query', lambda: client.query(params)),
+                     ('write', lambda: client.write(records, 'BENCH/1Min/OHLCV'))):
+        call()  # warm-up, e.g. connection setup
+        proxy.reset()
+        latencies = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call()
+            latencies.append(time.perf_counter() - start)
+        results[op] = (proxy.sent // repeat, proxy.received // repeat, statistics.median(latencies))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000, help='records of a query reply and of a write')
+    parser.add_argument('--repeat', type=int, default=5, help='number of timed requests per case')
+    args = parser.parse_args()
+
+    print('{:<10} {:<12} {:<6} {:>14} {:>14} {:>10}'.format(
+        'transport', 'compression', 'op', 'sent bytes', 'recv bytes', 'median ms'))
+    for transport in ('msgpack', 'grpc'):
+        for compression in (None, 'gzip', 'deflate'):
+            if transport == 'grpc':
+                server, port = serve_grpc(args.rows, compression=compression)
+            else:
+                server, port = serve_rpc(args.rows, compression=compression)
+            proxy = CountingProxy(port)
+            if transport == 'grpc':
+                client = pymkts.Client('127.0.0.1:{}'.format(proxy.port), grpc=True, compression=compression)
+            else:
+                client = pymkts.Client('http://127.0.0.1:{}/rpc'.format(proxy.port), compression=compression)
+
+            for op, (sent, received, latency) in run(client, proxy, args.repeat, args.rows).items():
+                print('{:<10} {:<12} {:<6} {:>14,} {:>14,} {:>10.1f}'.format(
+                    transport, compression or '-', op, sent, received, latency * 1000))
+
+            proxy.close()
+            if transport == 'grpc':
+                server.stop(None)
+            else:
+                server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,68 @@
+"""
+measure how the query throughput of a GRPCClient scales with the size of its channel pool.
+
+    pip install -e . && python benchmarks/grpc_pool.py --threads 32 --pool-sizes 1 2 4 8
+
+without --endpoint the queries go to the local stand-in server, which is bound by the GIL of its own
+process, so it shows the client-side scaling only. point --endpoint at a MarketStore server to see
+what a real server can serve.
+"""
+import argparse
+import threading
+import time
+
+import pymarketstore as pymkts
+from standin import serve_grpc
+
+
+def throughput(client: pymkts.GRPCClient, threads: int, duration: float, rows: int) -> float:
+    params = pymkts.Params('BENCH', '1Min', 'OHLCV', limit=rows)
+    client.query(params)
+    count = [0] * threads
+    deadline = time.perf_counter() + duration
+
+    def worker(idx: int):
+        while time.perf_counter() < deadline:
+            client.query(params)
+            count[idx] += 1
+
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for worker_thread in workers:
+        worker_thread.start()
+    for worker_thread in workers:
+        worker_thread.join()
+    return sum(count) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--endpoint', help='"{host}:{port}" of a gRPC server. a local stand-in if omitted')
+    parser.add_argument('--threads', type=int, default=32, help='number of concurrent callers')
+    parser.add_argument('--pool-sizes', type=int, nargs='+', default=[1, 2, 4, 8], help='pool sizes to compare')
+    parser.add_argument('--balance', default='round_robin', choices=['round_robin', 'least_loaded'])
+    parser.add_argument('--rows', type=int, default=1000, help='records per query')
+    parser.add_argument('--duration', type=float, default=5.0, help='seconds per pool size')
+    args = parser.parse_args()
+
+    server = None
+    endpoint = args.endpoint
+    if endpoint is None:
+        server, port = serve_grpc(args.rows, max_workers=args.threads)
+        endpoint = '127.0.0.1:{}'.format(port)
+
+    print('{:>9} {:>12} {:>8}'.format('pool size', 'queries/s', 'speedup'))
+    base = None
+    for size in args.pool_sizes:
+        client = pymkts.GRPCClient(endpoint, pool_size=size, balance=args.balance, warm_up=True, warm_up_timeout=10)
+        qps = throughput(client, args.threads, args.duration, args.rows)
+        base = base or qps
+        print('{:>9} {:>12.0f} {:>7.2f}x'.format(size, qps, qps / base))
+        client.pool.close()
+
+    if server is not None:
+        server.stop(None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+"""
+local stand-in MarketStore server for the benchmarks.
+serves synthetic OHLCV records for any query over msgpack-RPC (HTTP) and gRPC, accepts and drops writes,
+and provides a TCP proxy counting the bytes on the wire.
+"""
+import gzip
+import socket
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Tuple
+
+import grpc
+import msgpack
+import numpy as np
+
+import pymarketstore.proto.marketstore_pb2 as proto
+import pymarketstore.proto.marketstore_pb2_grpc as gp
+from pymarketstore.encode import pack
+
+VERSION = 'standin'
+DTYPE = np.dtype([('Epoch', 'i8'), ('Open', 'f4'), ('High', 'f4'), ('Low', 'f4'), ('Close', 'f4'), ('Volume', 'f4')])
+
+DECOMPRESSORS = {'gzip': gzip.decompress, 'deflate': zlib.decompress}
+COMPRESSORS = {'gzip': lambda data: gzip.compress(data, compresslevel=1),
+               'deflate': lambda data: zlib.compress(data, 1)}
+GRPC_COMPRESSIONS = {None: grpc.Compression.NoCompression, 'gzip': grpc.Compression.Gzip,
+                     'deflate': grpc.Compression.Deflate}
+
+
+def ohlcv(rows: int, seed: int = 0) -> np.ndarray:
+    """
+    1Min bars of a random walk priced in cents, which compress like real market data rather than noise
+    """
+    rng = np.random.default_rng(seed)
+    array = np.empty(rows, dtype=DTYPE)
+    array['Epoch'] = 1500000000 + 60 * np.arange(rows)
+    close = np.round(100 + np.cumsum(rng.normal(0, 0.05, rows)), 2)
+    array['Open'] = np.roll(close, 1)
+    array['High'] = np.maximum(array['Open'], close) + 0.01
+    array['Low'] = np.minimum(array['Open'], close) - 0.01
+    array['Close'] = close
+    array['Volume'] = rng.integers(1, 1000, rows)
+    return array
+
+
+class Dataset(object):
+    """
+    records returned for every queried TBK, truncated to the limit of the query
+    """
+
+    def __init__(self, rows: int):
+        self.records = ohlcv(rows)
+
+    def query(self, destination: str, limit: int = 0) -> np.ndarray:
+        return self.records[-limit:] if limit else self.records
+
+
+def _rpc_handler(dataset: Dataset, compression: str = None):
+    class RpcHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, fmt, *args):
+            pass
+
+        def do_HEAD(self):
+            self.send_response(200)
+            self.send_header('Marketstore-Version', VERSION)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers['Content-Length']))
+            encoding = self.headers.get('Content-Encoding')
+            if encoding in DECOMPRESSORS:
+                body = DECOMPRESSORS[encoding](body)
+            request = msgpack.loads(body)
+            params = request['params']
+            if request['method'] == 'DataService.Query':
+                result = {'responses': [self._query(req) for req in params['requests']],
+                          'timezone': 'UTC', 'version': VERSION}
+            else:
+                result = {'responses': None}
+            reply = msgpack.dumps({'jsonrpc': '2.0', 'id': request['id'], 'result': result})
+
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/x-msgpack')
+            if compression is not None and compression in self.headers.get('Accept-Encoding', ''):
+                reply = COMPRESSORS[compression](reply)
+                self.send_header('Content-Encoding', compression)
+            self.send_header('Content-Length', str(len(reply)))
+            self.send_header('Marketstore-Version', VERSION)
+            self.end_headers()
+            self.wfile.write(reply)
+
+        @staticmethod
+        def _query(req: Dict) -> Dict:
+            tbk = req['destination']
+            packed = pack({tbk: dataset.query(tbk, req.get('limit_record_count', 0))})[0]
+            return {'result': {
+                'names': packed.names, 'types': packed.types, 'data': packed.data, 'length': packed.length,
+                'startindex': packed.start_index, 'lengths': packed.lengths,
+            }}
+
+    return RpcHandler
+
+
+def serve_rpc(rows: int = 100000, compression: str = None) -> Tuple[ThreadingHTTPServer, int]:
+    """
+    start a msgpack-RPC stand-in in a background thread
+    :param compression: compress replies with it when the client accepts it
+    :return: (server, port). stop it with server.shutdown()
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _rpc_handler(Dataset(rows), compression))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, server.server_address[1]
+
+
+class Servicer(gp.MarketstoreServicer):
+
+    def __init__(self, dataset: Dataset):
+        self.dataset = dataset
+
+    def Query(self, request, context):
+        responses = []
+        for req in request.requests:
+            packed = pack({req.destination: self.dataset.query(req.destination, req.limit_record_count)})[0]
+            responses.append(proto.QueryResponse(result=proto.NumpyMultiDataset(
+                data=proto.NumpyDataset(column_types=packed.types, column_names=packed.names,
+                                        column_data=packed.data, length=packed.length),
+                start_index=packed.start_index, lengths=packed.lengths)))
+        return proto.MultiQueryResponse(responses=responses, version=VERSION, timezone='UTC')
+
+    def Write(self, request, context):
+        return proto.MultiServerResponse(responses=[])
+
+    def ServerVersion(self, request, context):
+        return proto.ServerVersionResponse(version=VERSION)
+
+
+def serve_grpc(rows: int = 100000, compression: str = None, max_workers: int = 16) -> Tuple[grpc.Server, int]:
+    """
+    start a gRPC stand-in
+    :param compression: compression of the replies
+    :return: (server, port). stop it with server.stop(None)
+    """
+    options = [('grpc.max_send_message_length', 1024 ** 3), ('grpc.max_receive_message_length', 1024 ** 3)]
+    server = grpc.server(ThreadPoolExecutor(max_workers), options=options,
+                         compression=GRPC_COMPRESSIONS[compression])
+    gp.add_MarketstoreServicer_to_server(Servicer(Dataset(rows)), server)
+    port = server.add_insecure_port('127.0.0.1:0')
+    server.start()
+    return server, port
+
+
+class CountingProxy(object):
+    """
+    TCP proxy to a local port counting the bytes sent by the clients and by the server
+    """
+
+    def __init__(self, target_port: int):
+        self.target_port = target_port
+        self.sent = 0
+        self.received = 0
+        self._lock = threading.Lock()
+        self._listener = socket.socket()
+        self._listener.bind(('127.0.0.1', 0))
+        self._listener.listen(64)
+        self.port = self._listener.getsockname()[1]
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def reset(self):
+        with self._lock:
+            self.sent = self.received = 0
+
+    def _accept(self):
+        while True:
+            try:
+                client, _ = self._listener.accept()
+            except OSError:
+                return
+            upstream = socket.create_connection(('127.0.0.1', self.target_port))
+            threading.Thread(target=self._pipe, args=(client, upstream, 'sent'), daemon=True).start()
+            threading.Thread(target=self._pipe, args=(upstream, client, 'received'), daemon=True).start()
+
+    def _pipe(self, src: socket.socket, dst: socket.socket, counter: str):
+        try:
+            while True:
+                data = src.recv(1 << 20)
+                if not data:
+                    break
+                with self._lock:
+                    setattr(self, counter, getattr(self, counter) + len(data))
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def close(self):
+        self._listener.close()
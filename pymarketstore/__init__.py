@@ -1,11 +1,19 @@
-from .client import Client  # noqa
+from .client import Client, AsyncClient  # noqa
 from .params import Params, ListSymbolsFormat  # noqa
+from .batch import QueryBatch  # noqa
 from .jsonrpc_client import MsgpackRpcClient  # noqa
-from .grpc_client import GRPCClient  # noqa
+from .jsonrpc_client import AsyncJsonRpcClient  # noqa
+from .grpc_client import GRPCClient, AsyncGRPCClient  # noqa
 
 # alias
 Param = Params  # noqa
 
-from .stream import StreamConn  # noqa
+from .stream import StreamConn, AsyncStreamConn  # noqa
+from .cache import QueryCache  # noqa
+from .diskcache import DiskCache  # noqa
+from .writer import BufferedWriter  # noqa
+from .loader import BulkLoader  # noqa
+from .sharded import ShardedClient, HashRing  # noqa
+from .hedging import HedgedClient, HedgePolicy, LatencyHistogram  # noqa
 
 __version__ = '0.22'
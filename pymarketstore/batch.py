@@ -0,0 +1,156 @@
+import re
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+NAT = np.iinfo(np.int64).min
+
+timeframe_regex = re.compile(r'^(\d*)(Sec|Min|H|D|W)$')
+timeframe_ns = {
+    'Sec': 10 ** 9,
+    'Min': 60 * 10 ** 9,
+    'H': 3600 * 10 ** 9,
+    'D': 86400 * 10 ** 9,
+    'W': 7 * 86400 * 10 ** 9,
+}
+
+# rough size of a serialized QueryRequest besides its destination
+REQUEST_OVERHEAD = 64
+
+
+def to_ns(values, length: int) -> Optional[np.ndarray]:
+    """
+    convert timestamps to int64 nanoseconds since the epoch in one pass.
+    :param values: None, a scalar or an array of numpy datetime64 / int64 nanoseconds / timestamp strings.
+        NaT is kept as a missing timestamp
+    :param length: number of queries
+    :return: int64 array of the given length or None. missing timestamps are NAT
+    """
+    if values is None:
+        return None
+    array = np.asarray(values)
+    if array.dtype.kind in 'iu':
+        array = array.astype('i8', copy=False)
+    else:
+        array = array.astype('M8[ns]').view('i8')
+    return np.broadcast_to(array, (length,))
+
+
+def parse_timeframe(timeframe: str) -> Optional[int]:
+    """
+    :return: length of a timeframe (e.g. "5Min") in nanoseconds, or None if it is unknown
+    """
+    match = timeframe_regex.match(timeframe)
+    if match is None:
+        return None
+    return int(match.group(1) or 1) * timeframe_ns[match.group(2)]
+
+
+class QueryBatch(object):
+    """
+    many single-symbol queries of the same timeframe and attribute group, held as arrays.
+    unlike a list of Params, the timestamps of all queries are converted and split into
+    epoch seconds/nanoseconds in vectorized passes when the request is built.
+    """
+
+    def __init__(self, symbols: Sequence[str], timeframe: str, attrgroup: str,
+                 starts=None, ends=None, limit: int = None, limit_from_start: bool = None,
+                 columns: List[str] = None, functions: List[str] = None):
+        """
+        :param symbols: array of symbols, one query per symbol
+        :param timeframe: timeframe string
+        :param attrgroup: attribute group string
+        :param starts: start of each query (or one for all) as datetime64, int64 nanoseconds or strings
+        :param ends: end of each query (or one for all) as datetime64, int64 nanoseconds or strings
+        """
+        self.symbols = np.asarray(symbols, dtype=object)
+        self.timeframe = timeframe
+        self.attrgroup = attrgroup
+        self.starts = to_ns(starts, len(self.symbols))
+        self.ends = to_ns(ends, len(self.symbols))
+        self.limit = limit
+        self.limit_from_start = limit_from_start
+        self.columns = columns
+        self.functions = functions
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def __getitem__(self, item: slice) -> 'QueryBatch':
+        batch = QueryBatch.__new__(QueryBatch)
+        batch.__dict__.update(self.__dict__)
+        batch.symbols = self.symbols[item]
+        batch.starts = None if self.starts is None else self.starts[item]
+        batch.ends = None if self.ends is None else self.ends[item]
+        return batch
+
+    def destinations(self) -> List[str]:
+        suffix = '/{}/{}'.format(self.timeframe, self.attrgroup)
+        return [symbol + suffix for symbol in self.symbols.tolist()]
+
+    @staticmethod
+    def _epochs(ns: Optional[np.ndarray]) -> Tuple[Optional[list], Optional[list], Optional[list]]:
+        if ns is None:
+            return None, None, None
+        secs, nanos = np.divmod(ns, 10 ** 9)
+        return secs.tolist(), nanos.tolist(), (ns != NAT).tolist()
+
+    def epochs(self):
+        """
+        :return: (start seconds, start nanoseconds, has start, end seconds, end nanoseconds, has end)
+            as python lists, or Nones when the batch has no starts/ends
+        """
+        return self._epochs(self.starts) + self._epochs(self.ends)
+
+    def estimate_sizes(self, row_bytes: int = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        estimate the serialized request size and the reply size of each query
+        :param row_bytes: size of a record. the reply size is only estimated when it is given
+        :return: (request sizes, reply sizes) in bytes
+        """
+        req_sizes = np.fromiter((len(s) for s in self.symbols.tolist()), dtype='i8', count=len(self))
+        req_sizes += len(self.timeframe) + len(self.attrgroup) + REQUEST_OVERHEAD
+        reply_sizes = np.zeros(len(self), dtype='i8')
+        if row_bytes is None:
+            return req_sizes, reply_sizes
+
+        rows = None
+        tf = parse_timeframe(self.timeframe)
+        if tf is not None and self.starts is not None and self.ends is not None:
+            # unbounded queries are not estimated
+            valid = (self.starts != NAT) & (self.ends != NAT)
+            rows = np.where(valid, (self.ends - self.starts) // tf + 1, 0)
+        if self.limit is not None:
+            rows = np.full(len(self), self.limit, dtype='i8') if rows is None else np.minimum(rows, self.limit)
+        if rows is not None:
+            reply_sizes = np.maximum(rows, 0) * row_bytes
+        return req_sizes, reply_sizes
+
+    def split(self, max_bytes: int, row_bytes: int = None, ratio: float = 0.8) -> List['QueryBatch']:
+        """
+        split the batch so that the estimated size of each request and of its reply stay
+        under `ratio` of `max_bytes` (e.g. the channel's max message length).
+        a single query larger than the limit still gets a batch of its own.
+        :param max_bytes: max message length in bytes
+        :param row_bytes: size of a record, to estimate reply sizes
+        :param ratio: safety margin for the estimation
+        :return: list of QueryBatch
+        """
+        limit = int(max_bytes * ratio)
+        cumsums = [np.cumsum(sizes) for sizes in self.estimate_sizes(row_bytes)]
+
+        batches = []
+        begin = 0
+        while begin < len(self):
+            end = min(
+                int(np.searchsorted(cumsum, (cumsum[begin - 1] if begin > 0 else 0) + limit, side='right'))
+                for cumsum in cumsums
+            )
+            end = max(end, begin + 1)
+            batches.append(self[begin:end])
+            begin = end
+        return batches
+
+    def __repr__(self):
+        return 'QueryBatch(symbols={}, timeframe={}, attrgroup={}, limit={})'.format(
+            len(self), self.timeframe, self.attrgroup, self.limit)
@@ -0,0 +1,150 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Set, Tuple, Union
+
+from .params import Params, isiterable
+from .results import QueryReply
+
+
+def normalize_params(params: Union[Params, List[Params]]) -> Tuple:
+    """
+    build a hashable key of a query from its Params. the order of the symbols in a Params does not matter.
+    :param params: Params object or list of Params
+    :return: tuple
+    """
+    if not isiterable(params):
+        params = [params]
+    return tuple(
+        (
+            tuple(sorted(set(p.symbols))), p.timeframe, p.attrgroup, p.key_category,
+            None if p.start is None else p.start.value,
+            None if p.end is None else p.end.value,
+            p.limit, p.limit_from_start,
+            None if p.columns is None else tuple(p.columns),
+            None if p.functions is None else tuple(p.functions),
+        )
+        for p in params
+    )
+
+
+def _tbks(params: Union[Params, List[Params]]) -> Set[Tuple[str, str, str]]:
+    if not isiterable(params):
+        params = [params]
+    return {
+        (symbol, p.timeframe, p.attrgroup)
+        for p in params for symbol in p.symbols
+    }
+
+
+def _match(tbk: Tuple[str, str, str], other: Tuple[str, str, str]) -> bool:
+    return all(a == b or a == '*' or b == '*' for a, b in zip(tbk, other))
+
+
+def reply_nbytes(reply: QueryReply) -> int:
+    """
+    :return: size of the records held by the reply. lazy DataSets are not decoded to compute it.
+    """
+    return sum(len(ds) * ds.dtype.itemsize for ds in reply.all().values())
+
+
+class _Entry(object):
+
+    def __init__(self, reply: QueryReply, nbytes: int, expires_at: float, tbks: Set[Tuple[str, str, str]]):
+        self.reply = reply
+        self.nbytes = nbytes
+        self.expires_at = expires_at
+        self.tbks = tbks
+
+
+class QueryCache(object):
+    """
+    in-process LRU cache of query replies keyed on normalized Params.
+    entries are evicted in least-recently-used order once the total size exceeds max_bytes,
+    and expire ttl seconds after they are stored.
+    replies are stored and handed out as views (QueryReply.view()), so that appending to or refreshing
+    a returned reply does not change the cached one. the records themselves are shared between callers
+    and must not be modified in place.
+    """
+
+    def __init__(self, max_bytes: int = 256 * 1024 ** 2, ttl: float = 60.0):
+        """
+        :param max_bytes: byte budget of the records held in the cache
+        :param ttl: lifetime of an entry in seconds. None for no expiration
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[Tuple, _Entry] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, params: Union[Params, List[Params]]) -> Optional[QueryReply]:
+        key = normalize_params(params)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.reply.view()
+
+    def put(self, params: Union[Params, List[Params]], reply: QueryReply):
+        nbytes = reply_nbytes(reply)
+        if nbytes > self.max_bytes:
+            return
+        key = normalize_params(params)
+        expires_at = float('inf') if self.ttl is None else time.monotonic() + self.ttl
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = _Entry(reply.view(), nbytes, expires_at, _tbks(params))
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tbk: str):
+        """
+        drop the entries which hold records of the time bucket
+        :param tbk: Time Bucket Key string. (e.g. "TSLA/1Min/OHLCV"). "*" matches any element
+        """
+        symbol, timeframe, attrgroup = tbk.split(':')[0].split('/')
+        target = (symbol, timeframe, attrgroup)
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if any(_match(target, t) for t in entry.tbks)]
+            for key in stale:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self.nbytes,
+            }
+
+    def _remove(self, key: Tuple):
+        entry = self._entries.pop(key)
+        self.nbytes -= entry.nbytes
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self):
+        return 'QueryCache(max_bytes={}, ttl={}, entries={}, bytes={})'.format(
+            self.max_bytes, self.ttl, len(self._entries), self.nbytes)
@@ -2,14 +2,20 @@ from __future__ import absolute_import
 
 import logging
 import re
-from typing import List, Dict, Union, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Dict, Union, Tuple, Iterator
 
 import numpy as np
+import pandas as pd
 
-from .grpc_client import GRPCClient
-from .jsonrpc_client import JsonRpcClient
-from .params import Params, ListSymbolsFormat
-from .results import QueryReply
+from .batch import QueryBatch
+from .cache import QueryCache
+from .diskcache import DiskCache
+from .encode import Records, columns_from_df
+from .grpc_client import GRPCClient, AsyncGRPCClient
+from .jsonrpc_client import JsonRpcClient, AsyncJsonRpcClient
+from .params import Params, ListSymbolsFormat, split_params
+from .results import DataSet, QueryReply, QueryResult
 
 logger = logging.getLogger(__name__)
 
@@ -23,25 +29,59 @@ data_type_conv = {
 http_regex = re.compile(r'^https?://(.+):\d+/rpc')  # http:// or https://
 
 
+def grpc_endpoint(endpoint: str) -> str:
+    match = re.findall(http_regex, endpoint)
+
+    # when endpoint is specified in "http://{host}:{port}/rpc" format,
+    # extract the host and initialize GRPC client with default port(5995) for compatibility
+    if len(match) != 0:
+        host = match[0] if match[0] != "" else "localhost"  # default host is "localhost"
+        return "{}:5995".format(host)  # default port is 5995
+    return endpoint
+
+
+# error of the server on a query of a bucket which does not exist
+_NOT_FOUND = re.compile(r'no files returned from query parse', re.IGNORECASE)
+
+
+def _is_bucket_not_found(exc: Exception) -> bool:
+    details = exc.details() if callable(getattr(exc, 'details', None)) else None
+    return bool(_NOT_FOUND.search(details or str(exc)))
+
+
 class Client:
-    def __init__(self, endpoint: str = 'http://localhost:5993/rpc', grpc: bool = False):
+    """
+    MarketStore client
+    :param endpoint: msgpack-RPC endpoint URL, or "{host}:{port}" of the gRPC server
+    :param grpc: use the gRPC API instead of msgpack-RPC
+    :param columnar: decode query replies into per-column arrays over the received buffers
+        (DataSet.columns) instead of copying them into a structured array
+    :param lazy: keep the received buffers of query replies and decode the data of each TBK
+        only when its DataSet is accessed
+    :param cache: QueryCache to serve repeated queries from. writes and destroys through
+        this client invalidate the cached replies of the affected TBKs
+    :param disk_cache: DiskCache to serve closed historical ranges from, so that only the
+        missing edges of a query range are fetched from the server
+    :param compression: "gzip" or "deflate" to compress the request and reply bodies. None for no compression
+    :param pool_size: max number of HTTP connections kept open for concurrent calls (msgpack-RPC, 10 by default),
+        or number of channels the calls are spread over (gRPC, 1 by default)
+    :param timeout: timeout in seconds of every call, or a (connect, read) tuple (msgpack-RPC)
+    """
+
+    def __init__(self, endpoint: str = 'http://localhost:5993/rpc', grpc: bool = False, columnar: bool = False,
+                 lazy: bool = False, cache: QueryCache = None, disk_cache: DiskCache = None,
+                 compression: str = None, pool_size: int = None, timeout: Union[float, Tuple[float, float]] = None):
+        self.cache = cache
+        self.disk_cache = disk_cache
         if grpc:
-            match = re.findall(http_regex, endpoint)
-
-            # when endpoint is specified in "http://{host}:{port}/rpc" format,
-            # extract the host and initialize GRPC client with default port(5995) for compatibility
-            if len(match) != 0:
-                host = match[0] if match[0] != "" else "localhost"  # default host is "localhost"
-                self.endpoint = "{}:5995".format(host)  # default port is 5995
-                self.client = GRPCClient(self.endpoint)
-                return
-            else:
-                self.endpoint = endpoint
-                self.client = GRPCClient(self.endpoint)
-                return
+            self.endpoint = grpc_endpoint(endpoint)
+            self.client = GRPCClient(self.endpoint, columnar=columnar, lazy=lazy, compression=compression,
+                                     pool_size=pool_size or 1)
+            return
 
         self.endpoint = endpoint
-        self.client = JsonRpcClient(self.endpoint)
+        self.client = JsonRpcClient(self.endpoint, columnar=columnar, lazy=lazy, compression=compression,
+                                    pool_size=pool_size or 10, timeout=timeout)
 
     def query(self, params: Params) -> QueryReply:
         """
@@ -49,8 +89,130 @@ class Client:
         :param params: Params object used to query
         :return: QueryReply object
         """
+        if self.cache is None:
+            return self.query_uncached(params)
+
+        reply = self.cache.get(params)
+        if reply is None:
+            reply = self.query_uncached(params)
+            self.cache.put(params, reply)
+        return reply
+
+    def query_uncached(self, params: Union[Params, List[Params]]) -> QueryReply:
+        """
+        execute QUERY to MarketStore server without going through the QueryCache (the DiskCache still serves
+        the closed ranges it holds), e.g. to poll for new records
+        :param params: Params object (or list of them) used to query
+        :return: QueryReply object
+        """
+        if self.disk_cache is not None:
+            return self.disk_cache.query(params, self.client.query)
         return self.client.query(params)
 
+    def query_parallel(self, params: Union[Params, List[Params]], max_workers: int = None,
+                       chunk_symbols: int = 100, chunk_span: Union[str, pd.Timedelta] = None) -> QueryReply:
+        """
+        split a large QUERY into symbol/time shards and execute them concurrently on a thread pool
+        :param params: Params object (or list of them) used to query
+        :param max_workers: max number of concurrent requests. defaults to ThreadPoolExecutor's default
+        :param chunk_symbols: max number of symbols per shard. None to not split by symbol
+        :param chunk_span: max time range per shard (e.g. '365D'). None to not split by time.
+            requires start and end to be set and limit to be unset.
+        :return: QueryReply object with a single result keyed by TBK, like the one of query()
+        """
+        shards = split_params(params, chunk_symbols=chunk_symbols, chunk_span=chunk_span)
+        # each shard goes through the caches like a query() of its own
+        if len(shards) == 1:
+            return self.query(shards[0])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            replies = list(executor.map(self.query, shards))
+        return QueryReply.concat(replies)
+
+    def query_iter(self, params: Params, page_rows: int = 100000,
+                   page_span: Union[str, pd.Timedelta] = None) -> Iterator[QueryReply]:
+        """
+        iterate over a QUERY page by page, so that only one page is held in memory at a time.
+        pages are walked forward in time from params.start to params.end.
+        :param params: Params object used to query
+        :param page_rows: max number of records per symbol in a page. None to only page by time
+        :param page_span: time range of a page (e.g. '30D'). requires start and end to be set
+        :return: iterator of QueryReply objects. each page holds a single symbol when page_rows is set
+        """
+        if params.limit is not None:
+            raise ValueError('limit cannot be used with query_iter: {}'.format(params))
+
+        windows = split_params(params, chunk_span=page_span) if page_span is not None else [params]
+        for window in windows:
+            if page_rows is None:
+                reply = self.query(window)
+                if any(len(ds) for ds in reply.all().values()):
+                    yield reply
+                continue
+            for shard in split_params(window, chunk_symbols=1):
+                yield from self._iter_rows(shard, page_rows)
+
+    def _iter_rows(self, params: Params, page_rows: int) -> Iterator[QueryReply]:
+        start = params.start
+        # records at the boundary timestamp already returned by the previous page
+        seen = 0
+        while True:
+            page = params.copy(limit=page_rows + seen, limit_from_start=True)
+            page.start = start
+            reply = self.client.query(page)
+            if not reply.keys():
+                return
+            dataset = reply.first()
+            if len(dataset) > seen:
+                yield QueryReply([QueryResult({dataset.key: dataset.slice(seen)}, reply.timezone)],
+                                 reply.timezone)
+            if len(dataset) < page.limit:
+                return
+
+            # resume from the last timestamp (Epoch + Nanoseconds) and skip the records already returned.
+            # if the whole page shares one timestamp, the next page is enlarged until it gets past it
+            timestamps = dataset.timestamps()
+            last = timestamps[-1]
+            seen = len(timestamps) - np.searchsorted(timestamps, last, side='left')
+            start = pd.Timestamp(int(last))
+
+    def query_batch(self, batch: QueryBatch, row_bytes: int = None, max_workers: int = None) -> QueryReply:
+        """
+        execute QUERY for a QueryBatch. the batch is split into several requests when the estimated
+        size of a request or of its reply approaches the max message length of the transport
+        :param batch: QueryBatch object
+        :param row_bytes: size of a record of the bucket, to estimate reply sizes
+        :param max_workers: max number of concurrent requests when the batch is split
+        :return: QueryReply object with a single result keyed by TBK
+        """
+        batches = batch.split(self.client.max_message_length, row_bytes=row_bytes)
+        if len(batches) == 1:
+            return self.client.query_batch(batches[0])
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            replies = list(executor.map(self.client.query_batch, batches))
+        return QueryReply.concat(replies)
+
+    def query_since(self, params: Params, last_epoch: int, last_nanos: int = 0) -> QueryReply:
+        """
+        execute QUERY for the records strictly after the last one already held, for incremental polling.
+        the reply can be appended to the held records with DataSet.append()
+        :param params: Params object used to query. its start is replaced
+        :param last_epoch: Epoch of the last record held
+        :param last_nanos: Nanoseconds of the last record held
+        :return: QueryReply object
+        """
+        return self.query_uncached(self.since_params(params, last_epoch, last_nanos))
+
+    @staticmethod
+    def since_params(params: Params, last_epoch: int, last_nanos: int = 0) -> Params:
+        """
+        :return: copy of the params starting strictly after the record at last_epoch and last_nanos
+        """
+        since = params.copy()
+        since.start = pd.Timestamp(int(last_epoch) * 10 ** 9 + int(last_nanos) + 1)
+        return since
+
     def sql(self, statements: Union[str, List[str]]) -> QueryReply:
         """
         execute SQL to MarketStore server
@@ -72,25 +234,183 @@ class Client:
         """
         return self.client.create(tbk=tbk, dtype=dtype, isvariablelength=isvariablelength)
 
-    def write(self, recarray: np.array, tbk: str, isvariablelength: bool = False) -> str:
+    def write(self, recarray: Records, tbk: str, isvariablelength: bool = False) -> str:
         """
         execute WRITE to MarketStore server
-        :param recarray: numpy.array object to write
+        :param recarray: numpy.array object to write, or a dict of 1-D column arrays
+            (e.g. {'Epoch': epochs, 'Bid': bids, 'Ask': asks}), which are encoded without being copied first
         :param tbk: Time Bucket Key string.
         ('{symbol name}/{time frame}/{attribute group name}' ex. 'TSLA/1Min/OHLCV' , 'AAPL/1Min/TICK' )
         :param isvariablelength: should be set true if the record content is variable-length array
         :return:
         """
-        return self.client.write(recarray, tbk, isvariablelength=isvariablelength)
+        try:
+            return self.client.write(recarray, tbk, isvariablelength=isvariablelength)
+        finally:
+            self._invalidate(tbk, recarray)
+
+    def write_many(self, datasets: Dict[str, Records], isvariablelength: bool = False) -> str:
+        """
+        execute WRITE of many time buckets in a single request.
+        time buckets with the same dtype are packed into one dataset
+        :param datasets: {tbk: numpy.array or dict of column arrays}
+            (e.g. {'TSLA/1Min/OHLCV': array1, 'AAPL/1Min/OHLCV': array2})
+        :param isvariablelength: should be set true if the record content is variable-length array
+        :return:
+        """
+        try:
+            return self.client.write_many(datasets, isvariablelength=isvariablelength)
+        finally:
+            for tbk, recarray in datasets.items():
+                self._invalidate(tbk, recarray)
+
+    def write_df(self, df: pd.DataFrame, tbk: str, dtype: List[Tuple[str, str]] = None,
+                 sort: bool = True, dedupe: bool = True, isvariablelength: bool = False) -> str:
+        """
+        execute WRITE of a DataFrame indexed by a tz-aware DatetimeIndex.
+        Epoch and Nanoseconds are derived from the index, and the columns are cast to the dtypes of the bucket.
+        :param df: DataFrame to write
+        :param tbk: Time Bucket Key string. (e.g. 'TSLA/1Min/OHLCV')
+        :param dtype: data shapes of the bucket (e.g. [("Epoch", "i8"), ("Bid", "f4"), ("Ask", "f4")] ).
+            if None, it is read from a record of the bucket, or taken from the DataFrame for a new bucket
+        :param sort: sort the rows by timestamp before sending them
+        :param dedupe: keep only the last row of each timestamp
+        :param isvariablelength: should be set true if the record content is variable-length array
+        :return:
+        """
+        if dtype is None:
+            dtype = self._bucket_dtype(tbk)
+        columns = columns_from_df(df, dtype, sort=sort, dedupe=dedupe)
+        return self.write(columns, tbk, isvariablelength=isvariablelength)
+
+    def _bucket_dtype(self, tbk: str) -> Union[np.dtype, None]:
+        symbol, timeframe, attrgroup = tbk.split('/')
+        try:
+            reply = self.client.query(Params(symbol, timeframe, attrgroup, limit=1))
+        except Exception as exc:
+            # only a missing bucket is a new bucket. on any other error, the dtype of the
+            # DataFrame could differ from the one of the bucket
+            if not _is_bucket_not_found(exc):
+                raise
+            logger.debug('%s does not exist yet: %s', tbk, exc)
+            return None
+        datasets = reply.all()
+        return next(iter(datasets.values())).dtype if datasets else None
 
     def list_symbols(self, fmt: ListSymbolsFormat = ListSymbolsFormat.SYMBOL) -> List[str]:
         return self.client.list_symbols(fmt)
 
     def destroy(self, tbk: str) -> Dict:
-        return self.client.destroy(tbk)
+        try:
+            return self.client.destroy(tbk)
+        finally:
+            self._invalidate(tbk)
+
+    def _invalidate(self, tbk: str, recarray: Records = None):
+        if self.cache is not None:
+            self.cache.invalidate(tbk)
+        if self.disk_cache is not None:
+            since = None
+            written = DataSet(recarray, tbk, 'UTC') if recarray is not None else None
+            if written is not None and len(written):
+                since = int(written.timestamps().min())
+            self.disk_cache.invalidate(tbk, since=since)
 
     def server_version(self) -> str:
         return self.client.server_version()
 
     def __repr__(self):
         return self.client.__repr__()
+
+
+class AsyncClient:
+    """
+    asyncio client with the same methods as Client. every method is a coroutine.
+    uses grpc.aio for gRPC and aiohttp for msgpack-RPC.
+    """
+
+    def __init__(self, endpoint: str = 'http://localhost:5993/rpc', grpc: bool = False, columnar: bool = False,
+                 lazy: bool = False, compression: str = None):
+        if grpc:
+            self.endpoint = grpc_endpoint(endpoint)
+            self.client = AsyncGRPCClient(self.endpoint, columnar=columnar, lazy=lazy, compression=compression)
+            return
+
+        self.endpoint = endpoint
+        self.client = AsyncJsonRpcClient(self.endpoint, columnar=columnar, lazy=lazy, compression=compression)
+
+    async def query(self, params: Params) -> QueryReply:
+        """
+        execute QUERY to MarketStore server
+        :param params: Params object used to query
+        :return: QueryReply object
+        """
+        return await self.client.query(params)
+
+    async def sql(self, statements: Union[str, List[str]]) -> QueryReply:
+        """
+        execute SQL to MarketStore server
+        :param statements: List of SQL statements in a string
+        :return: QueryReply object
+        """
+        return await self.client.sql(statements)
+
+    def _build_query(self, params: Union[Params, List[Params]]) -> Dict:
+        return self.client.build_query(params)
+
+    async def create(self, tbk: str, dtype: List[Tuple[str, str]], isvariablelength: bool = False):
+        """
+        create a new bucket
+        :param tbk: Time Bucket Key string. (e.g. TSLA/1Min/OHLCV )
+        :param  dtype: data shapes of the bucket (e.g. [("Epoch", "i8"), ("Bid", "f4"), ("Ask", "f4")] )
+        :param isvariablelength: should be set true if the record content is variable-length array
+        :return: str
+        """
+        return await self.client.create(tbk=tbk, dtype=dtype, isvariablelength=isvariablelength)
+
+    async def write(self, recarray: Records, tbk: str, isvariablelength: bool = False) -> str:
+        """
+        execute WRITE to MarketStore server
+        :param recarray: numpy.array object to write, or a dict of 1-D column arrays
+            (e.g. {'Epoch': epochs, 'Bid': bids, 'Ask': asks}), which are encoded without being copied first
+        :param tbk: Time Bucket Key string.
+        ('{symbol name}/{time frame}/{attribute group name}' ex. 'TSLA/1Min/OHLCV' , 'AAPL/1Min/TICK' )
+        :param isvariablelength: should be set true if the record content is variable-length array
+        :return:
+        """
+        return await self.client.write(recarray, tbk, isvariablelength=isvariablelength)
+
+    async def write_many(self, datasets: Dict[str, Records], isvariablelength: bool = False) -> str:
+        """
+        execute WRITE of many time buckets in a single request.
+        time buckets with the same dtype are packed into one dataset
+        :param datasets: {tbk: numpy.array or dict of column arrays}
+            (e.g. {'TSLA/1Min/OHLCV': array1, 'AAPL/1Min/OHLCV': array2})
+        :param isvariablelength: should be set true if the record content is variable-length array
+        :return:
+        """
+        return await self.client.write_many(datasets, isvariablelength=isvariablelength)
+
+    async def list_symbols(self, fmt: ListSymbolsFormat = ListSymbolsFormat.SYMBOL) -> List[str]:
+        return await self.client.list_symbols(fmt)
+
+    async def destroy(self, tbk: str) -> Dict:
+        return await self.client.destroy(tbk)
+
+    async def server_version(self) -> str:
+        return await self.client.server_version()
+
+    async def close(self):
+        """
+        close the underlying channel / HTTP session
+        """
+        await self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def __repr__(self):
+        return self.client.__repr__()
@@ -0,0 +1,356 @@
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from .params import Params, isiterable, split_params
+from .results import DataSet, QueryReply, QueryResult
+
+try:
+    import fcntl
+except ImportError:  # windows: the segments are only locked within the process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+ONE_NS = 1
+
+
+def _ns(ts: pd.Timestamp) -> int:
+    return int(ts.value)
+
+
+class Segment(object):
+    """
+    records of a time bucket stored on disk, one .npy file per column.
+    every record in [start, end] (nanoseconds since the epoch, inclusive) is in the segment.
+
+    the directory of a time bucket holds immutable versions of its segment, one directory each, and
+    a CURRENT file naming the current one. a new version is written to its own directory and made
+    current by atomically replacing CURRENT, so that readers never see a missing or half-written segment.
+    """
+    CURRENT = 'CURRENT'
+    # seconds a replaced version is kept for the readers which loaded it before it was replaced
+    GRACE = 60.0
+
+    def __init__(self, path: str, start: int, end: int, dtype: np.dtype, timezone: str):
+        self.path = path
+        self.start = start
+        self.end = end
+        self.dtype = dtype
+        self.timezone = timezone
+
+    @property
+    def version(self) -> str:
+        return os.path.basename(self.path)
+
+    @staticmethod
+    def current(path: str) -> Optional[str]:
+        """
+        :return: name of the current version in the directory of a time bucket
+        """
+        try:
+            with open(os.path.join(path, Segment.CURRENT)) as f:
+                return f.read().strip() or None
+        except (IOError, OSError):
+            return None
+
+    @classmethod
+    def load(cls, path: str) -> Optional['Segment']:
+        version = cls.current(path)
+        if version is None:
+            return None
+        try:
+            with open(os.path.join(path, version, 'meta.json')) as f:
+                meta = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+        dtype = np.dtype([(name, typ) for name, typ in meta['dtype']])
+        return cls(os.path.join(path, version), meta['start'], meta['end'], dtype, meta['timezone'])
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        return {
+            name: np.load(os.path.join(self.path, '{}.npy'.format(name)), mmap_mode='r')
+            for name in self.dtype.names
+        }
+
+    def read(self, start: int, end: int) -> Dict[str, np.ndarray]:
+        """
+        :return: memory-mapped columns of the records in [start, end]
+        """
+        columns = self.columns()
+        ts = DataSet(columns, '', self.timezone).timestamps()
+        lo = np.searchsorted(ts, start, side='left')
+        hi = np.searchsorted(ts, end, side='right')
+        return {name: col[lo:hi] for name, col in columns.items()}
+
+    @staticmethod
+    def write(path: str, start: int, end: int, columns: Dict[str, np.ndarray], timezone: str) -> 'Segment':
+        """
+        write a new version of the segment of a time bucket and make it current.
+        the caller holds the lock of the time bucket
+        """
+        os.makedirs(path, exist_ok=True)
+        # a directory of its own, so that a crashed or concurrent writer never mixes its files in
+        tmp = tempfile.mkdtemp(prefix='v', dir=path)
+        try:
+            for name, col in columns.items():
+                np.save(os.path.join(tmp, '{}.npy'.format(name)), col)
+            dtype = [(name, col.dtype.str) for name, col in columns.items()]
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({'start': start, 'end': end, 'dtype': dtype, 'timezone': timezone}, f)
+            Segment.replace(path, os.path.basename(tmp))
+        except BaseException:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+        return Segment.load(path)
+
+    @staticmethod
+    def replace(path: str, version: Optional[str]):
+        """
+        make `version` the current version of the segment, or drop the segment if None.
+        the replaced version is removed after GRACE seconds. the caller holds the lock of the time bucket
+        """
+        previous = Segment.current(path)
+        if version is None:
+            try:
+                os.remove(os.path.join(path, Segment.CURRENT))
+            except FileNotFoundError:
+                pass
+        else:
+            fd, tmp = tempfile.mkstemp(prefix='.current', dir=path)
+            with os.fdopen(fd, 'w') as f:
+                f.write(version)
+            os.replace(tmp, os.path.join(path, Segment.CURRENT))
+        if previous is not None and previous != version:
+            # the grace period starts now
+            try:
+                os.utime(os.path.join(path, previous))
+            except OSError:
+                pass
+        Segment.collect(path, keep=version)
+
+    @staticmethod
+    def collect(path: str, keep: Optional[str]):
+        deadline = time.time() - Segment.GRACE
+        for entry in os.listdir(path):
+            full = os.path.join(path, entry)
+            if entry == keep or not (entry.startswith('v') or entry.startswith('.current')):
+                continue
+            try:
+                if os.path.getmtime(full) > deadline:
+                    continue
+                if os.path.isdir(full):
+                    shutil.rmtree(full, ignore_errors=True)
+                else:
+                    os.remove(full)
+            except OSError:
+                pass
+
+
+class DiskCache(object):
+    """
+    persistent cache of closed historical records. each time bucket is stored as a
+    contiguous segment of columnar .npy files under `directory`, opened with np.memmap.
+    a query is served from disk for the part of its range covered by the segment,
+    and only the missing edges are fetched from the server.
+    records newer than `settle` before now are never stored, since they may still change.
+    the directory can be shared by several processes: each time bucket is locked with a file lock
+    while its segment is replaced, and readers keep the version they loaded.
+    """
+
+    def __init__(self, directory: str, settle: Union[str, pd.Timedelta] = '1D'):
+        """
+        :param directory: cache directory. created if it does not exist
+        :param settle: age after which records are considered immutable
+        """
+        self.directory = directory
+        self.settle = pd.Timedelta(settle)
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, tbk: str) -> str:
+        return os.path.join(self.directory, *tbk.split(':')[0].split('/'))
+
+    @contextmanager
+    def _locked(self, path: str):
+        """
+        lock the segment of a time bucket against the threads of this process and, where fcntl is
+        available, against the other processes sharing the cache directory
+        """
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(path, 'lock'), 'a') as f:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    @staticmethod
+    def cacheable(params: Union[Params, List[Params]]) -> bool:
+        """
+        only plain range queries are cached. limit, columns and functions change the records returned
+        """
+        if not isiterable(params):
+            params = [params]
+        return all(
+            p.start is not None and p.limit is None and p.columns is None and p.functions is None
+            and p.key_category is None and '*' not in p.tbk
+            for p in params
+        )
+
+    def query(self, params: Union[Params, List[Params]],
+              fetch: Callable[[List[Params]], QueryReply]) -> QueryReply:
+        """
+        serve a query from the disk cache, fetching the missing ranges with `fetch`
+        :param params: Params object or list of Params
+        :param fetch: function to query the server with a list of Params
+        :return: QueryReply with a single result keyed by TBK
+        """
+        if not self.cacheable(params):
+            return fetch(params)
+
+        now = _ns(pd.Timestamp.now(tz='UTC'))
+        cutoff = now - self.settle.value
+        shards = split_params(params, chunk_symbols=1)
+
+        plans = []
+        heads, tails = [], []
+        for shard in shards:
+            start = _ns(shard.start)
+            end = _ns(shard.end) if shard.end is not None else now
+            segment = Segment.load(self._path(shard.tbk))
+            if segment is None or end < segment.start - ONE_NS or start > segment.end + ONE_NS:
+                # nothing on disk, or not contiguous with the segment
+                plans.append((shard, start, end, segment, None))
+                heads.append(shard.copy(end=pd.Timestamp(end)))
+                continue
+            plans.append((shard, start, end, segment, (max(start, segment.start), min(end, segment.end))))
+            if start < segment.start:
+                heads.append(shard.copy(end=pd.Timestamp(segment.start - ONE_NS)))
+            if end > segment.end:
+                tails.append(shard.copy(start=pd.Timestamp(segment.end + ONE_NS), end=pd.Timestamp(end)))
+
+        head_reply = fetch(heads) if heads else None
+        tail_reply = fetch(tails) if tails else None
+        heads = head_reply.all() if head_reply is not None else {}
+        tails = tail_reply.all() if tail_reply is not None else {}
+        timezone = next((r.timezone for r in (head_reply, tail_reply) if r is not None), None)
+
+        replies = []
+        for shard, start, end, segment, hit in plans:
+            key = shard.tbk
+            head, tail = heads.get(key), tails.get(key)
+            parts = [head]
+            if hit is not None and hit[0] <= hit[1]:
+                parts.append(DataSet(segment.read(*hit), key, segment.timezone))
+                timezone = timezone or segment.timezone
+            parts.append(tail)
+            replies += [QueryReply([QueryResult({key: ds}, ds.timezone)], ds.timezone)
+                        for ds in parts if ds is not None and len(ds)]
+            self._store(key, start, end, segment, hit, head, tail, cutoff, timezone or 'UTC')
+
+        if not replies:
+            timezone = timezone or 'UTC'
+            return QueryReply([QueryResult({}, timezone)], timezone)
+        return QueryReply.concat(replies)
+
+    def _store(self, tbk: str, start: int, end: int, segment: Optional[Segment], hit: Optional[Tuple[int, int]],
+               head: Optional[DataSet], tail: Optional[DataSet], cutoff: int, timezone: str):
+        if segment is None:
+            # start a new segment from the fetched records
+            if head is not None and start <= cutoff:
+                self._write(tbk, start, min(end, cutoff), [head], None, timezone)
+            return
+        if hit is None:
+            # keep the segment contiguous. disjoint ranges are not stored
+            return
+
+        new_start = min(start, segment.start)
+        new_end = segment.end
+        parts = [head] if head is not None and start < segment.start else []
+        parts.append(None)  # records already on disk
+        if end > segment.end and segment.end < cutoff:
+            new_end = min(end, cutoff)
+            if tail is not None:
+                parts.append(tail)
+        if new_start == segment.start and new_end == segment.end:
+            return
+        self._write(tbk, new_start, new_end, parts, segment, timezone)
+
+    def _write(self, tbk: str, start: int, end: int, parts: List[Optional[DataSet]],
+               segment: Optional[Segment], timezone: str):
+        columns = []
+        for part in parts:
+            if part is None:
+                columns.append(segment.columns())
+                continue
+            ts = part.timestamps()
+            stop = np.searchsorted(ts, end, side='right')
+            columns.append({name: col[:stop] for name, col in part.columns.items()})
+        if not columns:
+            return
+        if segment is not None:
+            names = segment.dtype.names
+        else:
+            names = list(columns[0].keys())
+        merged = {name: np.concatenate([c[name] for c in columns]) for name in names}
+        path = self._path(tbk)
+        try:
+            with self._locked(path):
+                # the records were merged with the segment read before the lock was taken. if another
+                # writer replaced or dropped it since, its version wins
+                if Segment.current(path) != (segment.version if segment is not None else None):
+                    return
+                Segment.write(path, start, end, merged, timezone)
+        except (IOError, OSError) as exc:
+            logger.warning('failed to write the disk cache of %s: %s', tbk, exc)
+
+    def invalidate(self, tbk: str, since: Optional[int] = None):
+        """
+        drop the cached records of a time bucket. errors are logged rather than raised, since
+        it runs after writes whose own result or error must not be hidden
+        :param tbk: Time Bucket Key string. (e.g. "TSLA/1Min/OHLCV")
+        :param since: nanoseconds since the epoch. if set, only records at or after it are dropped
+        """
+        path = self._path(tbk)
+        if Segment.current(path) is None:
+            return
+        try:
+            with self._locked(path):
+                segment = Segment.load(path)
+                if segment is None or (since is not None and since > segment.end):
+                    return
+                if since is None or since <= segment.start:
+                    Segment.replace(path, None)
+                    return
+                columns = segment.read(segment.start, since - ONE_NS)
+                Segment.write(path, segment.start, since - ONE_NS,
+                              {name: np.array(col) for name, col in columns.items()}, segment.timezone)
+        except (IOError, OSError, ValueError) as exc:
+            logger.warning('failed to invalidate the disk cache of %s: %s', tbk, exc)
+            # a segment which could not be trimmed must not be served
+            try:
+                os.remove(os.path.join(path, Segment.CURRENT))
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            os.makedirs(self.directory, exist_ok=True)
+
+    def __repr__(self):
+        return 'DiskCache(directory={}, settle={})'.format(self.directory, self.settle)
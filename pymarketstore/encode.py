@@ -0,0 +1,167 @@
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+import six
+
+# records of a time bucket: a structured array, or a dict of 1-D column arrays of the same length
+Records = Union[np.ndarray, Dict[str, np.ndarray]]
+
+
+def column_type(dtype: np.dtype) -> str:
+    # e.g. '<f4' -> 'f4'
+    return dtype.str.replace('<', '').replace('|', '')
+
+
+def columns_of(records: Records) -> Dict[str, np.ndarray]:
+    """
+    :return: 1-D column arrays of the records, without a copy. the fields of a structured array
+        are strided views on it, which pack() copies into the outgoing buffers.
+    """
+    if isinstance(records, dict):
+        columns = {name: np.asarray(col) for name, col in six.iteritems(records)}
+        lengths = {len(col) for col in columns.values()}
+        if any(col.ndim != 1 for col in columns.values()) or len(lengths) > 1:
+            raise ValueError('columns must be 1-D arrays of the same length')
+        return columns
+    return {name: records[name] for name in records.dtype.names}
+
+
+def _buffer(col: np.ndarray) -> Union[bytes, memoryview]:
+    # a contiguous column is used in place, a strided one is copied to bytes
+    if col.flags.c_contiguous:
+        return memoryview(col).cast('B')
+    return col.tobytes()
+
+
+def _concat(cols: List[np.ndarray], as_bytes: bool) -> Union[bytes, bytearray]:
+    if as_bytes:
+        # contiguous columns are copied once into the bytes. a strided one is gathered by tobytes() first,
+        # since bytes can not be filled in place
+        return b''.join(_buffer(col) for col in cols)
+    # every column, strided or not, is copied once into a preallocated buffer
+    out = bytearray(sum(col.nbytes for col in cols))
+    offset = 0
+    for col in cols:
+        np.frombuffer(out, dtype=col.dtype, count=len(col), offset=offset)[:] = col
+        offset += col.nbytes
+    return out
+
+
+def _schema(columns: Dict[str, np.ndarray]) -> Tuple:
+    return tuple((name, col.dtype.str) for name, col in six.iteritems(columns))
+
+
+class PackedDataset(object):
+    """
+    columns of one or more time buckets sharing the same schema, laid out as a
+    NumpyMultiDataset: the records of each time bucket are the [start_index, start_index + length)
+    rows of the columns.
+    """
+
+    def __init__(self, names: List[str], types: List[str], data: List[Union[bytes, bytearray, memoryview]],
+                 length: int, start_index: Dict[str, int], lengths: Dict[str, int]):
+        self.names = names
+        self.types = types
+        self.data = data
+        self.length = length
+        self.start_index = start_index
+        self.lengths = lengths
+
+
+def pack(datasets: Dict[str, Records], as_bytes: bool = True) -> List[PackedDataset]:
+    """
+    pack records of many time buckets into as few datasets as possible.
+    time buckets with the same schema share one dataset.
+    each column is encoded straight from the buffers of the column arrays.
+    :param datasets: {tbk: structured numpy array or dict of 1-D column arrays}
+    :param as_bytes: if False, the column of a single contiguous array is returned as a
+        memoryview on it instead of being copied to bytes, and the columns of several arrays are
+        copied into a bytearray (e.g. for msgpack, which copies them into the message).
+    :return: list of PackedDataset, one per distinct schema
+    """
+    groups: Dict[Tuple, Dict[str, Dict[str, np.ndarray]]] = {}
+    for tbk, records in six.iteritems(datasets):
+        columns = columns_of(records)
+        groups.setdefault(_schema(columns), {})[tbk] = columns
+
+    packed = []
+    for schema, group in six.iteritems(groups):
+        start_index, lengths = {}, {}
+        offset = 0
+        for tbk, columns in six.iteritems(group):
+            length = len(next(iter(columns.values()))) if columns else 0
+            start_index[tbk] = offset
+            lengths[tbk] = length
+            offset += length
+
+        data = []
+        for name, _ in schema:
+            cols = [columns[name] for columns in group.values()]
+            if len(cols) == 1:
+                # a single copy straight from the (possibly strided) column, or none at all
+                data.append(cols[0].tobytes() if as_bytes else _buffer(cols[0]))
+            else:
+                data.append(_concat(cols, as_bytes))
+        packed.append(PackedDataset(
+            names=[name for name, _ in schema],
+            types=[column_type(np.dtype(typ)) for _, typ in schema],
+            data=data,
+            length=offset,
+            start_index=start_index,
+            lengths=lengths,
+        ))
+    return packed
+
+
+def columns_from_df(df: pd.DataFrame, dtype: np.dtype = None, sort: bool = True,
+                    dedupe: bool = True) -> Dict[str, np.ndarray]:
+    """
+    convert a DataFrame indexed by a DatetimeIndex to write columns in vectorized passes.
+    Epoch (int64 seconds) and Nanoseconds (int32) are split from the index. a tz-naive index is taken as UTC.
+    :param df: DataFrame indexed by a DatetimeIndex
+    :param dtype: dtype of the bucket. the columns are cast to it, and Nanoseconds is only written
+        if the bucket has it. if None, the dtypes of the DataFrame are kept and Nanoseconds is written
+        when the index has sub-second timestamps
+    :param sort: sort the rows by timestamp (stable)
+    :param dedupe: keep only the last row of each timestamp. implies sort
+    :return: dict of 1-D column arrays
+    """
+    if not isinstance(df.index, pd.DatetimeIndex):
+        raise ValueError('the DataFrame must be indexed by a DatetimeIndex')
+    # UTC nanoseconds. DatetimeIndex.as_unit requires pandas 2
+    ns = df.index.values.astype('M8[ns]', copy=False).view('i8')
+    rows = None
+    if (sort or dedupe) and len(ns) and not (np.diff(ns) >= 0).all():
+        rows = np.argsort(ns, kind='stable')
+        ns = ns[rows]
+    if dedupe and len(ns):
+        # the last row of each run of equal timestamps
+        keep = np.empty(len(ns), dtype=bool)
+        keep[-1] = True
+        np.not_equal(ns[1:], ns[:-1], out=keep[:-1])
+        if not keep.all():
+            ns = ns[keep]
+            rows = np.flatnonzero(keep) if rows is None else rows[keep]
+
+    epochs, nanos = np.divmod(ns, 10 ** 9)
+    if dtype is None:
+        names = [name for name in df.columns if name not in ('Epoch', 'Nanoseconds')]
+        dtype = np.dtype(
+            [('Epoch', 'i8')]
+            + ([('Nanoseconds', 'i4')] if nanos.any() else [])
+            + [(name, df[name].to_numpy().dtype) for name in names])
+    dtype = np.dtype(dtype)
+
+    columns = {}
+    for name in dtype.names:
+        if name == dtype.names[0]:
+            columns[name] = epochs.astype(dtype[name], copy=False)
+        elif name == 'Nanoseconds':
+            columns[name] = nanos.astype(dtype[name])
+        elif name not in df.columns:
+            raise ValueError('column {} of the bucket is missing in the DataFrame'.format(name))
+        else:
+            col = df[name].to_numpy(dtype=dtype[name])
+            columns[name] = col if rows is None else col[rows]
+    return columns
@@ -1,46 +1,239 @@
 from __future__ import absolute_import
 
+import itertools
 import logging
+import threading
+from concurrent.futures import Future
 
 import grpc
 
 import pymarketstore.proto.marketstore_pb2 as proto
 import pymarketstore.proto.marketstore_pb2_grpc as gp
+from .batch import QueryBatch
+from .encode import Records, pack
 from .params import Params, ListSymbolsFormat
 from .results import QueryReply
 
-import numpy as np
-from typing import List, Union, Tuple
+from typing import Dict, List, Union, Tuple
 
 logger = logging.getLogger(__name__)
 
+MAX_MESSAGE_LENGTH = 1 * 1024 ** 3  # 1GB
+
+COMPRESSIONS = {
+    None: grpc.Compression.NoCompression,
+    'gzip': grpc.Compression.Gzip,
+    'deflate': grpc.Compression.Deflate,
+}
+
+
+def channel_compression(compression: str = None) -> grpc.Compression:
+    if compression not in COMPRESSIONS:
+        raise ValueError('unsupported compression: {}. use one of gzip, deflate'.format(compression))
+    return COMPRESSIONS[compression]
+
 
 def isiterable(something):
     return isinstance(something, (list, tuple, set))
 
 
+def channel_options(max_message_length: int, keepalive_ms: int = None,
+                    keepalive_timeout_ms: int = None) -> List[Tuple[str, int]]:
+    # set max message sizes
+    options = [
+        ('grpc.max_send_message_length', max_message_length),
+        ('grpc.max_receive_message_length', max_message_length),
+    ]
+    if keepalive_ms is not None:
+        # ping idle connections so that they are not dropped by the server or load balancers
+        options += [
+            ('grpc.keepalive_time_ms', keepalive_ms),
+            ('grpc.keepalive_permit_without_calls', 1),
+            ('grpc.http2.max_pings_without_data', 0),
+        ]
+    if keepalive_timeout_ms is not None:
+        options.append(('grpc.keepalive_timeout_ms', keepalive_timeout_ms))
+    return options
+
+
+class ChannelPool(object):
+    """
+    channels to the same endpoint, each over its own HTTP/2 connection, and a stub per channel.
+    calls are spread over the channels either in turn (round_robin) or to the channel with
+    the fewest calls in flight (least_loaded).
+    """
+    BALANCES = ('round_robin', 'least_loaded')
+
+    def __init__(self, endpoint: str, size: int = 1, options: List[Tuple[str, int]] = None,
+                 compression: str = None, balance: str = 'round_robin'):
+        if size < 1:
+            raise ValueError('pool size must be positive: {}'.format(size))
+        if balance not in self.BALANCES:
+            raise ValueError('unsupported balance: {}. use one of {}'.format(balance, ', '.join(self.BALANCES)))
+        options = list(options or [])
+        if size > 1:
+            # channels with the same target and options share their connection otherwise
+            options.append(('grpc.use_local_subchannel_pool', 1))
+        self.balance = balance
+        self.channels = [
+            grpc.insecure_channel(endpoint, options=options, compression=channel_compression(compression))
+            for _ in range(size)
+        ]
+        self.stubs = [gp.MarketstoreStub(channel) for channel in self.channels]
+        self._turns = itertools.count()
+        self._in_flight = [0] * size
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def warm_up(self, timeout: float = None):
+        """
+        connect all the channels now instead of on their first call
+        :param timeout: seconds to wait for each channel. raises grpc.FutureTimeoutError on expiry
+        """
+        for channel in self.channels:
+            grpc.channel_ready_future(channel).result(timeout=timeout)
+
+    def _acquire(self) -> int:
+        if len(self.stubs) == 1:
+            return 0
+        if self.balance == 'round_robin':
+            return next(self._turns) % len(self.stubs)
+
+        with self._lock:
+            idx = min(range(len(self._in_flight)), key=self._in_flight.__getitem__)
+            self._in_flight[idx] += 1
+        return idx
+
+    def _release(self, idx: int):
+        if len(self.stubs) > 1 and self.balance == 'least_loaded':
+            with self._lock:
+                self._in_flight[idx] -= 1
+
+    def call(self, method: str, request):
+        idx = self._acquire()
+        try:
+            return getattr(self.stubs[idx], method)(request)
+        finally:
+            self._release(idx)
+
+    def future(self, method: str, request) -> grpc.Future:
+        """
+        start a call without blocking
+        :return: grpc.Future of the reply. its cancel() cancels the call
+        """
+        idx = self._acquire()
+        try:
+            future = getattr(self.stubs[idx], method).future(request)
+        except Exception:
+            self._release(idx)
+            raise
+        future.add_done_callback(lambda _: self._release(idx))
+        return future
+
+    def in_flight(self) -> List[int]:
+        with self._lock:
+            return list(self._in_flight)
+
+    def close(self):
+        for channel in self.channels:
+            channel.close()
+
+
 class GRPCClient(object):
+    max_message_length = MAX_MESSAGE_LENGTH
 
-    def __init__(self, endpoint: str = 'localhost:5995'):
+    def __init__(self, endpoint: str = 'localhost:5995', columnar: bool = False, lazy: bool = False,
+                 compression: str = None, pool_size: int = 1, balance: str = 'round_robin',
+                 keepalive_ms: int = None, keepalive_timeout_ms: int = None,
+                 warm_up: bool = False, warm_up_timeout: float = None):
+        """
+        :param compression: "gzip" or "deflate" to compress the messages of the channel.
+            the server compresses its replies with the algorithm when it supports it
+        :param pool_size: number of channels (HTTP/2 connections) the calls are spread over
+        :param balance: "round_robin" or "least_loaded" (the channel with the fewest calls in flight)
+        :param keepalive_ms: interval of the keepalive pings of idle connections. None for no pings
+        :param keepalive_timeout_ms: time to wait for a keepalive ping to be acknowledged
+        :param warm_up: connect the channels in the constructor rather than on their first call
+        :param warm_up_timeout: seconds to wait for each channel to connect when warming up
+        """
         self.endpoint = endpoint
-        # set max message sizes
-        options = [
-            ('grpc.max_send_message_length', 1 * 1024 ** 3),  # 1GB
-            ('grpc.max_receive_message_length', 1 * 1024 ** 3),  # 1GB
-        ]
-        self.channel = grpc.insecure_channel(endpoint, options=options)
-        self.stub = gp.MarketstoreStub(self.channel)
+        self.columnar = columnar
+        self.lazy = lazy
+        self.compression = compression
+        options = channel_options(self.max_message_length, keepalive_ms, keepalive_timeout_ms)
+        self.pool = ChannelPool(endpoint, pool_size, options=options, compression=compression, balance=balance)
+        # the first channel, for compatibility
+        self.channel = self.pool.channels[0]
+        self.stub = self.pool.stubs[0]
+        if warm_up:
+            self.pool.warm_up(warm_up_timeout)
+
+    def _call(self, method: str, request):
+        return self.pool.call(method, request)
 
     def query(self, params: Union[Params, List[Params]]) -> QueryReply:
         if not isiterable(params):
             params = [params]
         reqs = self.build_query(params)
 
-        reply = self.stub.Query(reqs)
+        reply = self._call('Query', reqs)
+
+        return QueryReply.from_grpc_response(reply, columnar=self.columnar, lazy=self.lazy)
 
-        return QueryReply.from_grpc_response(reply)
+    def query_future(self, params: Union[Params, List[Params]]) -> Future:
+        """
+        start QUERY without blocking a thread
+        :return: concurrent.futures.Future of the QueryReply. cancelling it cancels the RPC
+        """
+        if not isiterable(params):
+            params = [params]
+        call = self.pool.future('Query', self.build_query(params))
+        future = Future()
+
+        def cancel(f: Future):
+            if f.cancelled():
+                call.cancel()
+
+        def done(c: grpc.Future):
+            # the future can no longer be cancelled once the reply is decoded into it
+            if not future.set_running_or_notify_cancel():
+                return
+            try:
+                future.set_result(QueryReply.from_grpc_response(c.result(), columnar=self.columnar, lazy=self.lazy))
+            except BaseException as exc:
+                future.set_exception(exc)
+
+        future.add_done_callback(cancel)
+        call.add_done_callback(done)
+        return future
+
+    def query_batch(self, batch: QueryBatch) -> QueryReply:
+        reqs = self.build_query_batch(batch)
+        reply = self._call('Query', reqs)
+        return QueryReply.from_grpc_response(reply, columnar=self.columnar, lazy=self.lazy)
 
     def sql(self, statements: Union[str, List[str]]) -> QueryReply:
+        reqs = self.build_sql(statements)
+        reply = self._call('Query', reqs)
+        return QueryReply.from_grpc_response(reply, columnar=self.columnar, lazy=self.lazy)
+
+    def create(self, tbk: str, dtype: List[Tuple[str, str]],
+               isvariablelength: bool = False) -> proto.MultiServerResponse:
+        req = self.build_create(tbk, dtype, isvariablelength=isvariablelength)
+        return self._call('Create', req)
+
+    def write(self, recarray: Records, tbk: str, isvariablelength: bool = False) -> proto.MultiServerResponse:
+        req = self.build_write(recarray, tbk, isvariablelength=isvariablelength)
+        return self._call('Write', req)
+
+    def write_many(self, datasets: Dict[str, Records],
+                   isvariablelength: bool = False) -> proto.MultiServerResponse:
+        req = self.build_write_many(datasets, isvariablelength=isvariablelength)
+        return self._call('Write', req)
+
+    def build_sql(self, statements: Union[str, List[str]]) -> proto.MultiQueryRequest:
         if not isiterable(statements):
             statements = [statements]
 
@@ -52,15 +245,12 @@ class GRPCClient(object):
                 sql_statement=statement,
             )
             reqs.requests.append(req)
+        return reqs
 
-        reply = self.stub.Query(reqs)
-        return QueryReply.from_grpc_response(reply)
-
-    def create(self, tbk: str, dtype: List[Tuple[str, str]],
-               isvariablelength: bool = False) -> proto.MultiServerResponse:
+    def build_create(self, tbk: str, dtype: List[Tuple[str, str]],
+                     isvariablelength: bool = False) -> proto.MultiCreateRequest:
         # dtype: e.g. [('Epoch', 'i8'), ('Ask', 'f4')]
-
-        req = proto.MultiCreateRequest(requests=[
+        return proto.MultiCreateRequest(requests=[
             proto.CreateRequest(
                 key="{}:Symbol/Timeframe/AttributeGroup".format(tbk),
                 data_shapes=[proto.DataShape(name=name, type=typ) for name, typ in dtype],
@@ -68,41 +258,30 @@ class GRPCClient(object):
             )
         ])
 
-        return self.stub.Create(req)
-
-    def write(self, recarray: np.array, tbk: str, isvariablelength: bool = False) -> proto.MultiServerResponse:
-        types = [
-            recarray.dtype[name].str.replace('<', '').replace('|', '')
-            for name in recarray.dtype.names
-        ]
-        names = recarray.dtype.names
-        data = [
-            bytes(memoryview(recarray[name]))
-            for name in recarray.dtype.names
-        ]
-        length = len(recarray)
-        start_index = {tbk: 0}
-        lengths = {tbk: len(recarray)}
+    def build_write(self, recarray: Records, tbk: str, isvariablelength: bool = False) -> proto.MultiWriteRequest:
+        return self.build_write_many({tbk: recarray}, isvariablelength=isvariablelength)
 
-        req = proto.MultiWriteRequest(requests=[
+    def build_write_many(self, datasets: Dict[str, Records],
+                         isvariablelength: bool = False) -> proto.MultiWriteRequest:
+        # one WriteRequest per distinct schema, holding all the time buckets of that schema
+        return proto.MultiWriteRequest(requests=[
             proto.WriteRequest(
                 data=proto.NumpyMultiDataset(
                     data=proto.NumpyDataset(
-                        column_types=types,
-                        column_names=names,
-                        column_data=data,
-                        length=length,
+                        column_types=packed.types,
+                        column_names=packed.names,
+                        column_data=packed.data,
+                        length=packed.length,
                         # data_shapes = [],
                     ),
-                    start_index=start_index,
-                    lengths=lengths,
+                    start_index=packed.start_index,
+                    lengths=packed.lengths,
                 ),
                 is_variable_length=isvariablelength,
             )
+            for packed in pack(datasets)
         ])
 
-        return self.stub.Write(req)
-
     def build_query(self, params: Union[Params, List[Params]]) -> proto.MultiQueryRequest:
         reqs = proto.MultiQueryRequest(requests=[])
         if not isiterable(params):
@@ -115,23 +294,20 @@ class GRPCClient(object):
             if param.key_category is not None:
                 req.key_category = param.key_category
             if param.start is not None:
-                req.epoch_start = int(param.start.value / (10 ** 9))
+                # divmod keeps the nanoseconds exact, where a float division rounds them into the seconds
+                req.epoch_start, start_nanosec = divmod(param.start.value, 10 ** 9)
 
                 # support nanosec
-                start_nanosec = int(param.start.value % (10 ** 9))
                 if start_nanosec != 0:
                     req.epoch_start_nanos = start_nanosec
 
             if param.end is not None:
-                req.epoch_end = int(param.end.value / (10 ** 9))
+                req.epoch_end, end_nanosec = divmod(param.end.value, 10 ** 9)
 
                 # support nanosec
-                end_nanosec = int(param.end.value % (10 ** 9))
                 if end_nanosec != 0:
                     req.epoch_end_nanos = end_nanosec
 
-            if param.end is not None:
-                req.epoch_end = int(param.end.value / (10 ** 9))
             if param.limit is not None:
                 req.limit_record_count = int(param.limit)
             if param.limit_from_start is not None:
@@ -143,13 +319,39 @@ class GRPCClient(object):
             reqs.requests.append(req)
         return reqs
 
+    def build_query_batch(self, batch: QueryBatch) -> proto.MultiQueryRequest:
+        start_secs, start_nanos, has_start, end_secs, end_nanos, has_end = batch.epochs()
+        common = {}
+        if batch.limit is not None:
+            common['limit_record_count'] = int(batch.limit)
+        if batch.limit_from_start is not None:
+            common['limit_from_start'] = bool(batch.limit_from_start)
+        if batch.functions is not None:
+            common['functions'] = batch.functions
+        if batch.columns is not None:
+            common['columns'] = batch.columns
+
+        reqs = []
+        for i, destination in enumerate(batch.destinations()):
+            req = proto.QueryRequest(destination=destination, **common)
+            if has_start is not None and has_start[i]:
+                req.epoch_start = start_secs[i]
+                if start_nanos[i] != 0:
+                    req.epoch_start_nanos = start_nanos[i]
+            if has_end is not None and has_end[i]:
+                req.epoch_end = end_secs[i]
+                if end_nanos[i] != 0:
+                    req.epoch_end_nanos = end_nanos[i]
+            reqs.append(req)
+        return proto.MultiQueryRequest(requests=reqs)
+
     def list_symbols(self, fmt: ListSymbolsFormat = ListSymbolsFormat.SYMBOL) -> List[str]:
         if fmt == ListSymbolsFormat.TBK:
             req_format = proto.ListSymbolsRequest.Format.TIME_BUCKET_KEY
         else:
             req_format = proto.ListSymbolsRequest.Format.SYMBOL
 
-        resp = self.stub.ListSymbols(proto.ListSymbolsRequest(format=req_format))
+        resp = self._call('ListSymbols', proto.ListSymbolsRequest(format=req_format))
 
         if resp is None:
             return []
@@ -162,11 +364,95 @@ class GRPCClient(object):
         :param tbk: Time Bucket Key Name (i.e. "TEST/1Min/Tick" )
         """
         req = proto.MultiKeyRequest(requests=[proto.KeyRequest(key=tbk)])
-        return self.stub.Destroy(req)
+        return self._call('Destroy', req)
 
     def server_version(self) -> str:
-        resp = self.stub.ServerVersion(proto.ServerVersionRequest())
+        resp = self._call('ServerVersion', proto.ServerVersionRequest())
         return resp.version
 
     def __repr__(self):
         return 'GRPCClient("{}")'.format(self.endpoint)
+
+
+class AsyncGRPCClient(GRPCClient):
+    """
+    asyncio version of GRPCClient on top of grpc.aio.
+    Requests are built and replies are decoded by the same code as GRPCClient.
+    The channel is opened on first use so that it binds to the running event loop.
+    """
+
+    def __init__(self, endpoint: str = 'localhost:5995', columnar: bool = False, lazy: bool = False,
+                 compression: str = None):
+        if not hasattr(grpc, 'aio'):
+            raise ImportError('grpcio>=1.32.0 is required for the asyncio gRPC client')
+        self.endpoint = endpoint
+        self.columnar = columnar
+        self.lazy = lazy
+        self.compression = compression
+        channel_compression(compression)
+        self.channel = None
+        self._stub = None
+
+    @property
+    def stub(self) -> gp.MarketstoreStub:
+        if self._stub is None:
+            options = channel_options(self.max_message_length)
+            self.channel = grpc.aio.insecure_channel(self.endpoint, options=options,
+                                                     compression=channel_compression(self.compression))
+            self._stub = gp.MarketstoreStub(self.channel)
+        return self._stub
+
+    async def query(self, params: Union[Params, List[Params]]) -> QueryReply:
+        reqs = self.build_query(params)
+        reply = await self.stub.Query(reqs)
+        return QueryReply.from_grpc_response(reply, columnar=self.columnar, lazy=self.lazy)
+
+    async def sql(self, statements: Union[str, List[str]]) -> QueryReply:
+        reqs = self.build_sql(statements)
+        reply = await self.stub.Query(reqs)
+        return QueryReply.from_grpc_response(reply, columnar=self.columnar, lazy=self.lazy)
+
+    async def create(self, tbk: str, dtype: List[Tuple[str, str]],
+                     isvariablelength: bool = False) -> proto.MultiServerResponse:
+        req = self.build_create(tbk, dtype, isvariablelength=isvariablelength)
+        return await self.stub.Create(req)
+
+    async def write(self, recarray: Records, tbk: str,
+                    isvariablelength: bool = False) -> proto.MultiServerResponse:
+        req = self.build_write(recarray, tbk, isvariablelength=isvariablelength)
+        return await self.stub.Write(req)
+
+    async def write_many(self, datasets: Dict[str, Records],
+                         isvariablelength: bool = False) -> proto.MultiServerResponse:
+        req = self.build_write_many(datasets, isvariablelength=isvariablelength)
+        return await self.stub.Write(req)
+
+    async def list_symbols(self, fmt: ListSymbolsFormat = ListSymbolsFormat.SYMBOL) -> List[str]:
+        if fmt == ListSymbolsFormat.TBK:
+            req_format = proto.ListSymbolsRequest.Format.TIME_BUCKET_KEY
+        else:
+            req_format = proto.ListSymbolsRequest.Format.SYMBOL
+
+        resp = await self.stub.ListSymbols(proto.ListSymbolsRequest(format=req_format))
+
+        if resp is None:
+            return []
+
+        return resp.results
+
+    async def destroy(self, tbk: str) -> proto.MultiServerResponse:
+        req = proto.MultiKeyRequest(requests=[proto.KeyRequest(key=tbk)])
+        return await self.stub.Destroy(req)
+
+    async def server_version(self) -> str:
+        resp = await self.stub.ServerVersion(proto.ServerVersionRequest())
+        return resp.version
+
+    async def close(self):
+        if self.channel is not None:
+            await self.channel.close()
+            self.channel = None
+            self._stub = None
+
+    def __repr__(self):
+        return 'AsyncGRPCClient("{}")'.format(self.endpoint)
@@ -0,0 +1,299 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+import grpc
+import requests
+
+from .client import Client
+from .grpc_client import GRPCClient
+from .params import Params
+from .results import QueryReply
+
+logger = logging.getLogger(__name__)
+
+
+def is_unavailable(exc: Exception) -> bool:
+    """
+    :return: True if the error means the node could not serve the call (as opposed to an error in the call),
+        so that it may be retried on another node
+    """
+    if isinstance(exc, (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                        requests.exceptions.ChunkedEncodingError)):
+        return True
+    if isinstance(exc, grpc.RpcError) and hasattr(exc, 'code'):
+        return exc.code() in (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED)
+    return False
+
+
+def query_future(node: Any, params: Union[Params, List[Params]]) -> Optional[Future]:
+    """
+    start a query on a gRPC node without blocking, so that it can be cancelled when it loses a hedge
+    :return: Future of the QueryReply, or None if the node does not support it (msgpack-RPC, or a Client
+        with a cache, whose queries go through the cache)
+    """
+    if not isinstance(node, Client) or not isinstance(getattr(node, 'client', None), GRPCClient):
+        return None
+    if node.cache is not None or node.disk_cache is not None:
+        return None
+    return node.client.query_future(params)
+
+
+class LatencyHistogram(object):
+    """
+    histogram of call latencies in log-spaced buckets, from 100us to about 2 minutes with a 10% resolution
+    """
+    MIN = 1e-4
+    GROWTH = 1.1
+
+    def __init__(self):
+        size = int(math.log(1200.0 / self.MIN) / math.log(self.GROWTH)) + 1
+        self.bounds = [self.MIN * self.GROWTH ** i for i in range(size)]
+        self.counts = [0] * (size + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        idx = bisect.bisect_left(self.bounds, seconds)
+        with self._lock:
+            self.counts[idx] += 1
+            self.count += 1
+            self.total += seconds
+            self.max = max(self.max, seconds)
+
+    def percentile(self, q: float) -> float:
+        """
+        :param q: percentile in [0, 100]
+        :return: upper bound of the bucket holding the percentile, in seconds. 0 if nothing was recorded
+        """
+        with self._lock:
+            if not self.count:
+                return 0.0
+            rank = max(1, int(math.ceil(q / 100.0 * self.count)))
+            seen = 0
+            for idx, count in enumerate(self.counts):
+                seen += count
+                if seen >= rank:
+                    return self.bounds[idx] if idx < len(self.bounds) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+            'max': self.max,
+        }
+
+    def __repr__(self):
+        return 'LatencyHistogram({})'.format(self.snapshot())
+
+
+class HedgePolicy(object):
+    """
+    when to send a duplicate of a read to another node: after the `percentile` latency of the node
+    the read was sent to, clamped to [min_delay, max_delay]. until a node has `min_samples` latencies,
+    `initial_delay` is used.
+    """
+
+    def __init__(self, percentile: float = 95.0, min_delay: float = 0.005, max_delay: float = 1.0,
+                 initial_delay: float = 0.1, min_samples: int = 20, max_hedges: int = 1):
+        """
+        :param percentile: percentile of the node latency after which a duplicate is sent
+        :param min_delay: min delay in seconds
+        :param max_delay: max delay in seconds
+        :param initial_delay: delay in seconds while the histogram of the node has too few samples
+        :param min_samples: number of latencies of a node before its percentile is used
+        :param max_hedges: max number of duplicates of a read
+        """
+        self.percentile = percentile
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.initial_delay = initial_delay
+        self.min_samples = min_samples
+        self.max_hedges = max_hedges
+
+    def delay(self, histogram: LatencyHistogram) -> float:
+        if histogram.count < self.min_samples:
+            return self.initial_delay
+        return min(self.max_delay, max(self.min_delay, histogram.percentile(self.percentile)))
+
+    def __repr__(self):
+        return 'HedgePolicy(percentile={}, min_delay={}, max_delay={}, max_hedges={})'.format(
+            self.percentile, self.min_delay, self.max_delay, self.max_hedges)
+
+
+class Hedger(object):
+    """
+    runs reads on equivalent nodes with hedging and failover, and keeps a latency histogram per node
+    """
+
+    def __init__(self, policy: HedgePolicy = None, max_workers: int = None):
+        """
+        :param policy: HedgePolicy
+        :param max_workers: max number of blocking reads in flight, the duplicates and the losers still
+            running included. it should cover the expected concurrency, since reads waiting for a thread
+            hedge more. defaults to 64
+        """
+        self.policy = policy or HedgePolicy()
+        self._histograms: Dict[str, LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers or 64)
+
+    def histogram(self, key: str) -> LatencyHistogram:
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram()
+            return histogram
+
+    def latencies(self) -> Dict[str, Dict[str, float]]:
+        with self._lock:
+            histograms = dict(self._histograms)
+        return {key: histogram.snapshot() for key, histogram in histograms.items()}
+
+    def _timed(self, key: str, node: Any, call: Callable[[Any], Any]) -> Any:
+        # timed from the start of the call rather than its submission, so that time spent waiting
+        # for a thread is not recorded as latency of the node
+        start = time.monotonic()
+        result = call(node)
+        # losers are recorded as well, so that the histograms are not biased to the fast replies
+        self.histogram(key).record(time.monotonic() - start)
+        return result
+
+    def _launch(self, key: str, node: Any, call: Callable[[Any], Any],
+                start: Callable[[Any], Optional[Future]] = None) -> Future:
+        future = start(node) if start is not None else None
+        if future is None:
+            return self._executor.submit(self._timed, key, node, call)
+
+        launched = time.monotonic()
+
+        def record(f: Future):
+            # a cancelled loser is not recorded, since it is only known to be slower than the winner
+            if not f.cancelled() and f.exception() is None:
+                self.histogram(key).record(time.monotonic() - launched)
+
+        future.add_done_callback(record)
+        return future
+
+    def call(self, nodes: Sequence[Tuple[str, Any]], call: Callable[[Any], Any],
+             start: Callable[[Any], Optional[Future]] = None) -> Any:
+        """
+        send the call to the first node. if it has not answered after the hedging delay, send a duplicate
+        to the next node, and return the first reply. a node which is unavailable is failed over immediately.
+        :param nodes: (key, node) of the equivalent nodes in order of preference
+        :param call: blocking function of a node, run on the thread pool
+        :param start: function of a node starting the call without blocking, used instead of `call`
+            when it returns a Future. cancelling the Future must cancel the call, so that losers are cancelled
+        :return: the first reply
+        """
+        pending: Dict[Future, str] = {}
+        error = None
+        hedges = 0
+        idx = 0
+
+        def launch():
+            key, node = nodes[idx]
+            pending[self._launch(key, node, call, start)] = key
+
+        launch()
+        idx += 1
+        try:
+            while pending:
+                can_hedge = idx < len(nodes) and hedges < self.policy.max_hedges
+                timeout = self.policy.delay(self.histogram(nodes[idx - 1][0])) if can_hedge else None
+                done, _ = wait(list(pending), timeout=timeout, return_when=FIRST_COMPLETED)
+                if not done:
+                    logger.debug('hedging a read of %s to %s', nodes[idx - 1][0], nodes[idx][0])
+                    hedges += 1
+                    launch()
+                    idx += 1
+                    continue
+                for future in done:
+                    key = pending.pop(future)
+                    exc = future.exception()
+                    if exc is None:
+                        return future.result()
+                    if not is_unavailable(exc):
+                        raise exc
+                    logger.warning('%s is unavailable: %s', key, exc)
+                    error = exc
+                if not pending and idx < len(nodes):
+                    # fail over
+                    launch()
+                    idx += 1
+            raise error
+        finally:
+            # losers started with `start` are cancelled. the others are dropped, and only cancelled
+            # if they are still waiting for a thread, since a blocking request cannot be taken back
+            for future in pending:
+                future.cancel()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+
+class HedgedClient(object):
+    """
+    client of equivalent nodes (e.g. read replicas) which hedges its reads: a query which has not
+    been answered within the hedging delay of its node is sent again to the next node, and the first
+    reply wins. nodes are tried in turn, and the latency histogram of each node is kept.
+    """
+
+    def __init__(self, endpoints: Sequence[Union[str, Client]], policy: HedgePolicy = None,
+                 max_workers: int = None, **client_options):
+        """
+        :param endpoints: equivalent nodes, as Client objects or endpoints
+        :param policy: HedgePolicy. hedges after the p95 latency of the node by default
+        :param max_workers: max number of blocking reads in flight. see Hedger
+        :param client_options: arguments of the Client created for each endpoint (e.g. grpc=True)
+        """
+        if not endpoints:
+            raise ValueError('at least one endpoint is required')
+        self.nodes = [node if isinstance(node, Client) else Client(node, **client_options) for node in endpoints]
+        self.keys = [node.endpoint for node in self.nodes]
+        self.hedger = Hedger(policy, max_workers=max_workers)
+        self._turn = 0
+        self._lock = threading.Lock()
+
+    @property
+    def policy(self) -> HedgePolicy:
+        return self.hedger.policy
+
+    def _order(self) -> List[Tuple[str, Client]]:
+        with self._lock:
+            start = self._turn
+            self._turn = (self._turn + 1) % len(self.nodes)
+        order = [(start + i) % len(self.nodes) for i in range(len(self.nodes))]
+        return [(self.keys[idx], self.nodes[idx]) for idx in order]
+
+    def query(self, params: Union[Params, List[Params]]) -> QueryReply:
+        return self.hedger.call(self._order(), lambda node: node.query(params),
+                                start=lambda node: query_future(node, params))
+
+    def sql(self, statements: Union[str, List[str]]) -> QueryReply:
+        return self.hedger.call(self._order(), lambda node: node.sql(statements))
+
+    def histogram(self, endpoint: str) -> LatencyHistogram:
+        return self.hedger.histogram(endpoint)
+
+    def latencies(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: {endpoint: {'count', 'mean', 'p50', 'p90', 'p99', 'max'}} latencies in seconds
+        """
+        return self.hedger.latencies()
+
+    def close(self):
+        self.hedger.close()
+
+    def __repr__(self):
+        return 'HedgedClient(endpoints={}, policy={})'.format(self.keys, self.policy)
@@ -1,28 +1,109 @@
+import gzip
+import itertools
 import json
+import threading
+import zlib
+
 import msgpack
 import requests
-from typing import Dict, Union
+import requests.adapters
+import urllib3
+from typing import Dict, Tuple, Union
+
+from . import msgpack_view
+
+try:
+    import aiohttp
+except ImportError:  # optional dependency for AsyncMsgpackRpcClient
+    aiohttp = None
+
+
+# level 1 gives most of the size reduction on float columns at a fraction of the CPU of the default level
+COMPRESSORS = {
+    'gzip': lambda data: gzip.compress(data, compresslevel=1),
+    'deflate': lambda data: zlib.compress(data, 1),
+}
+
+
+def request_headers(mimetype: str, compression: str = None) -> Dict[str, str]:
+    headers = {"Content-Type": mimetype}
+    if compression is not None:
+        headers["Content-Encoding"] = compression
+        headers["Accept-Encoding"] = compression
+    return headers
+
+
+def check_compression(compression: str = None):
+    if compression is not None and compression not in COMPRESSORS:
+        raise ValueError('unsupported compression: {}. use one of gzip, deflate'.format(compression))
+
+
+def compress_body(data: bytes, compression: str = None) -> bytes:
+    """
+    :param compression: None, "gzip" or "deflate". replies are decompressed by the HTTP client
+        according to their Content-Encoding
+    """
+    if compression is None:
+        return data
+    return COMPRESSORS[compression](data)
+
+
+def _loads(method: str, body: Union[bytes, bytearray]) -> Dict:
+    # the bin values (the column data) of query replies are decoded as memoryviews of the body.
+    # the pure-Python decoder is slower than msgpack's on replies made of many small values, so it
+    # is used for query replies only
+    if method == 'DataService.Query':
+        return msgpack_view.loads(body)
+    return msgpack.loads(body)
 
 
 class MsgpackRpcClient(object):
+    """
+    msgpack-RPC client over HTTP. safe to share between threads.
+    each thread gets its own requests.Session, and all the sessions share one connection pool,
+    so that concurrent calls run in parallel over kept-alive connections.
+    """
     mimetype = "application/x-msgpack"
 
-    def __init__(self, endpoint: str):
+    def __init__(self, endpoint: str, compression: str = None, pool_size: int = 10,
+                 timeout: Union[float, Tuple[float, float]] = None, keep_alive: bool = True):
+        """
+        :param endpoint: URL of the msgpack-RPC endpoint
+        :param compression: None, "gzip" or "deflate"
+        :param pool_size: max number of connections kept open. callers beyond it wait for a free connection
+        :param timeout: timeout in seconds of every call, or a (connect, read) tuple. None waits forever
+        :param keep_alive: reuse connections between calls
+        """
         if not endpoint:
             raise ValueError('The `endpoint` parameter is required')
+        check_compression(compression)
 
-        self._id = 1
+        self._ids = itertools.count(1)
         self._endpoint = endpoint
-        self._session = requests.Session()
+        self._compression = compression
+        self._timeout = timeout
+        self._headers = request_headers(self.mimetype, compression)
+        if not keep_alive:
+            self._headers["Connection"] = "close"
+        self._adapter = requests.adapters.HTTPAdapter(
+            pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+        self._local = threading.local()
+
+    @property
+    def _session(self) -> requests.Session:
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+            session.mount('http://', self._adapter)
+            session.mount('https://', self._adapter)
+        return session
 
     def __getattr__(self, method: str):
-        assert self._endpoint is not None
+        if method.startswith('_'):
+            raise AttributeError(method)
 
         def call(**kwargs):
-            return self._session.post(
-                self._endpoint,
-                data=msgpack.dumps(self.request(method, **kwargs)),
-                headers={"Content-Type": self.mimetype})
+            return self._post(method, kwargs)
 
         return call
 
@@ -30,25 +111,79 @@ class MsgpackRpcClient(object):
         reply = self._rpc_request(rpc_method, **query)
         return self._rpc_response(reply)
 
-    def _rpc_request(self, method: str, **query) -> Union[Dict, requests.Response]:
-        http_resp = self._session.post(
+    def _post(self, method: str, query: Dict, stream: bool = False) -> requests.Response:
+        return self._session.post(
             self._endpoint,
-            data=msgpack.dumps(dict(
+            data=compress_body(msgpack.dumps(dict(
                 method=method,
-                id=str(self._id),
+                # itertools.count is atomic, so the ids are unique across threads
+                id=str(next(self._ids)),
                 jsonrpc='2.0',
                 params=query,
-            )),
-            headers={"Content-Type": self.mimetype}
+            )), self._compression),
+            headers=self._headers,
+            timeout=self._timeout,
+            stream=stream,
         )
 
+    def _rpc_request(self, method: str, **query) -> Union[Dict, requests.Response]:
+        http_resp = self._post(method, query, stream=True)
+
         # compat with unittest.mock
         if (not isinstance(requests.Response, type)
                 or not isinstance(http_resp, requests.Response)):
             return http_resp
 
+        if http_resp.status_code >= 400:
+            http_resp.content  # read the error body so that the connection is reused
         http_resp.raise_for_status()
-        return msgpack.loads(http_resp.content)
+        return _loads(method, self._read(http_resp))
+
+    @staticmethod
+    def _read(http_resp: requests.Response) -> Union[bytes, bytearray]:
+        """
+        read the response body into a single buffer. when its size is known, the buffer is
+        allocated once and filled from the socket, so that the body is held in memory only once.
+        compressed bodies are read by requests.
+        """
+        try:
+            length = int(http_resp.headers.get('Content-Length'))
+        except (TypeError, ValueError):
+            length = None
+        if length is None or http_resp.headers.get('Content-Encoding'):
+            return http_resp.content
+
+        buffer = bytearray(length)
+        view = memoryview(buffer)
+        pos = 0
+        try:
+            while pos < length:
+                # urllib3 errors are raised as the requests exceptions that reading .content would raise
+                try:
+                    n = http_resp.raw.readinto(view[pos:])
+                except urllib3.exceptions.ReadTimeoutError as e:
+                    raise requests.exceptions.ReadTimeout(e, response=http_resp)
+                except (urllib3.exceptions.ProtocolError, OSError) as e:
+                    raise requests.exceptions.ChunkedEncodingError(e, response=http_resp)
+                if not n:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        'response ended after {} of {} bytes'.format(pos, length), response=http_resp)
+                pos += n
+        except Exception:
+            # the connection is in an unknown state, so it is closed rather than reused
+            http_resp.close()
+            raise
+        finally:
+            view.release()
+        http_resp.raw.release_conn()
+        return buffer
+
+    def head(self) -> Dict:
+        http_resp = self._session.head(self._endpoint, headers=self._headers, timeout=self._timeout)
+        return http_resp.headers
+
+    def close(self):
+        self._adapter.close()
 
     @staticmethod
     def _rpc_response(reply: Dict) -> str:
@@ -61,3 +196,56 @@ class MsgpackRpcClient(object):
             return reply['result']
 
         raise Exception('invalid JSON-RPC protocol: missing error or result key')
+
+
+class AsyncMsgpackRpcClient(object):
+    """
+    asyncio version of MsgpackRpcClient. requires aiohttp.
+    the HTTP session is created lazily so that it binds to the running event loop.
+    """
+    mimetype = "application/x-msgpack"
+
+    def __init__(self, endpoint: str, compression: str = None):
+        if not endpoint:
+            raise ValueError('The `endpoint` parameter is required')
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for the asyncio client. '
+                              'install it with `pip install pymarketstore[async]`')
+        check_compression(compression)
+
+        self._ids = itertools.count(1)
+        self._endpoint = endpoint
+        self._compression = compression
+        self._headers = request_headers(self.mimetype, compression)
+        self._session = None
+
+    def _get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    async def call(self, rpc_method: str, **query):
+        reply = await self._rpc_request(rpc_method, **query)
+        return MsgpackRpcClient._rpc_response(reply)
+
+    async def _rpc_request(self, method: str, **query) -> Dict:
+        async with self._get_session().post(
+                self._endpoint,
+                data=compress_body(msgpack.dumps(dict(
+                    method=method,
+                    id=str(next(self._ids)),
+                    jsonrpc='2.0',
+                    params=query,
+                )), self._compression),
+                headers=self._headers) as http_resp:
+            http_resp.raise_for_status()
+            return _loads(method, await http_resp.read())
+
+    async def head(self) -> Dict:
+        async with self._get_session().head(self._endpoint) as http_resp:
+            return http_resp.headers
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
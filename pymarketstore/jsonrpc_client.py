@@ -9,7 +9,9 @@ import numpy as np
 import pandas as pd
 import requests
 
-from .jsonrpc import MsgpackRpcClient
+from .batch import QueryBatch
+from .encode import Records, pack
+from .jsonrpc import MsgpackRpcClient, AsyncMsgpackRpcClient
 from .params import Params, ListSymbolsFormat
 from .results import QueryReply
 from .stream import StreamConn
@@ -30,10 +32,16 @@ def get_timestamp(value: Union[int, str]) -> pd.Timestamp:
 
 
 class JsonRpcClient(object):
+    # HTTP has no message size limit of its own. used to split QueryBatch requests
+    max_message_length = 1 * 1024 ** 3  # 1GB
 
-    def __init__(self, endpoint: str = 'http://localhost:5993/rpc', ):
+    def __init__(self, endpoint: str = 'http://localhost:5993/rpc', columnar: bool = False, lazy: bool = False,
+                 compression: str = None, pool_size: int = 10, timeout: Union[float, Tuple[float, float]] = None):
         self.endpoint = endpoint
-        self.rpc = MsgpackRpcClient(self.endpoint)
+        self.columnar = columnar
+        self.lazy = lazy
+        self.compression = compression
+        self.rpc = MsgpackRpcClient(self.endpoint, compression=compression, pool_size=pool_size, timeout=timeout)
 
     def _request(self, method: str, **query) -> Dict:
         try:
@@ -47,9 +55,43 @@ class JsonRpcClient(object):
             params = [params]
         query = self.build_query(params)
         reply = self._request('DataService.Query', **query)
-        return QueryReply.from_response(reply)
+        return QueryReply.from_response(reply, columnar=self.columnar, lazy=self.lazy)
+
+    def query_batch(self, batch: QueryBatch) -> QueryReply:
+        query = self.build_query_batch(batch)
+        reply = self._request('DataService.Query', **query)
+        return QueryReply.from_response(reply, columnar=self.columnar, lazy=self.lazy)
 
     def sql(self, statements: Union[str, List[str]]) -> QueryReply:
+        param = self.build_sql(statements)
+        reply = self._request('DataService.Query', **param)
+        return QueryReply.from_response(reply, columnar=self.columnar, lazy=self.lazy)
+
+    def create(self, tbk: str, dtype: List[Tuple[str, str]], isvariablelength: bool = False) -> dict:
+        writer = self.build_create(tbk, dtype, isvariablelength=isvariablelength)
+        try:
+            return self.rpc.call("DataService.Create", **writer)
+        except requests.exceptions.ConnectionError:
+            raise requests.exceptions.ConnectionError(
+                "Could not contact server")
+
+    def write(self, recarray: Records, tbk: str, isvariablelength: bool = False) -> str:
+        writer = self.build_write(recarray, tbk, isvariablelength=isvariablelength)
+        try:
+            return self.rpc.call("DataService.Write", **writer)
+        except requests.exceptions.ConnectionError:
+            raise requests.exceptions.ConnectionError(
+                "Could not contact server")
+
+    def write_many(self, datasets: Dict[str, Records], isvariablelength: bool = False) -> str:
+        writer = self.build_write_many(datasets, isvariablelength=isvariablelength)
+        try:
+            return self.rpc.call("DataService.Write", **writer)
+        except requests.exceptions.ConnectionError:
+            raise requests.exceptions.ConnectionError(
+                "Could not contact server")
+
+    def build_sql(self, statements: Union[str, List[str]]) -> Dict:
         if not isiterable(statements):
             statements = [statements]
 
@@ -61,11 +103,9 @@ class JsonRpcClient(object):
             }
             reqs.append(req)
 
-        param = {'requests': reqs}
-        reply = self._request('DataService.Query', **param)
-        return QueryReply.from_response(reply)
+        return {'requests': reqs}
 
-    def create(self, tbk: str, dtype: List[Tuple[str, str]], isvariablelength: bool = False) -> dict:
+    def build_create(self, tbk: str, dtype: List[Tuple[str, str]], isvariablelength: bool = False) -> Dict:
         # dtype: e.g. [('Epoch', 'i8'), ('Ask', 'f4')]
         req = {
             "key": "{}:Symbol/Timeframe/AttributeGroup".format(tbk),
@@ -76,38 +116,29 @@ class JsonRpcClient(object):
             "row_type": "variable" if isvariablelength else "fixed",
         }
 
-        writer = {'requests': [req]}
-        try:
-            return self.rpc.call("DataService.Create", **writer)
-        except requests.exceptions.ConnectionError:
-            raise requests.exceptions.ConnectionError(
-                "Could not contact server")
+        return {'requests': [req]}
 
-    def write(self, recarray: np.array, tbk: str, isvariablelength: bool = False) -> str:
-        data = {}
-        data['types'] = [
-            recarray.dtype[name].str.replace('<', '').replace('|', '')
-            for name in recarray.dtype.names
-        ]
-        data['names'] = recarray.dtype.names
-        data['data'] = [
-            bytes(memoryview(recarray[name]))
-            for name in recarray.dtype.names
-        ]
-        data['length'] = len(recarray)
-        data['startindex'] = {tbk: 0}
-        data['lengths'] = {tbk: len(recarray)}
-        write_request = {}
-        write_request['dataset'] = data
-        write_request['is_variable_length'] = isvariablelength
-        writer = {}
-        writer['requests'] = [write_request]
+    def build_write(self, recarray: Records, tbk: str, isvariablelength: bool = False) -> Dict:
+        return self.build_write_many({tbk: recarray}, isvariablelength=isvariablelength)
 
-        try:
-            return self.rpc.call("DataService.Write", **writer)
-        except requests.exceptions.ConnectionError:
-            raise requests.exceptions.ConnectionError(
-                "Could not contact server")
+    def build_write_many(self, datasets: Dict[str, Records], isvariablelength: bool = False) -> Dict:
+        # one write request per distinct schema, holding all the time buckets of that schema
+        requests = []
+        for packed in pack(datasets, as_bytes=False):
+            data = {}
+            data['types'] = packed.types
+            data['names'] = packed.names
+            data['data'] = packed.data
+            data['length'] = packed.length
+            data['startindex'] = packed.start_index
+            data['lengths'] = packed.lengths
+            write_request = {}
+            write_request['dataset'] = data
+            write_request['is_variable_length'] = isvariablelength
+            requests.append(write_request)
+        writer = {}
+        writer['requests'] = requests
+        return writer
 
     def build_query(self, params: Union[Params, List[Params]]) -> Dict:
         reqs = []
@@ -146,6 +177,34 @@ class JsonRpcClient(object):
             'requests': reqs,
         }
 
+    def build_query_batch(self, batch: QueryBatch) -> Dict:
+        start_secs, start_nanos, has_start, end_secs, end_nanos, has_end = batch.epochs()
+        common = {}
+        if batch.limit is not None:
+            common['limit_record_count'] = int(batch.limit)
+        if batch.limit_from_start is not None:
+            common['limit_from_start'] = bool(batch.limit_from_start)
+        if batch.functions is not None:
+            common['functions'] = batch.functions
+        if batch.columns is not None:
+            common['columns'] = batch.columns
+
+        reqs = []
+        for i, destination in enumerate(batch.destinations()):
+            req = dict(common, destination=destination)
+            if has_start is not None and has_start[i]:
+                req['epoch_start'] = start_secs[i]
+                if start_nanos[i] != 0:
+                    req['epoch_start_nanos'] = start_nanos[i]
+            if has_end is not None and has_end[i]:
+                req['epoch_end'] = end_secs[i]
+                if end_nanos[i] != 0:
+                    req['epoch_end_nanos'] = end_nanos[i]
+            reqs.append(req)
+        return {
+            'requests': reqs,
+        }
+
     def list_symbols(self, fmt: ListSymbolsFormat = ListSymbolsFormat.SYMBOL) -> List[str]:
         reply = self._request('DataService.ListSymbols', format=fmt.value)
         return reply.get('Results') or []
@@ -161,8 +220,8 @@ class JsonRpcClient(object):
         return reply
 
     def server_version(self) -> str:
-        resp = requests.head(self.endpoint)
-        return resp.headers.get('Marketstore-Version')
+        headers = self.rpc.head()
+        return headers.get('Marketstore-Version')
 
     def stream(self):
         endpoint = re.sub('^http', 'ws',
@@ -171,3 +230,65 @@ class JsonRpcClient(object):
 
     def __repr__(self):
         return 'MsgPackRPCClient("{}")'.format(self.endpoint)
+
+
+class AsyncJsonRpcClient(JsonRpcClient):
+    """
+    asyncio version of JsonRpcClient. HTTP requests are sent with aiohttp,
+    requests and replies are built/decoded by the same code as JsonRpcClient.
+    """
+
+    def __init__(self, endpoint: str = 'http://localhost:5993/rpc', columnar: bool = False, lazy: bool = False,
+                 compression: str = None):
+        self.endpoint = endpoint
+        self.columnar = columnar
+        self.lazy = lazy
+        self.compression = compression
+        self.rpc = AsyncMsgpackRpcClient(self.endpoint, compression=compression)
+
+    async def _request(self, method: str, **query) -> Dict:
+        try:
+            return await self.rpc.call(method, **query)
+        except Exception as exc:
+            logger.exception(exc)
+            raise
+
+    async def query(self, params: Params) -> QueryReply:
+        query = self.build_query(params)
+        reply = await self._request('DataService.Query', **query)
+        return QueryReply.from_response(reply, columnar=self.columnar, lazy=self.lazy)
+
+    async def sql(self, statements: Union[str, List[str]]) -> QueryReply:
+        param = self.build_sql(statements)
+        reply = await self._request('DataService.Query', **param)
+        return QueryReply.from_response(reply, columnar=self.columnar, lazy=self.lazy)
+
+    async def create(self, tbk: str, dtype: List[Tuple[str, str]], isvariablelength: bool = False) -> dict:
+        writer = self.build_create(tbk, dtype, isvariablelength=isvariablelength)
+        return await self._request("DataService.Create", **writer)
+
+    async def write(self, recarray: Records, tbk: str, isvariablelength: bool = False) -> str:
+        writer = self.build_write(recarray, tbk, isvariablelength=isvariablelength)
+        return await self._request("DataService.Write", **writer)
+
+    async def write_many(self, datasets: Dict[str, Records], isvariablelength: bool = False) -> str:
+        writer = self.build_write_many(datasets, isvariablelength=isvariablelength)
+        return await self._request("DataService.Write", **writer)
+
+    async def list_symbols(self, fmt: ListSymbolsFormat = ListSymbolsFormat.SYMBOL) -> List[str]:
+        reply = await self._request('DataService.ListSymbols', format=fmt.value)
+        return reply.get('Results') or []
+
+    async def destroy(self, tbk: str) -> Dict:
+        destroy_req = {'requests': [{'key': tbk}]}
+        return await self._request('DataService.Destroy', **destroy_req)
+
+    async def server_version(self) -> str:
+        headers = await self.rpc.head()
+        return headers.get('Marketstore-Version')
+
+    async def close(self):
+        await self.rpc.close()
+
+    def __repr__(self):
+        return 'AsyncMsgPackRPCClient("{}")'.format(self.endpoint)
@@ -0,0 +1,270 @@
+import argparse
+import json
+import logging
+import os
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List, Set, Union
+
+import numpy as np
+import pandas as pd
+
+from .client import Client
+from .encode import column_type, columns_from_df
+from .params import ListSymbolsFormat
+
+logger = logging.getLogger(__name__)
+
+
+def parse_file(path: str, time_column: str = None, dtype: np.dtype = None) -> Dict[str, np.ndarray]:
+    """
+    read a CSV or Parquet file and convert it to write columns.
+    runs in a worker process of BulkLoader, so it only takes and returns picklable values.
+    :param path: .csv (optionally compressed, e.g. .csv.gz) or .parquet file
+    :param time_column: column of the timestamps. the first column if None.
+        numbers are taken as seconds since the epoch, and tz-naive timestamps as UTC
+    :param dtype: dtype of the bucket, or None to keep the dtypes of the file
+    :return: dict of 1-D column arrays
+    """
+    if path.endswith(('.parquet', '.pq')):
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_csv(path)
+    time_column = time_column or df.columns[0]
+    times = df.pop(time_column)
+    if times.dtype.kind in 'iuf':
+        df.index = pd.to_datetime(times.to_numpy(), unit='s', utc=True)
+    else:
+        df.index = pd.to_datetime(times, utc=True)
+    return columns_from_df(df, dtype)
+
+
+class Checkpoint(object):
+    """
+    set of the files completely written, persisted in a JSON file so that an interrupted load
+    resumes where it stopped. a file is written again if its size or modification time changed.
+    """
+
+    def __init__(self, path: str = None):
+        """
+        :param path: checkpoint file. nothing is persisted if None
+        """
+        self.path = path
+        self._done: Set[str] = set()
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            with open(path) as f:
+                self._done = set(json.load(f))
+
+    @staticmethod
+    def _key(path: str) -> str:
+        stat = os.stat(path)
+        return '{}:{}:{}'.format(os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+
+    def done(self, path: str) -> bool:
+        return self._key(path) in self._done
+
+    def mark(self, path: str):
+        with self._lock:
+            self._done.add(self._key(path))
+            if self.path is None:
+                return
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(sorted(self._done), f)
+            os.replace(tmp, self.path)
+
+
+class BulkLoader(object):
+    """
+    load CSV/Parquet files into MarketStore.
+    files are parsed and converted to the bucket dtype in a process pool, and their records are
+    written through several concurrent connections, with at most `window` write requests in flight.
+    progress is recorded per file in a checkpoint, and buckets which do not exist are created
+    from the schema of their first file.
+    """
+
+    def __init__(self, endpoint: str = 'http://localhost:5993/rpc', grpc: bool = False,
+                 processes: int = None, connections: int = 4, window: int = 8,
+                 chunk_rows: int = 1000000, checkpoint: str = None, create: bool = True,
+                 time_column: str = None, dtype: np.dtype = None):
+        """
+        :param endpoint: MarketStore endpoint
+        :param grpc: write through gRPC
+        :param processes: number of parser processes. the number of CPUs if None
+        :param connections: number of concurrent write connections
+        :param window: max number of write requests in flight
+        :param chunk_rows: max number of records of a write request
+        :param checkpoint: checkpoint file to resume an interrupted load
+        :param create: create the buckets which do not exist
+        :param time_column: column of the timestamps in the files. the first column if None
+        :param dtype: dtype of the buckets. the dtypes of the files are kept if None
+        """
+        self.endpoint = endpoint
+        self.grpc = grpc
+        self.processes = processes or os.cpu_count() or 1
+        self.connections = connections
+        self.window = window
+        self.chunk_rows = chunk_rows
+        self.checkpoint = Checkpoint(checkpoint)
+        self.create = create
+        self.time_column = time_column
+        self.dtype = dtype
+        self._local = threading.local()
+
+    def _client(self) -> Client:
+        # one connection per writer thread
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = Client(self.endpoint, grpc=self.grpc)
+        return client
+
+    def load(self, files: Iterable[str], tbk: Union[str, Callable[[str], str]]) -> Dict[str, int]:
+        """
+        :param files: paths of the files to load
+        :param tbk: Time Bucket Key of the records of a file. either a string in which "{symbol}"
+            is replaced by the file name without extension (e.g. '{symbol}/1Min/OHLCV'),
+            or a function of the path returning the TBK
+        :return: stats of the load. {'files': written, 'skipped': already in the checkpoint, 'rows': written}
+        """
+        if not callable(tbk):
+            tbk = _tbk_formatter(tbk)
+        files = list(files)
+        pending = [path for path in files if not self.checkpoint.done(path)]
+        stats = {'files': 0, 'skipped': len(files) - len(pending), 'rows': 0}
+        existing = set(self._client().list_symbols(ListSymbolsFormat.TBK)) if self.create else set()
+
+        state = _LoadState(self.window)
+        with ProcessPoolExecutor(self.processes) as parsers, ThreadPoolExecutor(self.connections) as writers:
+            parsing: Dict[Future, str] = {}
+            queue = list(reversed(pending))
+            while (queue or parsing) and state.error is None:
+                # keep a few files parsed ahead of the writes, not all of them
+                while queue and len(parsing) < 2 * self.processes:
+                    path = queue.pop()
+                    parsing[parsers.submit(parse_file, path, self.time_column, self.dtype)] = path
+                done, _ = wait(parsing, return_when=FIRST_COMPLETED)
+                for future in done:
+                    path = parsing.pop(future)
+                    key = tbk(path)
+                    columns = future.result()
+                    if self.create and key not in existing:
+                        self._client().create(key, [(name, column_type(col.dtype)) for name, col in columns.items()])
+                        existing.add(key)
+                    self._submit(writers, state, path, key, columns, stats)
+            state.drain()
+        if state.error is not None:
+            raise state.error
+        return stats
+
+    def _submit(self, writers: ThreadPoolExecutor, state: '_LoadState', path: str, tbk: str,
+                columns: Dict[str, np.ndarray], stats: Dict[str, int]):
+        length = len(next(iter(columns.values()))) if columns else 0
+        starts = list(range(0, length, self.chunk_rows))
+        if not starts:
+            self.checkpoint.mark(path)
+            with state.lock:
+                stats['files'] += 1
+            return
+        with state.lock:
+            state.remaining[path] = len(starts)
+        for start in starts:
+            chunk = {name: col[start:start + self.chunk_rows] for name, col in columns.items()}
+            state.acquire()
+            if state.error is not None:
+                state.release()
+                return
+            future = writers.submit(self._write, chunk, tbk)
+            future.add_done_callback(
+                lambda f, rows=len(chunk[next(iter(chunk))]): self._written(f, state, path, rows, stats))
+
+    def _write(self, columns: Dict[str, np.ndarray], tbk: str):
+        return self._client().write(columns, tbk)
+
+    def _written(self, future: Future, state: '_LoadState', path: str, rows: int, stats: Dict[str, int]):
+        try:
+            future.result()
+        except Exception as exc:
+            logger.error('failed to write %s: %s', path, exc)
+            state.fail(exc)
+            return
+        finally:
+            state.release()
+        with state.lock:
+            stats['rows'] += rows
+            state.remaining[path] -= 1
+            if state.remaining[path]:
+                return
+            del state.remaining[path]
+            stats['files'] += 1
+        self.checkpoint.mark(path)
+        logger.info('loaded %s', path)
+
+    def __repr__(self):
+        return 'BulkLoader(endpoint={}, processes={}, connections={}, window={})'.format(
+            self.endpoint, self.processes, self.connections, self.window)
+
+
+class _LoadState(object):
+    """
+    write requests in flight of a load
+    """
+
+    def __init__(self, window: int):
+        self.window = window
+        self.remaining: Dict[str, int] = {}
+        self.error = None
+        self.lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(window)
+
+    def acquire(self):
+        self._slots.acquire()
+
+    def release(self):
+        self._slots.release()
+
+    def fail(self, exc: Exception):
+        with self.lock:
+            if self.error is None:
+                self.error = exc
+
+    def drain(self):
+        # wait for all the writes in flight
+        for _ in range(self.window):
+            self._slots.acquire()
+        for _ in range(self.window):
+            self._slots.release()
+
+
+def _tbk_formatter(tbk: str) -> Callable[[str], str]:
+    def format_tbk(path: str) -> str:
+        name = os.path.basename(path)
+        symbol = name.split('.')[0]
+        return tbk.format(symbol=symbol)
+    return format_tbk
+
+
+def main(argv: List[str] = None):
+    parser = argparse.ArgumentParser(description='load CSV/Parquet files into MarketStore')
+    parser.add_argument('files', nargs='+', help='CSV or Parquet files')
+    parser.add_argument('--tbk', required=True,
+                        help='Time Bucket Key. "{symbol}" is replaced by the file name (e.g. "{symbol}/1Min/OHLCV")')
+    parser.add_argument('--endpoint', default='http://localhost:5993/rpc', help='MarketStore endpoint')
+    parser.add_argument('--grpc', action='store_true', help='write through gRPC')
+    parser.add_argument('--time-column', help='column of the timestamps. the first column by default')
+    parser.add_argument('--processes', type=int, help='number of parser processes')
+    parser.add_argument('--connections', type=int, default=4, help='number of concurrent write connections')
+    parser.add_argument('--window', type=int, default=8, help='max number of write requests in flight')
+    parser.add_argument('--chunk-rows', type=int, default=1000000, help='max number of records of a write request')
+    parser.add_argument('--checkpoint', help='checkpoint file to resume an interrupted load')
+    parser.add_argument('--no-create', action='store_true', help='do not create missing buckets')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    loader = BulkLoader(
+        endpoint=args.endpoint, grpc=args.grpc, processes=args.processes, connections=args.connections,
+        window=args.window, chunk_rows=args.chunk_rows, checkpoint=args.checkpoint,
+        create=not args.no_create, time_column=args.time_column,
+    )
+    stats = loader.load(args.files, args.tbk)
+    logger.info('loaded %d files (%d skipped), %d rows', stats['files'], stats['skipped'], stats['rows'])
@@ -0,0 +1,111 @@
+"""
+msgpack decoder which returns bin payloads as memoryview slices of the input buffer instead of
+copying them into new bytes objects. the column data of a query reply is the bulk of it, so
+decoding a reply this way does not copy the records at all.
+"""
+import struct
+from typing import Any, Tuple, Union
+
+_unpack_from = struct.unpack_from
+
+# (struct format, size) of the fixed-size types by first byte
+_FIXED = {
+    0xca: ('>f', 4), 0xcb: ('>d', 8),
+    0xcc: ('>B', 1), 0xcd: ('>H', 2), 0xce: ('>I', 4), 0xcf: ('>Q', 8),
+    0xd0: ('>b', 1), 0xd1: ('>h', 2), 0xd2: ('>i', 4), 0xd3: ('>q', 8),
+}
+# struct format and size of the length of the variable-size types by first byte
+_LENGTH = {
+    0xc4: ('>B', 1), 0xc5: ('>H', 2), 0xc6: ('>I', 4),  # bin
+    0xd9: ('>B', 1), 0xda: ('>H', 2), 0xdb: ('>I', 4),  # str
+    0xdc: ('>H', 2), 0xdd: ('>I', 4),  # array
+    0xde: ('>H', 2), 0xdf: ('>I', 4),  # map
+}
+
+
+def loads(buffer: Union[bytes, bytearray, memoryview]) -> Any:
+    """
+    decode a msgpack document. bin values are returned as memoryview slices of `buffer`, which must
+    stay unchanged while they are used. they are read-only, except for a writable buffer on python 3.7.
+    str values are decoded to str.
+    :raise ValueError: on truncated or unsupported input (ext types)
+    """
+    view = memoryview(buffer).cast('B')
+    if hasattr(view, 'toreadonly'):  # python 3.8+. slices of a read-only view are read-only
+        view = view.toreadonly()
+    try:
+        obj, pos = _decode(view, 0)
+    except (struct.error, IndexError):
+        raise ValueError('truncated msgpack data')
+    if pos != len(view):
+        raise ValueError('extra data after the msgpack document: {} bytes'.format(len(view) - pos))
+    return obj
+
+
+def _decode(view: memoryview, pos: int) -> Tuple[Any, int]:
+    b = view[pos]
+    pos += 1
+    if b <= 0x7f:
+        return b, pos
+    if b >= 0xe0:
+        return b - 0x100, pos
+    if 0xa0 <= b <= 0xbf:
+        end = pos + (b & 0x1f)
+        return _str(view, pos, end), end
+    if 0x90 <= b <= 0x9f:
+        return _array(view, pos, b & 0x0f)
+    if 0x80 <= b <= 0x8f:
+        return _map(view, pos, b & 0x0f)
+    if b == 0xc0:
+        return None, pos
+    if b == 0xc2:
+        return False, pos
+    if b == 0xc3:
+        return True, pos
+
+    fixed = _FIXED.get(b)
+    if fixed is not None:
+        fmt, size = fixed
+        return _unpack_from(fmt, view, pos)[0], pos + size
+
+    length = _LENGTH.get(b)
+    if length is None:
+        raise ValueError('unsupported msgpack type: 0x{:02x}'.format(b))
+    fmt, size = length
+    n = _unpack_from(fmt, view, pos)[0]
+    pos += size
+    if b <= 0xc6:
+        end = pos + n
+        if end > len(view):
+            raise ValueError('truncated msgpack data')
+        return view[pos:end], end
+    if b <= 0xdb:
+        end = pos + n
+        return _str(view, pos, end), end
+    if b <= 0xdd:
+        return _array(view, pos, n)
+    return _map(view, pos, n)
+
+
+def _str(view: memoryview, pos: int, end: int) -> str:
+    if end > len(view):
+        raise ValueError('truncated msgpack data')
+    return str(view[pos:end], 'utf-8')
+
+
+def _array(view: memoryview, pos: int, n: int) -> Tuple[list, int]:
+    items = []
+    for _ in range(n):
+        item, pos = _decode(view, pos)
+        items.append(item)
+    return items, pos
+
+
+def _map(view: memoryview, pos: int, n: int) -> Tuple[dict, int]:
+    items = {}
+    for _ in range(n):
+        key, pos = _decode(view, pos)
+        if isinstance(key, memoryview):
+            key = key.tobytes()
+        items[key], pos = _decode(view, pos)
+    return items, pos
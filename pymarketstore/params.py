@@ -1,3 +1,4 @@
+import copy
 from typing import Union, List, Any
 import pandas as pd
 import numpy as np
@@ -57,6 +58,34 @@ class Params(object):
             setattr(self, key, val)
         return self
 
+    @property
+    def symbols(self) -> List[str]:
+        return self.tbk.split('/')[0].split(',')
+
+    @property
+    def timeframe(self) -> str:
+        return self.tbk.split('/')[1]
+
+    @property
+    def attrgroup(self) -> str:
+        return self.tbk.split('/')[2]
+
+    def copy(self, **kwargs) -> 'Params':
+        """
+        return a shallow copy of the Params with some attributes replaced
+        :param kwargs: attributes to replace. "symbols" replaces the symbols of the tbk
+        :return: Params
+        """
+        p = copy.copy(self)
+        symbols = kwargs.pop('symbols', None)
+        if symbols is not None:
+            if not isiterable(symbols):
+                symbols = [symbols]
+            p.tbk = ','.join(symbols) + "/" + self.timeframe + "/" + self.attrgroup
+        for key, val in kwargs.items():
+            p.set(key, val)
+        return p
+
     def __repr__(self) -> str:
         content = ('tbk={}, start={}, end={}, '.format(
             self.tbk, self.start, self.end,
@@ -65,3 +94,51 @@ class Params(object):
                    'limit_from_start={}'.format(self.limit_from_start) +
                    'columns={}'.format(self.columns))
         return 'Params({})'.format(content)
+
+
+def split_params(params: Union[Params, List[Params]], chunk_symbols: int = None,
+                 chunk_span: Union[str, pd.Timedelta] = None) -> List[Params]:
+    """
+    split Params into smaller shards by symbols and/or time range.
+    time ranges are split into consecutive non-overlapping [start, end] windows
+    (both ends inclusive, nanosecond precision), returned in chronological order.
+    :param params: Params or list of Params to split
+    :param chunk_symbols: max number of symbols per shard. None for no symbol split
+    :param chunk_span: max time span per shard (e.g. '30D', pd.Timedelta(days=30)).
+        requires both start and end, and cannot be combined with limit.
+    :return: list of Params
+    """
+    if not isiterable(params):
+        params = [params]
+
+    shards = []
+    for param in params:
+        symbols = param.symbols
+        step = chunk_symbols or len(symbols)
+        for i in range(0, len(symbols), step):
+            param_chunk = param.copy(symbols=symbols[i:i + step])
+            if chunk_span is None:
+                shards.append(param_chunk)
+            else:
+                shards += _split_time(param_chunk, pd.Timedelta(chunk_span))
+    return shards
+
+
+def _split_time(param: Params, span: pd.Timedelta) -> List[Params]:
+    if param.start is None or param.end is None:
+        raise ValueError('chunk_span requires both start and end: {}'.format(param))
+    if param.limit is not None:
+        raise ValueError('chunk_span cannot be used with limit: {}'.format(param))
+    if span <= pd.Timedelta(0):
+        raise ValueError('chunk_span must be positive')
+
+    one_ns = pd.Timedelta(1, unit='ns')
+    shards = []
+    start = param.start
+    while start <= param.end:
+        end = min(start + span - one_ns, param.end)
+        shard = copy.copy(param)
+        shard.start, shard.end = start, end
+        shards.append(shard)
+        start = end + one_ns
+    return shards
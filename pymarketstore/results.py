@@ -1,10 +1,32 @@
-from typing import List, Dict
+import functools
+from typing import List, Dict, Optional, Tuple, Union
 
 import numpy as np
 import pandas as pd
 import six
 
 import pymarketstore.proto.marketstore_pb2 as proto
+from .params import Params
+
+try:
+    import pyarrow as pa
+except ImportError:  # optional dependency for to_arrow()
+    pa = None
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise ImportError('pyarrow is required for Arrow output. '
+                          'install it with `pip install pymarketstore[arrow]`')
+
+
+def _arrow_array(col: np.ndarray):
+    """
+    wrap a numpy column as an Arrow array. contiguous, aligned columns are not copied.
+    """
+    if not col.flags.c_contiguous or col.ctypes.data % col.dtype.alignment:
+        col = np.array(col)
+    return pa.array(col)
 
 
 def decode(column_names: List[str], column_types: List[str], column_data, data_length) -> np.ndarray:
@@ -20,42 +42,274 @@ def decode(column_names: List[str], column_types: List[str], column_data, data_l
     return array
 
 
-def decode_responses(responses: List[Dict]) -> List:
+def decode_columns(column_names: List[str], column_types: List[str], column_data, data_length) -> Dict[str, np.ndarray]:
+    """
+    decode columns without copying. each column is a read-only np.frombuffer view
+    over the received bytes of the column.
+    """
+    return {
+        str(colname): np.frombuffer(column_data[idx], dtype=np.dtype(coltype), count=data_length)
+        for idx, (colname, coltype) in enumerate(zip(column_names, column_types))
+    }
+
+
+def _slice(data, start_idx: int, length: int):
+    if isinstance(data, dict):
+        return {name: col[start_idx:start_idx + length] for name, col in six.iteritems(data)}
+    return data[start_idx:start_idx + length]
+
+
+class LazySlice(object):
+    """
+    a not-yet-decoded [start_idx, start_idx + length) slice of a response.
+    the raw column buffers are shared by all the slices of the same response,
+    and only the rows of this slice are decoded when decode() is called.
+    """
+
+    def __init__(self, columns: 'LazyColumns', start_idx: int, length: int):
+        self.columns = columns
+        self.start_idx = start_idx
+        self.length = length
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.columns.dtype
+
+    def decode(self) -> Union[np.ndarray, Dict[str, np.ndarray]]:
+        return self.columns.decode(self.start_idx, self.length)
+
+
+class LazyColumns(object):
+    """
+    raw column buffers of a response, kept as received until one of its slices is decoded.
+    """
+
+    def __init__(self, column_names: List[str], column_types: List[str], column_data, columnar: bool = False):
+        self.dtype = np.dtype([(str(name), typ) for name, typ in zip(column_names, column_types)])
+        self.columnar = columnar
+        self._column_data = column_data
+        self._buffers = None
+
+    def decode(self, start_idx: int, length: int) -> Union[np.ndarray, Dict[str, np.ndarray]]:
+        if self._buffers is None:
+            # protobuf returns a new bytes object on every access of a repeated bytes field
+            self._buffers = list(self._column_data)
+            self._column_data = None
+        columns = {
+            name: np.frombuffer(self._buffers[idx], dtype=self.dtype[idx], count=length,
+                                offset=start_idx * self.dtype[idx].itemsize)
+            for idx, name in enumerate(self.dtype.names)
+        }
+        if self.columnar:
+            return columns
+        array = np.empty((length,), dtype=self.dtype)
+        for name, col in six.iteritems(columns):
+            array[name] = col
+        return array
+
+
+def _decode_packed(column_names, column_types, column_data, data_length, start_index, lengths,
+                   columnar: bool, lazy: bool) -> Dict:
+    if lazy:
+        lazy_columns = LazyColumns(column_names, column_types, column_data, columnar=columnar)
+    else:
+        _decode = decode_columns if columnar else decode
+        array = _decode(column_names, column_types, column_data, data_length)
+
+    array_dict = {}
+    for tbk, start_idx in six.iteritems(start_index):
+        length = lengths[tbk]
+        key = str(tbk.split(':')[0])
+        if lazy:
+            array_dict[key] = LazySlice(lazy_columns, start_idx, length)
+        else:
+            array_dict[key] = _slice(array, start_idx, length)
+    return array_dict
+
+
+def decode_responses(responses: List[Dict], columnar: bool = False, lazy: bool = False) -> List:
     results = []
     for response in responses:
         packed = response['result']
-        array_dict = {}
-        # array = decode(packed)
-        array = decode(packed['names'], packed['types'], packed['data'], packed['length'])
-        for tbk, start_idx in six.iteritems(packed['startindex']):
-            length = packed['lengths'][tbk]
-            key = str(tbk.split(':')[0])
-            array_dict[key] = array[start_idx:start_idx + length]
-        results.append(array_dict)
+        results.append(_decode_packed(packed['names'], packed['types'], packed['data'], packed['length'],
+                                      packed['startindex'], packed['lengths'], columnar, lazy))
     return results
 
 
-def decode_grpc_responses(responses) -> List[Dict[str, np.ndarray]]:
+def decode_grpc_responses(responses, columnar: bool = False, lazy: bool = False) -> List[Dict[str, np.ndarray]]:
     results = []
     for response in responses:
         packed = response.result
-        array_dict = {}
-        array = decode(packed.data.column_names, packed.data.column_types, packed.data.column_data, packed.data.length)
-        for tbk, start_idx in six.iteritems(packed.start_index):
-            length = packed.lengths[tbk]
-            key = str(tbk.split(':')[0])
-            array_dict[key] = array[start_idx:start_idx + length]
-        results.append(array_dict)
+        results.append(_decode_packed(packed.data.column_names, packed.data.column_types, packed.data.column_data,
+                                      packed.data.length, packed.start_index, packed.lengths, columnar, lazy))
     return results
 
 
 class DataSet(object):
-
-    def __init__(self, array: np.ndarray, key: str, timezone: str):
-        self.array = array
+    """
+    records of a time bucket. the data is held either as a numpy structured array
+    or, for columnar replies, as a dict of 1-D column arrays which are views over the received bytes.
+    `array` and `columns` convert between the two on demand.
+    for lazy replies the data is a LazySlice which is decoded on first access.
+    """
+
+    def __init__(self, array: Union[np.ndarray, Dict[str, np.ndarray], LazySlice], key: str, timezone: str):
+        self._lazy = None
+        self._set_data(array)
         self.key = key
         self.timezone = timezone
 
+    def _set_data(self, data: Union[np.ndarray, Dict[str, np.ndarray], LazySlice]):
+        self._array, self._columns = None, None
+        # growable storage used by append()
+        self._buffer, self._capacity = None, 0
+        if isinstance(data, LazySlice):
+            self._lazy = data
+        elif isinstance(data, dict):
+            self._columns = data
+        else:
+            self._array = data
+
+    def _load(self):
+        if self._lazy is not None:
+            lazy, self._lazy = self._lazy, None
+            self._set_data(lazy.decode())
+
+    @property
+    def is_decoded(self) -> bool:
+        return self._lazy is None
+
+    @property
+    def array(self) -> np.ndarray:
+        self._load()
+        if self._array is None:
+            array = np.empty((len(self),), dtype=self.dtype)
+            for name, col in six.iteritems(self._columns):
+                array[name] = col
+            self._array = array
+        return self._array
+
+    @array.setter
+    def array(self, array: np.ndarray):
+        self._lazy = None
+        self._set_data(array)
+
+    @property
+    def columns(self) -> Dict[str, np.ndarray]:
+        self._load()
+        if self._columns is not None:
+            return self._columns
+        return {name: self._array[name] for name in self._array.dtype.names}
+
+    @property
+    def is_columnar(self) -> bool:
+        self._load()
+        return self._columns is not None
+
+    @property
+    def dtype(self) -> np.dtype:
+        if self._lazy is not None:
+            return self._lazy.dtype
+        if self._columns is None:
+            return self._array.dtype
+        return np.dtype([(name, col.dtype) for name, col in six.iteritems(self._columns)])
+
+    @property
+    def shape(self) -> Tuple[int]:
+        return (len(self),)
+
+    def __len__(self) -> int:
+        if self._lazy is not None:
+            return self._lazy.length
+        if self._columns is None:
+            return len(self._array)
+        return len(next(iter(self._columns.values()))) if self._columns else 0
+
+    def timestamps(self) -> np.ndarray:
+        """
+        :return: int64 nanoseconds since the epoch of each record, combining Epoch and Nanoseconds (if any)
+        """
+        columns = self.columns
+        epochs = columns[self.dtype.names[0]].astype('i8')
+        epochs *= 10 ** 9
+        if 'Nanoseconds' in columns:
+            epochs += columns['Nanoseconds']
+        return epochs
+
+    def view(self) -> 'DataSet':
+        """
+        :return: DataSet over the same records. the records are not copied, but appending to (or refreshing)
+            the view does not change this DataSet, and vice versa.
+        """
+        if self._lazy is not None:
+            data = self._lazy
+        else:
+            data = self._columns if self.is_columnar else self._array
+        return DataSet(data, self.key, self.timezone)
+
+    def slice(self, start: int, stop: int = None) -> 'DataSet':
+        """
+        :return: DataSet of the records [start, stop). the data is not copied.
+        """
+        stop = len(self) if stop is None else stop
+        data = self.columns if self.is_columnar else self.array
+        return DataSet(_slice(data, start, stop - start), self.key, self.timezone)
+
+    def append(self, data: Union[np.ndarray, Dict[str, np.ndarray], 'DataSet']) -> int:
+        """
+        append records in place. the records are kept in a buffer which grows geometrically,
+        so that repeated appends cost O(new records) amortized instead of rebuilding the whole array.
+        :param data: records with the same columns as this DataSet
+        :return: number of appended records
+        """
+        if isinstance(data, DataSet):
+            data = data.columns if data.is_columnar else data.array
+        n = len(next(iter(data.values()))) if isinstance(data, dict) else len(data)
+        if n == 0:
+            return 0
+
+        columnar = self.is_columnar
+        length = len(self)
+        needed = length + n
+        if needed > self._capacity:
+            capacity = max(16, 2 * needed)
+            if columnar:
+                buffer = {name: np.empty(capacity, dtype=col.dtype) for name, col in six.iteritems(self._columns)}
+                for name, col in six.iteritems(self._columns):
+                    buffer[name][:length] = col
+            else:
+                buffer = np.empty(capacity, dtype=self._array.dtype)
+                buffer[:length] = self._array
+            self._buffer, self._capacity = buffer, capacity
+
+        buffer = self._buffer
+        for name in self.dtype.names:
+            buffer[name][length:needed] = data[name]
+        if columnar:
+            self._columns = {name: col[:needed] for name, col in six.iteritems(buffer)}
+        else:
+            self._array = buffer[:needed]
+        return n
+
+    def refresh(self, client, params: Params = None) -> int:
+        """
+        fetch the records newer than the last one held and append them
+        :param client: Client to query
+        :param params: Params of the query. defaults to all the columns of this time bucket
+        :return: number of appended records
+        """
+        if params is None:
+            params = Params(self.symbol, self.timeframe, self.attribute_group)
+        # polls bypass the QueryCache of the client, where a reply without new records would be
+        # served to the next polls until it expires
+        last = int(self.timestamps()[-1]) if len(self) else None
+        if last is None:
+            reply = client.query_uncached(params)
+        else:
+            reply = client.query_since(params, *divmod(last, 10 ** 9))
+        new = reply.all().get(self.key)
+        return self.append(new) if new is not None else 0
+
     @property
     def symbol(self) -> str:
         return self.key.split('/')[0]
@@ -68,28 +322,60 @@ class DataSet(object):
     def attribute_group(self) -> str:
         return self.key.split('/')[2]
 
-    def df(self) -> pd.DataFrame:
-        idxname = self.array.dtype.names[0]
-        df = pd.DataFrame(self.array).set_index(idxname)
-        index = pd.to_datetime(df.index, unit='s', utc=True)
+    def df(self, copy: bool = True) -> pd.DataFrame:
+        """
+        :param copy: if False, the columns of the DataFrame share the memory of this DataSet (and of the
+            replies cached with it), so they must not be modified. those of a columnar reply are read-only.
+        :return: DataFrame of the records indexed by a tz-aware DatetimeIndex with nanosecond precision,
+            built from Epoch and Nanoseconds (if any)
+        """
+        columns = self.columns
+        idxname = self.dtype.names[0]
+        index = pd.DatetimeIndex(self.timestamps().view('M8[ns]'), name=idxname, copy=False).tz_localize('UTC')
         tz = self.timezone
         if tz.lower() != 'utc':
+            # only changes the dtype of the index
             index = index.tz_convert(tz)
-        df.index = index
-        return df
+        return pd.DataFrame({
+            name: col for name, col in six.iteritems(columns) if name != idxname
+        }, index=index, copy=copy)
+
+    def to_arrow(self) -> 'pa.Table':
+        """
+        :return: Arrow table of the records. the index column becomes a tz-aware nanosecond timestamp
+            like the index of df(). the other columns are wrapped without copy when their buffers allow it
+            (e.g. columnar replies); strided or misaligned columns are copied once.
+        """
+        _require_pyarrow()
+        columns = self.columns
+        idxname = self.dtype.names[0]
+        index = pa.array(self.timestamps(), type=pa.timestamp('ns', tz=self.timezone))
+        names = [idxname] + [name for name in columns if name != idxname]
+        arrays = [index] + [_arrow_array(columns[name]) for name in names[1:]]
+        return pa.Table.from_arrays(arrays, names=names)
 
     def __repr__(self):
-        a = self.array
         return 'DataSet(key={}, shape={}, dtype={})'.format(
-            self.key, a.shape, a.dtype,
+            self.key, self.shape, self.dtype,
         )
 
 
+def _concat_datasets(datasets: List[DataSet]) -> Union[np.ndarray, Dict[str, np.ndarray]]:
+    if len(datasets) == 1:
+        return datasets[0].columns if datasets[0].is_columnar else datasets[0].array
+    if not all(ds.is_columnar for ds in datasets):
+        return np.concatenate([ds.array for ds in datasets])
+    return {
+        name: np.concatenate([ds.columns[name] for ds in datasets])
+        for name in datasets[0].dtype.names
+    }
+
+
 class QueryResult(object):
 
-    def __init__(self, result: Dict[str, np.ndarray], timezone: str):
+    def __init__(self, result: Dict[str, Union[np.ndarray, DataSet]], timezone: str):
         self.result = {
-            key: DataSet(value, key, timezone)
+            key: value if isinstance(value, DataSet) else DataSet(value, key, timezone)
             for key, value in six.iteritems(result)
         }
         self.timezone = timezone
@@ -103,6 +389,9 @@ class QueryResult(object):
     def all(self) -> Dict[str, DataSet]:
         return self.result
 
+    def view(self) -> 'QueryResult':
+        return QueryResult({key: ds.view() for key, ds in six.iteritems(self.result)}, self.timezone)
+
     def __repr__(self):
         content = '\n'.join([
             str(ds) for _, ds in six.iteritems(self.result)
@@ -117,24 +406,145 @@ class QueryReply(object):
         self.timezone = timezone
 
     @classmethod
-    def from_response(cls, resp: Dict):
-        results = decode_responses(resp['responses'])
+    def from_response(cls, resp: Dict, columnar: bool = False, lazy: bool = False):
+        results = decode_responses(resp['responses'], columnar=columnar, lazy=lazy)
         return cls([QueryResult(result, resp['timezone']) for result in results], resp['timezone'])
 
     @classmethod
-    def from_grpc_response(cls, resp: proto.MultiQueryResponse):  # ->QueryReply:
-        results = decode_grpc_responses(resp.responses)
+    def from_grpc_response(cls, resp: proto.MultiQueryResponse, columnar: bool = False,
+                           lazy: bool = False):  # ->QueryReply:
+        results = decode_grpc_responses(resp.responses, columnar=columnar, lazy=lazy)
         return cls([QueryResult(result, resp.timezone) for result in results], resp.timezone)
 
+    @classmethod
+    def concat(cls, replies: List['QueryReply']):  # ->QueryReply:
+        """
+        stitch several replies (e.g. symbol/time shards of one query) into one.
+        arrays of the same key are concatenated in the order of the replies.
+        :param replies: list of QueryReply
+        :return: QueryReply with a single QueryResult keyed by TBK
+        """
+        timezone = replies[0].timezone if replies else 'UTC'
+        datasets = {}
+        for reply in replies:
+            for key, dataset in six.iteritems(reply.all()):
+                datasets.setdefault(key, []).append(dataset)
+        merged = {key: _concat_datasets(parts) for key, parts in six.iteritems(datasets)}
+        return cls([QueryResult(merged, timezone)], timezone)
+
     def first(self) -> DataSet:
         return self.results[0].first()
 
+    def view(self) -> 'QueryReply':
+        """
+        :return: QueryReply over the same records, whose DataSets can be appended to or refreshed
+            without changing the DataSets of this reply
+        """
+        return QueryReply([result.view() for result in self.results], self.timezone)
+
     def all(self) -> Dict[str, DataSet]:
         datasets = {}
         for result in self.results:
             datasets.update(result.all())
         return datasets
 
+    def refresh(self, client) -> int:
+        """
+        fetch the records newer than the last one held by each DataSet in a single query, and append them
+        :param client: Client to query
+        :return: number of appended records
+        """
+        datasets = self.all()
+        params = []
+        for key, dataset in six.iteritems(datasets):
+            p = Params(dataset.symbol, dataset.timeframe, dataset.attribute_group)
+            if len(dataset):
+                p = client.since_params(p, *divmod(int(dataset.timestamps()[-1]), 10 ** 9))
+            params.append(p)
+        if not params:
+            return 0
+        # like DataSet.refresh, the QueryCache of the client is bypassed
+        reply = client.query_uncached(params)
+        return sum(
+            datasets[key].append(new)
+            for key, new in six.iteritems(reply.all()) if key in datasets
+        )
+
+    def to_arrow_table(self, key_column: Optional[str] = 'Symbol', key: str = 'symbol') -> 'pa.Table':
+        """
+        concatenate the records of all the DataSets into one long Arrow table
+        :param key_column: name of the dictionary-encoded column telling which DataSet a row comes from.
+            None to not add it
+        :param key: 'symbol' to fill key_column with symbols, 'tbk' with Time Bucket Keys
+        :return: pyarrow.Table
+        """
+        _require_pyarrow()
+        if key not in ('symbol', 'tbk'):
+            raise ValueError('key must be "symbol" or "tbk": {}'.format(key))
+        datasets = list(self.all().values())
+        labels = [ds.symbol if key == 'symbol' else ds.key for ds in datasets]
+        dictionary = sorted(set(labels))
+        positions = {label: i for i, label in enumerate(dictionary)}
+        dictionary = pa.array(dictionary, type=pa.string())
+        tables = []
+        for label, ds in zip(labels, datasets):
+            table = ds.to_arrow()
+            if key_column is not None:
+                indices = pa.array(np.full(len(ds), positions[label], dtype='i4'))
+                table = table.append_column(key_column, pa.DictionaryArray.from_arrays(indices, dictionary))
+            tables.append(table)
+        if not tables:
+            return pa.table({})
+        try:
+            return pa.concat_tables(tables, promote_options='default')
+        except TypeError:  # pyarrow < 14
+            return pa.concat_tables(tables, promote=True)
+
+    def panel(self, column: str, how: str = 'outer', fill=np.nan, key: str = 'symbol') -> pd.DataFrame:
+        """
+        align one column of all the DataSets into a (time x symbol) matrix.
+        rows of all DataSets are scattered into a single preallocated array by searchsorted
+        on the aligned index, instead of joining per-symbol DataFrames.
+        :param column: column name (e.g. 'Close')
+        :param how: 'outer' for the union of the timestamps of all DataSets, 'inner' for their intersection
+        :param fill: value of the cells a DataSet has no record for
+        :param key: 'symbol' to label the columns with symbols, 'tbk' with Time Bucket Keys
+        :return: DataFrame indexed by a tz-aware DatetimeIndex. `.to_numpy()` returns the matrix without copy
+        """
+        if how not in ('outer', 'inner'):
+            raise ValueError('how must be "outer" or "inner": {}'.format(how))
+        datasets = self.by_symbols() if key == 'symbol' else self.all()
+        labels = list(datasets.keys())
+        stamps = [ds.timestamps() for ds in datasets.values()]
+        values = [ds.columns[column] for ds in datasets.values()]
+
+        if not stamps:
+            index = np.empty(0, dtype='i8')
+        elif how == 'outer':
+            index = np.unique(np.concatenate(stamps))
+        else:
+            index = functools.reduce(np.intersect1d, stamps)
+
+        all_stamps = np.concatenate(stamps) if stamps else index
+        rows = np.searchsorted(index, all_stamps)
+        cols = np.repeat(np.arange(len(labels)), [len(ts) for ts in stamps])
+        if how == 'inner':
+            valid = rows < len(index)
+            valid[valid] = index[rows[valid]] == all_stamps[valid]
+            rows, cols = rows[valid], cols[valid]
+        else:
+            valid = slice(None)
+
+        dtype = np.result_type(*[v.dtype for v in values], fill) if values else np.float64
+        matrix = np.full((len(index), len(labels)), fill, dtype=dtype)
+        if values:
+            matrix[rows, cols] = np.concatenate(values)[valid]
+
+        dtindex = pd.DatetimeIndex(index.view('M8[ns]'), name='Epoch', copy=False).tz_localize('UTC')
+        if self.timezone.lower() != 'utc':
+            dtindex = dtindex.tz_convert(self.timezone)
+        return pd.DataFrame(matrix, index=dtindex, columns=labels, copy=False)
+
     def keys(self) -> List[str]:
         keys = []
         for result in self.results:
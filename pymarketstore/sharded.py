@@ -0,0 +1,222 @@
+import bisect
+import hashlib
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import partial
+from operator import methodcaller
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
+
+from .client import Client
+from .encode import Records
+from .hedging import HedgePolicy, Hedger, is_unavailable, query_future
+from .params import ListSymbolsFormat, Params, isiterable
+from .results import QueryReply
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing(object):
+    """
+    consistent-hash ring of shard names. each shard is placed at `vnodes` points of the ring,
+    so that adding or removing a shard only moves the symbols of its neighbouring points.
+    """
+
+    def __init__(self, shards: Sequence[str], vnodes: int = 64):
+        points = sorted((_hash('{}#{}'.format(shard, i)), shard) for shard in shards for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def get(self, symbol: str) -> str:
+        idx = bisect.bisect(self._hashes, _hash(symbol)) % len(self._hashes)
+        return self._shards[idx]
+
+
+class Shard(object):
+    """
+    nodes holding the same partition of the symbols. writes go to the primary (the first node),
+    reads rotate over all the nodes and fail over to the next node when one is unavailable.
+    an unavailable node is skipped for `cooldown` seconds, unless all the nodes are.
+    with a Hedger, reads are hedged over the nodes instead.
+    """
+
+    def __init__(self, name: str, nodes: List[Client], cooldown: float = 5.0, hedger: Hedger = None):
+        if not nodes:
+            raise ValueError('shard {} has no node'.format(name))
+        self.name = name
+        self.nodes = nodes
+        self.cooldown = cooldown
+        self.hedger = hedger
+        self._turn = 0
+        self._down_until = [0.0] * len(nodes)
+        self._lock = threading.Lock()
+
+    @property
+    def primary(self) -> Client:
+        return self.nodes[0]
+
+    def _order(self) -> List[int]:
+        with self._lock:
+            start = self._turn
+            self._turn = (self._turn + 1) % len(self.nodes)
+            now = time.monotonic()
+            order = [(start + i) % len(self.nodes) for i in range(len(self.nodes))]
+            # nodes in their cooldown are tried last
+            return sorted(order, key=lambda idx: self._down_until[idx] > now)
+
+    def key(self, idx: int) -> str:
+        return getattr(self.nodes[idx], 'endpoint', None) or '{}#{}'.format(self.name, idx)
+
+    def read(self, call: Callable[[Client], QueryReply],
+             start: Callable[[Client], Optional[Future]] = None) -> QueryReply:
+        if self.hedger is not None:
+            return self.hedger.call([(self.key(idx), self.nodes[idx]) for idx in self._order()], call, start)
+        error = None
+        for idx in self._order():
+            try:
+                return call(self.nodes[idx])
+            except Exception as exc:
+                if not is_unavailable(exc):
+                    raise
+                logger.warning('node %d of shard %s is unavailable: %s', idx, self.name, exc)
+                with self._lock:
+                    self._down_until[idx] = time.monotonic() + self.cooldown
+                error = exc
+        raise error
+
+    def __repr__(self):
+        return 'Shard({}, nodes={})'.format(self.name, len(self.nodes))
+
+
+class ShardedClient(object):
+    """
+    client of several MarketStore nodes, each holding a partition of the symbols, optionally with read replicas.
+    symbols are routed to shards by an explicit shard map, falling back to a consistent-hash ring.
+    multi-symbol queries and write_many are split per shard, the per-shard calls run concurrently,
+    and query results are merged into a single QueryReply.
+    """
+
+    def __init__(self, shards: Dict[str, Sequence[Union[str, Client]]], shard_map: Dict[str, str] = None,
+                 vnodes: int = 64, max_workers: int = None, cooldown: float = 5.0, hedge: HedgePolicy = None,
+                 **client_options):
+        """
+        :param shards: {shard name: [primary, replica, ...]}. nodes are Client objects or endpoints
+        :param shard_map: {symbol: shard name} of the symbols which are not placed by the hash ring
+        :param vnodes: points of each shard on the hash ring
+        :param max_workers: max number of concurrent per-shard calls
+        :param cooldown: seconds an unavailable node is skipped by reads
+        :param hedge: HedgePolicy to hedge the reads over the nodes of each shard. None for no hedging
+        :param client_options: arguments of the Client created for each endpoint (e.g. grpc=True)
+        """
+        self.hedger = Hedger(hedge) if hedge is not None else None
+        self.shards = {
+            name: Shard(name, [node if isinstance(node, Client) else Client(node, **client_options)
+                               for node in nodes], cooldown=cooldown, hedger=self.hedger)
+            for name, nodes in shards.items()
+        }
+        self.shard_map = dict(shard_map or {})
+        unknown = set(self.shard_map.values()) - set(self.shards)
+        if unknown:
+            raise ValueError('unknown shards in the shard map: {}'.format(', '.join(sorted(unknown))))
+        self.ring = HashRing(list(self.shards), vnodes=vnodes)
+        self._executor = ThreadPoolExecutor(max_workers or 2 * len(self.shards))
+
+    def shard_of(self, symbol: str) -> Shard:
+        name = self.shard_map.get(symbol)
+        if name is None:
+            name = self.ring.get(symbol)
+        return self.shards[name]
+
+    def _dispatch(self, calls: Dict[str, Callable[[], object]]) -> Dict[str, object]:
+        if len(calls) == 1:
+            name, call = next(iter(calls.items()))
+            return {name: call()}
+        futures = {name: self._executor.submit(call) for name, call in calls.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def split(self, params: Union[Params, List[Params]]) -> Dict[str, List[Params]]:
+        """
+        :return: {shard name: Params of the shard's symbols}. a "*" symbol is sent to every shard
+        """
+        if not isiterable(params):
+            params = [params]
+        split = {}
+        for p in params:
+            by_shard = {}
+            for symbol in p.symbols:
+                names = list(self.shards) if symbol == '*' else [self.shard_of(symbol).name]
+                for name in names:
+                    by_shard.setdefault(name, []).append(symbol)
+            for name, symbols in by_shard.items():
+                split.setdefault(name, []).append(p.copy(symbols=symbols))
+        return split
+
+    def query(self, params: Union[Params, List[Params]]) -> QueryReply:
+        """
+        execute QUERY on the shards of the symbols
+        :param params: Params object or list of Params
+        :return: QueryReply with a single result keyed by TBK
+        """
+        calls = {
+            name: partial(self.shards[name].read, methodcaller('query', p), partial(query_future, params=p))
+            for name, p in self.split(params).items()
+        }
+        replies = self._dispatch(calls)
+        return QueryReply.concat([replies[name] for name in calls])
+
+    def write(self, recarray: Records, tbk: str, isvariablelength: bool = False):
+        return self.shard_of(tbk.split('/')[0]).primary.write(recarray, tbk, isvariablelength=isvariablelength)
+
+    def write_many(self, datasets: Dict[str, Records], isvariablelength: bool = False) -> Dict[str, object]:
+        """
+        execute WRITE of many time buckets, one request per shard
+        :return: {shard name: reply of the shard}
+        """
+        by_shard = {}
+        for tbk, records in datasets.items():
+            by_shard.setdefault(self.shard_of(tbk.split('/')[0]).name, {})[tbk] = records
+        return self._dispatch({
+            name: partial(self.shards[name].primary.write_many, part, isvariablelength=isvariablelength)
+            for name, part in by_shard.items()
+        })
+
+    def create(self, tbk: str, dtype: List[Tuple[str, str]], isvariablelength: bool = False):
+        return self.shard_of(tbk.split('/')[0]).primary.create(tbk, dtype, isvariablelength=isvariablelength)
+
+    def destroy(self, tbk: str):
+        return self.shard_of(tbk.split('/')[0]).primary.destroy(tbk)
+
+    def list_symbols(self, fmt: ListSymbolsFormat = ListSymbolsFormat.SYMBOL) -> List[str]:
+        results = self._dispatch({
+            name: partial(shard.read, methodcaller('list_symbols', fmt))
+            for name, shard in self.shards.items()
+        })
+        symbols = []
+        for name in self.shards:
+            symbols.extend(results[name])
+        return list(dict.fromkeys(symbols))
+
+    def latencies(self) -> Dict[str, Dict[str, float]]:
+        """
+        :return: latency histograms of the nodes by endpoint, when reads are hedged
+        """
+        return self.hedger.latencies() if self.hedger is not None else {}
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+        if self.hedger is not None:
+            self.hedger.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return 'ShardedClient(shards={})'.format(list(self.shards))
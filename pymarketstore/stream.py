@@ -1,15 +1,154 @@
+import asyncio
+import inspect
+import itertools
+import logging
+import random
+import threading
+from operator import itemgetter
+
 import msgpack
 import re
 import websocket
 from websocket import ABNF
 
+try:
+    import aiohttp
+except ImportError:  # optional dependency for AsyncStreamConn
+    aiohttp = None
+
+logger = logging.getLogger(__name__)
+
+
+# a pattern made of literal characters, optionally anchored at the end, is looked up in a dict instead of matched.
+# a key matching "{literal}$" is the literal itself, or the literal followed by a newline
+_LITERAL = re.compile(r'(?:\^|\\A)?((?:[^.^$*+?{}\[\]\\|()]|\\[^A-Za-z0-9])*)(\$|\\Z)?')
+# patterns with back references can not be combined into one pattern, since their group numbers change
+_BACKREF = re.compile(r'\\[1-9]|\(\?P=')
+_CACHE_SIZE = 10000
 
-class StreamConn(object):
+
+class _Index(object):
+    """
+    handler patterns by kind: exact keys and key prefixes are dict lookups, the other patterns are
+    matched one by one after a combined pattern of all of them has matched
+    """
+
+    def __init__(self, patterns):
+        self.exact = {}
+        self.prefixes = {}
+        self.patterns = []
+        for pat in patterns:
+            literal = _LITERAL.fullmatch(pat.pattern) if isinstance(pat.pattern, str) else None
+            if literal is None or pat.flags & ~re.UNICODE:
+                self.patterns.append(pat)
+                continue
+            text = re.sub(r'\\(.)', r'\1', literal.group(1))
+            if not literal.group(2):
+                self.prefixes.setdefault(text, []).append(pat)
+                continue
+            self.exact.setdefault(text, []).append(pat)
+            if literal.group(2) == '$':
+                # unlike \Z, $ also matches before a trailing newline
+                self.exact.setdefault(text + '\n', []).append(pat)
+        self.prefix_lengths = sorted({len(prefix) for prefix in self.prefixes})
+        self.prefilter = self._combine(self.patterns)
+
+    @staticmethod
+    def _combine(patterns):
+        if not patterns or any(pat.flags & ~re.UNICODE or _BACKREF.search(pat.pattern) for pat in patterns):
+            return None
+        try:
+            return re.compile('|'.join('(?:{})'.format(pat.pattern) for pat in patterns))
+        except re.error:
+            return None
+
+    def match(self, stream):
+        patterns = list(self.exact.get(stream, ()))
+        for length in self.prefix_lengths:
+            if length > len(stream):
+                break
+            patterns.extend(self.prefixes.get(stream[:length], ()))
+        if self.patterns and (self.prefilter is None or self.prefilter.match(stream)):
+            patterns.extend(pat for pat in self.patterns if pat.match(stream))
+        return patterns
+
+
+class _Handlers(object):
+    """
+    registry of the message handlers by stream pattern, shared by StreamConn and AsyncStreamConn.
+    the handlers of a stream key are resolved once through an index of the patterns, and cached
+    until a handler is registered or deregistered.
+    """
 
     def __init__(self, endpoint):
         self.endpoint = endpoint
 
+        # {pattern: [(registration number, handler), ...]}
         self._handlers = {}
+        self._seq = itertools.count()
+        self._index = None
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _handlers_of(self, stream):
+        handlers = self._cache.get(stream)
+        if handlers is not None:
+            return handlers
+        with self._lock:
+            if self._index is None:
+                self._index = _Index(self._handlers)
+            entries = [entry for pat in self._index.match(stream) for entry in self._handlers[pat]]
+            # handlers are called in the order they were registered
+            handlers = tuple(handler for _, handler in sorted(entries, key=itemgetter(0)))
+            if len(self._cache) >= _CACHE_SIZE:
+                self._cache.clear()
+            self._cache[stream] = handlers
+        return handlers
+
+    def _invalidate(self):
+        self._index = None
+        self._cache = {}
+
+    def on(self, stream_pat):
+        def decorator(func):
+            self.register(stream_pat, func)
+            return func
+
+        return decorator
+
+    def register(self, stream_pat, func):
+        """
+        add a handler of the streams matching the pattern. several handlers may be registered for a pattern.
+        """
+        if isinstance(stream_pat, str):
+            stream_pat = re.compile(stream_pat)
+        with self._lock:
+            self._handlers.setdefault(stream_pat, []).append((next(self._seq), func))
+            self._invalidate()
+
+    def deregister(self, stream_pat, func=None):
+        """
+        remove a handler of the pattern, or all of them if `func` is None
+        :raise KeyError: if the handler is not registered
+        """
+        if isinstance(stream_pat, str):
+            stream_pat = re.compile(stream_pat)
+        with self._lock:
+            entries = self._handlers[stream_pat]
+            if func is not None:
+                remaining = [entry for entry in entries if entry[1] != func]
+                if len(remaining) == len(entries):
+                    raise KeyError(func)
+            else:
+                remaining = []
+            if remaining:
+                self._handlers[stream_pat] = remaining
+            else:
+                del self._handlers[stream_pat]
+            self._invalidate()
+
+
+class StreamConn(_Handlers):
 
     def _connect(self):
         ws = websocket.WebSocket()
@@ -36,23 +175,123 @@ class StreamConn(object):
             ws.close()
 
     def _dispatch(self, stream, msg):
-        for pat, handler in self._handlers.items():
-            if pat.match(stream):
-                handler(self, msg)
+        for handler in self._handlers_of(stream):
+            handler(self, msg)
 
-    def on(self, stream_pat):
-        def decorator(func):
-            self.register(stream_pat, func)
-            return func
 
-        return decorator
+class AsyncStreamConn(_Handlers):
+    """
+    asyncio version of StreamConn. requires aiohttp.
+    the connection is re-established with an exponential backoff when it is lost, and the streams
+    are subscribed again. the server is pinged every `heartbeat` seconds, and a connection whose
+    pong is not received within half of it is taken as lost.
+    handlers may be plain functions or coroutine functions.
+    """
 
-    def register(self, stream_pat, func):
-        if isinstance(stream_pat, str):
-            stream_pat = re.compile(stream_pat)
-        self._handlers[stream_pat] = func
+    def __init__(self, endpoint, heartbeat: float = 30.0, reconnect: bool = True,
+                 backoff: float = 0.5, max_backoff: float = 30.0):
+        """
+        :param endpoint: "ws" or "wss" URL of the server
+        :param heartbeat: seconds between pings. None to disable the heartbeat
+        :param reconnect: reconnect when the connection is lost. if False, the error is raised
+        :param backoff: seconds before the first reconnect attempt, doubled on each failed attempt
+        :param max_backoff: max seconds between reconnect attempts
+        """
+        if aiohttp is None:
+            raise ImportError('aiohttp is required for the asyncio stream connection. '
+                              'install it with `pip install pymarketstore[async]`')
+        super(AsyncStreamConn, self).__init__(endpoint)
+        self.heartbeat = heartbeat
+        self.reconnect = reconnect
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._session = None
+        self._ws = None
+        self._closed = False
 
-    def deregister(self, stream_pat):
-        if isinstance(stream_pat, str):
-            stream_pat = re.compile(stream_pat)
-        del self._handlers[stream_pat]
+    async def _connect(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return await self._session.ws_connect(self.endpoint, heartbeat=self.heartbeat)
+
+    async def _subscribe(self, ws, streams):
+        msg = msgpack.dumps({
+            'streams': streams,
+        })
+        await ws.send_bytes(msg)
+
+    async def _wait(self, attempt: int, reason):
+        # jitter keeps many clients of a restarted server from reconnecting at the same time
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+        logger.warning('stream connection to %s lost (%s), reconnecting in %.1fs', self.endpoint, reason, delay)
+        await asyncio.sleep(delay)
+
+    async def messages(self, streams):
+        """
+        subscribe to the streams and iterate over the messages, with `async for`.
+        the subscription is sent again on each reconnect.
+        :param streams: stream names (e.g. ['BTC/*/*'])
+        """
+        attempt = 0
+        while not self._closed:
+            try:
+                self._ws = ws = await self._connect()
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as exc:
+                if not self.reconnect:
+                    raise
+                await self._wait(attempt, exc)
+                attempt += 1
+                continue
+
+            try:
+                await self._subscribe(ws, streams)
+                async for frame in ws:
+                    if frame.type == aiohttp.WSMsgType.BINARY:
+                        attempt = 0
+                        yield msgpack.loads(frame.data)
+                    elif frame.type == aiohttp.WSMsgType.ERROR:
+                        break
+                reason = ws.exception() or 'closed with code {}'.format(ws.close_code)
+            except (aiohttp.ClientError, OSError, asyncio.TimeoutError) as exc:
+                if not self.reconnect:
+                    raise
+                reason = exc
+            finally:
+                await ws.close()
+                self._ws = None
+
+            if self._closed:
+                return
+            if not self.reconnect:
+                raise ConnectionError('stream connection to {} lost: {}'.format(self.endpoint, reason))
+            await self._wait(attempt, reason)
+            attempt += 1
+
+    async def run(self, streams):
+        """
+        subscribe to the streams and dispatch the messages to the handlers until close() is called
+        """
+        async for msg in self.messages(streams):
+            key = msg.get('key')
+            if key is not None:
+                await self._dispatch(key, msg)
+
+    async def _dispatch(self, stream, msg):
+        for handler in self._handlers_of(stream):
+            result = handler(self, msg)
+            if inspect.isawaitable(result):
+                await result
+
+    async def close(self):
+        self._closed = True
+        if self._ws is not None:
+            await self._ws.close()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
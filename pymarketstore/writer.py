@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+from typing import Dict, List, Tuple, Union
+
+import numpy as np
+
+from .encode import Records
+
+logger = logging.getLogger(__name__)
+
+
+class _Buffer(object):
+    """
+    preallocated column arrays of the records of a time bucket waiting to be written.
+    they are written as a dict of contiguous columns, which is packed without copying them again.
+    """
+
+    def __init__(self, dtype: np.dtype, capacity: int):
+        self.dtype = dtype
+        self.columns = {name: np.empty(capacity, dtype=dtype[name]) for name in dtype.names}
+        self.capacity = capacity
+        self.length = 0
+
+    def append(self, records: Records):
+        n = len(next(iter(records.values()))) if isinstance(records, dict) else len(records)
+        needed = self.length + n
+        if needed > self.capacity:
+            capacity = max(needed, 2 * self.capacity)
+            for name, col in self.columns.items():
+                grown = np.empty(capacity, dtype=col.dtype)
+                grown[:self.length] = col[:self.length]
+                self.columns[name] = grown
+            self.capacity = capacity
+        for name, col in self.columns.items():
+            col[self.length:needed] = records[name]
+        self.length = needed
+
+    def records(self) -> Dict[str, np.ndarray]:
+        return {name: col[:self.length] for name, col in self.columns.items()}
+
+
+class BufferedWriter(object):
+    """
+    accumulate records per time bucket and write them in batches from a background thread.
+    pending records are flushed when their total reaches max_rows, or when the oldest of them
+    has waited max_latency_ms, whichever comes first.
+    an error raised by a background write is raised again by the next append(), flush() or close().
+    the records of the failed write are put back in front of the pending records, so that they are
+    written again by the next flush.
+    """
+
+    def __init__(self, client, max_rows: int = 10000, max_latency_ms: float = 1000,
+                 isvariablelength: bool = False):
+        """
+        :param client: Client (or GRPCClient/JsonRpcClient) to write with
+        :param max_rows: number of pending records which triggers a flush
+        :param max_latency_ms: max time a record waits before it is flushed
+        :param isvariablelength: should be set true if the record content is variable-length array
+        """
+        self.client = client
+        self.max_rows = max_rows
+        self.max_latency = max_latency_ms / 1000.0
+        self.isvariablelength = isvariablelength
+
+        self._buffers: Dict[str, _Buffer] = {}
+        self._dtypes: Dict[str, np.dtype] = {}
+        self._pending = 0
+        self._oldest = None
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        # serializes flushes so that the batches of a time bucket are written in order
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name='BufferedWriter', daemon=True)
+        self._thread.start()
+
+    def append(self, tbk: str, data: Union[np.ndarray, np.void, tuple], dtype: np.dtype = None):
+        """
+        add records of a time bucket
+        :param tbk: Time Bucket Key string. (e.g. 'TSLA/1Min/OHLCV')
+        :param data: a structured numpy array of records, a single record (np.void),
+            or a tuple of field values
+        :param dtype: dtype of a tuple record. only required for the first record of a time bucket
+        """
+        with self._cond:
+            self._raise_error()
+            if self._closed:
+                raise ValueError('append to a closed BufferedWriter')
+
+            if isinstance(data, tuple):
+                dtype = dtype if dtype is not None else self._dtypes.get(tbk)
+                if dtype is None:
+                    raise ValueError('dtype is required for the first tuple record of {}'.format(tbk))
+                data = np.array([data], dtype=dtype)
+            elif isinstance(data, np.void) or data.ndim == 0:
+                data = np.asarray(data).reshape(1)
+
+            buffer = self._buffers.get(tbk)
+            if buffer is None:
+                buffer = self._buffers[tbk] = _Buffer(data.dtype, min(self.max_rows, 1024))
+                self._dtypes[tbk] = data.dtype
+            buffer.append(data)
+
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+                self._cond.notify()
+            self._pending += len(data)
+            if self._pending >= self.max_rows:
+                self._cond.notify()
+
+    def flush(self):
+        """
+        write all the pending records now
+        """
+        with self._cond:
+            self._raise_error()
+        self._flush()
+        with self._cond:
+            self._raise_error()
+
+    def close(self):
+        """
+        flush the pending records and stop the background thread
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify()
+        self._thread.join()
+        with self._cond:
+            self._raise_error()
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            # the background thread holds off the retries of the failed records until the error is raised
+            self._cond.notify()
+            raise error
+
+    def _due(self) -> bool:
+        if self._error is not None:
+            return False
+        if self._pending >= self.max_rows:
+            return True
+        return self._oldest is not None and time.monotonic() - self._oldest >= self.max_latency
+
+    def _swap(self) -> List[Tuple[str, Dict[str, np.ndarray]]]:
+        # the written columns are handed over as they are, and appends continue into new buffers
+        batch = [(tbk, buffer.records()) for tbk, buffer in self._buffers.items()]
+        self._buffers = {}
+        self._pending = 0
+        self._oldest = None
+        return batch
+
+    def _restore(self, batch: List[Tuple[str, Dict[str, np.ndarray]]], oldest: float):
+        # the records of a failed write go back in front of the ones appended since
+        appended = self._buffers
+        self._buffers = {}
+        for tbk, columns in batch:
+            buffer = self._buffers[tbk] = _Buffer(self._dtypes[tbk], len(next(iter(columns.values()))))
+            buffer.append(columns)
+            self._pending += buffer.length
+        for tbk, buffer in appended.items():
+            self._buffers.setdefault(tbk, _Buffer(buffer.dtype, buffer.length)).append(buffer.records())
+        self._oldest = oldest
+
+    def _flush(self):
+        with self._write_lock:
+            with self._cond:
+                oldest = self._oldest
+                batch = self._swap()
+            try:
+                self._write(batch)
+            except Exception as exc:
+                logger.exception('failed to write %d records', sum(len(next(iter(c.values()))) for _, c in batch))
+                with self._cond:
+                    self._restore(batch, oldest)
+                    self._error = exc
+
+    def _write(self, batch: List[Tuple[str, Dict[str, np.ndarray]]]):
+        if batch:
+            # all the time buckets go in a single request
+            self.client.write_many(dict(batch), isvariablelength=self.isvariablelength)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._closed and not self._due():
+                    timeout = None
+                    if self._oldest is not None and self._error is None:
+                        timeout = max(0.0, self._oldest + self.max_latency - time.monotonic())
+                    self._cond.wait(timeout)
+                closed = self._closed
+            self._flush()
+            if closed:
+                return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __repr__(self):
+        return 'BufferedWriter(client={}, max_rows={}, max_latency_ms={}, pending={})'.format(
+            self.client, self.max_rows, self.max_latency * 1000, self._pending)
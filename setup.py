@@ -51,14 +51,24 @@ setup(
         'urllib3',
         'websocket-client',
         'protobuf>=3.11.3',
-        'grpcio'
+        'grpcio>=1.32.0'
     ],
+    extras_require={
+        'async': ['aiohttp'],
+        'arrow': ['pyarrow'],
+    },
+    entry_points={
+        'console_scripts': [
+            'pymkts-load = pymarketstore.loader:main',
+        ],
+    },
     tests_require=[
         'pytest',
         'pytest-cov',
         'coverage>=4.4.1',
-        'mock>=1.0.1',
-        'grpcio-tools'
+        'mock>=4.0.0',
+        'grpcio-tools',
+        'aiohttp',
     ],
     setup_requires=['pytest-runner', 'flake8'],
     cmdclass={
@@ -0,0 +1,84 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+import pymarketstore as pymkts
+
+try:
+    from unittest.mock import patch, AsyncMock
+except ImportError:  # python 3.7
+    from mock import patch, AsyncMock
+
+from pymarketstore.proto import marketstore_pb2 as proto
+from tests.test_results import testdata1
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_async_client_init():
+    c = pymkts.AsyncClient("http://192.168.1.10:5993/rpc", grpc=True)
+    assert c.endpoint == "192.168.1.10:5995"
+    assert isinstance(c.client, pymkts.AsyncGRPCClient)
+
+    pytest.importorskip('aiohttp')
+    c = pymkts.AsyncClient()
+    assert isinstance(c.client, pymkts.AsyncJsonRpcClient)
+
+
+@patch('pymarketstore.proto.marketstore_pb2_grpc.MarketstoreStub')
+def test_grpc_query(stub):
+    # --- given ---
+    c = pymkts.AsyncClient("localhost:5995", grpc=True)
+    stub().Query = AsyncMock(return_value=proto.MultiQueryResponse(timezone='UTC'))
+    p = pymkts.Params('BTC', '1Min', 'OHLCV', 1500000000)
+
+    # --- when ---
+    reply = run(c.query(p))
+
+    # --- then ---
+    assert c.client.stub.Query.await_count == 1
+    assert c.client.stub.Query.call_args[0][0] == pymkts.GRPCClient.build_query(c.client, p)
+    assert reply.timezone == 'UTC'
+
+
+@patch('pymarketstore.proto.marketstore_pb2_grpc.MarketstoreStub')
+def test_grpc_write(stub):
+    # --- given ---
+    c = pymkts.AsyncClient("localhost:5995", grpc=True)
+    stub().Write = AsyncMock()
+    data = np.array([(1, 0)], dtype=[('Epoch', 'i8'), ('Ask', 'f4')])
+
+    # --- when ---
+    run(c.write(data, 'TEST/1Min/TICK'))
+
+    # --- then ---
+    assert c.client.stub.Write.await_count == 1
+
+
+@patch('pymarketstore.jsonrpc_client.AsyncMsgpackRpcClient')
+def test_jsonrpc_query(AsyncMsgpackRpcClient):
+    # --- given ---
+    AsyncMsgpackRpcClient().call = AsyncMock(return_value=testdata1)
+    c = pymkts.AsyncClient()
+    p = pymkts.Params('BTC', '1Min', 'OHLCV')
+
+    # --- when ---
+    reply = run(c.query(p))
+
+    # --- then ---
+    assert AsyncMsgpackRpcClient().call.await_count == 1
+    assert reply.keys() == ['BTC/1Min/OHLCV']
+    expected = pymkts.results.QueryReply.from_response(testdata1)
+    assert (reply.first().array == expected.first().array).all()
+
+
+@patch('pymarketstore.jsonrpc_client.AsyncMsgpackRpcClient')
+def test_jsonrpc_sql(AsyncMsgpackRpcClient):
+    AsyncMsgpackRpcClient().call = AsyncMock(return_value=testdata1)
+    c = pymkts.AsyncClient()
+    run(c.sql("SELECT * FROM `BTC/1Min/OHLCV`"))
+    method, = AsyncMsgpackRpcClient().call.call_args[0]
+    assert method == 'DataService.Query'
@@ -0,0 +1,92 @@
+import asyncio
+
+import msgpack
+import pytest
+
+import pymarketstore as pymkts
+
+web = pytest.importorskip('aiohttp.web')
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+async def _serve(handler):
+    app = web.Application()
+    app.router.add_get('/ws', handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    return runner, 'ws://127.0.0.1:{}/ws'.format(port)
+
+
+def test_async_reconnect():
+    async def test():
+        # --- given ---
+        subscriptions = []
+
+        async def handler(request):
+            # each connection sends one message and is dropped
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            subscriptions.append(msgpack.loads((await ws.receive()).data))
+            n = len(subscriptions)
+            await ws.send_bytes(msgpack.dumps({'key': 'BTC/1Min/OHLCV', 'data': {'n': n}}))
+            await ws.close()
+            return ws
+
+        runner, endpoint = await _serve(handler)
+        conn = pymkts.AsyncStreamConn(endpoint, backoff=0.01)
+        received = []
+
+        @conn.on(r'^BTC/')
+        async def on_btc(c, msg):
+            received.append(msg['data']['n'])
+            if len(received) == 3:
+                await c.close()
+
+        # --- when ---
+        try:
+            await asyncio.wait_for(conn.run(['BTC/*/*']), timeout=5)
+        finally:
+            await runner.cleanup()
+
+        # --- then ---
+        assert received == [1, 2, 3]
+        assert subscriptions == [{'streams': ['BTC/*/*']}] * 3
+
+    run(test())
+
+
+def test_async_iteration():
+    async def test():
+        # --- given ---
+        async def handler(request):
+            ws = web.WebSocketResponse()
+            await ws.prepare(request)
+            await ws.receive()
+            for i in range(3):
+                await ws.send_bytes(msgpack.dumps({'key': 'ETH/1Min/OHLCV', 'data': {'n': i}}))
+            await ws.receive()
+            return ws
+
+        runner, endpoint = await _serve(handler)
+
+        # --- when ---
+        received = []
+        try:
+            async with pymkts.AsyncStreamConn(endpoint) as conn:
+                async for msg in conn.messages(['ETH/*/*']):
+                    received.append(msg['data']['n'])
+                    if len(received) == 3:
+                        break
+        finally:
+            await runner.cleanup()
+
+        # --- then ---
+        assert received == [0, 1, 2]
+
+    run(test())
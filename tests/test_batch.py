@@ -0,0 +1,57 @@
+import numpy as np
+
+import pymarketstore as pymkts
+from pymarketstore.results import QueryReply, QueryResult
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+
+def _batch():
+    starts = np.array(['2017-07-14T02:40:00', '2001-09-09T01:46:40.000000005', 'NaT'], dtype='M8[ns]')
+    return pymkts.QueryBatch(['TSLA', 'FORD', 'AAPL'], '1Min', 'OHLCV', starts=starts,
+                             ends=4294967296 * 10 ** 9, limit=10)
+
+
+def _params():
+    params = [
+        pymkts.Params('TSLA', '1Min', 'OHLCV', 1500000000, 4294967296, limit=10),
+        pymkts.Params('FORD', '1Min', 'OHLCV', '2001-09-09 01:46:40.000000005', 4294967296, limit=10),
+        pymkts.Params('AAPL', '1Min', 'OHLCV', None, 4294967296, limit=10),
+    ]
+    return params
+
+
+def test_build_query_batch():
+    c = pymkts.jsonrpc_client.JsonRpcClient()
+    assert c.build_query_batch(_batch()) == c.build_query(_params())
+
+    c = pymkts.GRPCClient()
+    assert c.build_query_batch(_batch()) == c.build_query(_params())
+
+
+def test_split():
+    batch = pymkts.QueryBatch(['A'] * 10, '1Min', 'OHLCV', starts=0, ends=59 * 60 * 10 ** 9)
+    # 60 records of 16 bytes per query
+    batches = batch.split(max_bytes=1000, row_bytes=16, ratio=1.0)
+    assert [len(b) for b in batches] == [1] * 10
+    batches = batch.split(max_bytes=2000, row_bytes=16, ratio=1.0)
+    assert [len(b) for b in batches] == [2] * 5
+    assert len(batch.split(max_bytes=10 ** 6)) == 1
+    assert [len(b) for b in batch.split(max_bytes=200, ratio=1.0)] == [2] * 5
+
+
+def test_query_batch():
+    c = pymkts.Client()
+    c.client = Mock(max_message_length=200)
+    c.client.query_batch.side_effect = lambda b: QueryReply([QueryResult({
+        '{}/1Min/OHLCV'.format(s): np.zeros(1, dtype=[('Epoch', 'i8')]) for s in b.symbols
+    }, 'UTC')], 'UTC')
+    batch = pymkts.QueryBatch(['S{}'.format(i) for i in range(10)], '1Min', 'OHLCV')
+
+    reply = c.query_batch(batch)
+
+    assert c.client.query_batch.call_count == 5
+    assert len(reply.keys()) == 10
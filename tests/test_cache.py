@@ -0,0 +1,69 @@
+import time
+
+import numpy as np
+
+import pymarketstore as pymkts
+from pymarketstore.cache import QueryCache, normalize_params
+from pymarketstore.results import QueryReply, QueryResult
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+
+def _reply(symbols, rows=10):
+    array = np.zeros(rows, dtype=[('Epoch', 'i8'), ('Close', 'f8')])
+    return QueryReply([QueryResult({'{}/1Min/OHLCV'.format(s): array for s in symbols}, 'UTC')], 'UTC')
+
+
+def test_normalize_params():
+    p1 = pymkts.Params(['AAPL', 'TSLA'], '1Min', 'OHLCV', start=1500000000, limit=10)
+    p2 = pymkts.Params(['TSLA', 'AAPL'], '1Min', 'OHLCV', start='2017-07-14 02:40:00', limit=10)
+    assert normalize_params(p1) == normalize_params([p2])
+    assert normalize_params(p1) != normalize_params(p1.copy(limit=11))
+
+
+def test_lru_eviction():
+    cache = QueryCache(max_bytes=2 * 160, ttl=None)
+    p = [pymkts.Params(s, '1Min', 'OHLCV') for s in ('A', 'B', 'C')]
+    cache.put(p[0], _reply(['A']))
+    cache.put(p[1], _reply(['B']))
+    assert cache.get(p[0]) is not None
+    cache.put(p[2], _reply(['C']))
+
+    assert cache.get(p[1]) is None
+    assert cache.get(p[0]) is not None
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'evictions': 1, 'entries': 2, 'bytes': 320}
+
+
+def test_ttl():
+    cache = QueryCache(ttl=0.01)
+    p = pymkts.Params('A', '1Min', 'OHLCV')
+    cache.put(p, _reply(['A']))
+    assert cache.get(p) is not None
+    time.sleep(0.02)
+    assert cache.get(p) is None
+    assert len(cache) == 0
+
+
+def test_client_cache_invalidation():
+    # --- given ---
+    c = pymkts.Client(cache=QueryCache())
+    c.client = Mock()
+    c.client.query.side_effect = lambda p: _reply(p.symbols)
+    p = pymkts.Params(['AAPL', 'TSLA'], '1Min', 'OHLCV')
+    p2 = pymkts.Params('AMZN', '1Min', 'OHLCV')
+
+    # --- when ---
+    first = c.query(p)
+    c.query(p)
+    c.query(p2)
+    c.write(np.zeros(1, dtype=[('Epoch', 'i8')]), 'TSLA/1Min/OHLCV')
+    c.query(p)
+    c.query(p2)
+
+    # --- then ---
+    assert c.query(p) is not first
+    assert c.client.query.call_count == 3
+    assert c.cache.stats()['hits'] == 3
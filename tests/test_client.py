@@ -1,11 +1,14 @@
 import numpy as np
+import pandas as pd
+import requests
 
 import pymarketstore as pymkts
+from pymarketstore.results import QueryReply, QueryResult
 
 try:
-    from unittest.mock import patch
+    from unittest.mock import patch, Mock
 except ImportError:
-    from mock import patch
+    from mock import patch, Mock
 
 import pytest
 
@@ -67,6 +70,23 @@ def test_write(MsgpackRpcClient):
     assert MsgpackRpcClient().call.called == 1
 
 
+@patch('pymarketstore.jsonrpc_client.MsgpackRpcClient')
+def test_write_many(MsgpackRpcClient):
+    c = pymkts.Client()
+    dtype = [('Epoch', 'i8'), ('Ask', 'f4')]
+    c.write_many({
+        'AAPL/1Min/TICK': np.array([(1, 0)], dtype=dtype),
+        'TSLA/1Min/TICK': np.array([(1, 0), (2, 0)], dtype=dtype),
+    })
+    assert MsgpackRpcClient().call.call_count == 1
+    _, kwargs = MsgpackRpcClient().call.call_args
+    dataset = kwargs['requests'][0]['dataset']
+    assert len(kwargs['requests']) == 1
+    assert dataset['length'] == 3
+    assert dataset['startindex'] == {'AAPL/1Min/TICK': 0, 'TSLA/1Min/TICK': 1}
+    assert dataset['lengths'] == {'AAPL/1Min/TICK': 1, 'TSLA/1Min/TICK': 2}
+
+
 def test_build_query():
     c = pymkts.Client("127.0.0.1:5994")
     p = pymkts.Params('TSLA', '1Min', 'OHLCV', 1500000000, 4294967296)
@@ -106,3 +126,209 @@ def test_destroy(MsgpackRpcClient):
     tbk = 'TEST/1Min/TICK'
     c.destroy(tbk)
     assert MsgpackRpcClient().call.called == 1
+
+
+def test_split_params():
+    p = pymkts.Params(['AAPL', 'AMZN', 'TSLA'], '1Min', 'OHLCV',
+                      start='2020-01-01', end='2020-01-10 12:00')
+
+    shards = pymkts.params.split_params(p, chunk_symbols=2)
+    assert [s.tbk for s in shards] == ['AAPL,AMZN/1Min/OHLCV', 'TSLA/1Min/OHLCV']
+    assert p.tbk == 'AAPL,AMZN,TSLA/1Min/OHLCV'
+
+    shards = pymkts.params.split_params(p, chunk_symbols=None, chunk_span='4D')
+    assert len(shards) == 3
+    assert shards[0].start == p.start
+    assert shards[-1].end == p.end
+    for prev, nxt in zip(shards, shards[1:]):
+        assert nxt.start - prev.end == pd.Timedelta(1, unit='ns')
+
+    with pytest.raises(ValueError):
+        pymkts.params.split_params(p.copy(limit=10), chunk_span='4D')
+
+
+def test_query_parallel():
+    # --- given ---
+    c = pymkts.Client(cache=pymkts.QueryCache())
+    dtype = [('Epoch', 'i8'), ('Close', 'f8')]
+
+    def query(shard):
+        start = shard.start.value // 10 ** 9
+        result = {
+            '{}/1Min/OHLCV'.format(symbol): np.array([(start, 1.0), (start + 60, 2.0)], dtype=dtype)
+            for symbol in shard.symbols
+        }
+        return QueryReply([QueryResult(result, 'UTC')], 'UTC')
+
+    c.client = Mock()
+    c.client.query.side_effect = query
+    p = pymkts.Params(['AAPL', 'AMZN', 'TSLA'], '1Min', 'OHLCV',
+                      start='2020-01-01', end='2020-01-02 23:59')
+
+    # --- when ---
+    reply = c.query_parallel(p, max_workers=4, chunk_symbols=2, chunk_span='1D')
+
+    # --- then ---
+    assert c.client.query.call_count == 4
+    assert sorted(reply.keys()) == ['AAPL/1Min/OHLCV', 'AMZN/1Min/OHLCV', 'TSLA/1Min/OHLCV']
+    epochs = reply.all()['TSLA/1Min/OHLCV'].array['Epoch']
+    assert list(epochs) == [1577836800, 1577836860, 1577923200, 1577923260]
+    # the shards are served from the cache
+    c.query_parallel(p, max_workers=4, chunk_symbols=2, chunk_span='1D')
+    assert c.client.query.call_count == 4
+    assert c.cache.stats()['hits'] == 4
+
+
+@patch('pymarketstore.jsonrpc_client.MsgpackRpcClient')
+def test_write_df(MsgpackRpcClient):
+    # --- given ---
+    c = pymkts.Client()
+    bucket = np.array([(1, 1.0)], dtype=[('Epoch', 'i8'), ('Close', 'f4')])
+    c.client.query = Mock(return_value=QueryReply([QueryResult({'TEST/1Min/OHLCV': bucket}, 'UTC')], 'UTC'))
+    index = pd.DatetimeIndex(['2020-01-01 00:02', '2020-01-01 00:01'], tz='UTC')
+    df = pd.DataFrame({'Close': [2.0, 1.0], 'Volume': [10, 20]}, index=index)
+
+    # --- when ---
+    c.write_df(df, 'TEST/1Min/OHLCV')
+
+    # --- then ---
+    params = c.client.query.call_args[0][0]
+    assert params.limit == 1
+    _, kwargs = MsgpackRpcClient().call.call_args
+    dataset = kwargs['requests'][0]['dataset']
+    assert dataset['names'] == ['Epoch', 'Close']
+    assert dataset['types'] == ['i8', 'f4']
+    assert list(np.frombuffer(dataset['data'][0], dtype='i8')) == [1577836860, 1577836920]
+
+
+@patch('pymarketstore.jsonrpc_client.MsgpackRpcClient')
+def test_write_df_new_bucket(MsgpackRpcClient):
+    # --- given ---
+    c = pymkts.Client()
+    c.client.query = Mock(side_effect=Exception('no files returned from query parse: '))
+    df = pd.DataFrame({'Close': [1.0]}, index=pd.DatetimeIndex(['2020-01-01 00:01'], tz='UTC'))
+
+    # --- when ---
+    c.write_df(df, 'TEST/1Min/OHLCV')
+
+    # --- then ---
+    # the dtypes of a new bucket are those of the DataFrame
+    _, kwargs = MsgpackRpcClient().call.call_args
+    assert kwargs['requests'][0]['dataset']['types'] == ['i8', 'f8']
+
+    # other errors are not taken as a new bucket
+    c.client.query.side_effect = requests.exceptions.Timeout('timed out')
+    with pytest.raises(requests.exceptions.Timeout):
+        c.write_df(df, 'TEST/1Min/OHLCV')
+
+
+def _fake_query(data, key):
+    """emulate the server side filtering of a single-symbol query on `data`"""
+    def query(p):
+        if isinstance(p, list):
+            p, = p
+        ts = data['Epoch'] * 10 ** 9 + data['Nanoseconds']
+        rows = data
+        if p.start is not None:
+            rows = rows[ts >= p.start.value]
+            ts = ts[ts >= p.start.value]
+        if p.end is not None:
+            rows = rows[ts <= p.end.value]
+        if p.limit is not None:
+            rows = rows[:p.limit] if p.limit_from_start else rows[-p.limit:]
+        return QueryReply([QueryResult({key: rows}, 'UTC')], 'UTC')
+    return query
+
+
+def test_query_iter():
+    # --- given ---
+    dtype = [('Epoch', 'i8'), ('Price', 'f8'), ('Nanoseconds', 'i4')]
+    data = np.array([(1, 1.0, 0), (1, 2.0, 5), (1, 3.0, 5), (1, 4.0, 5), (2, 5.0, 0),
+                     (2, 6.0, 7), (3, 7.0, 0), (3, 8.0, 0), (3, 9.0, 0), (4, 10.0, 0)], dtype=dtype)
+    c = pymkts.Client()
+    c.client = Mock()
+    c.client.query.side_effect = _fake_query(data, 'TEST/1Sec/TICK')
+    p = pymkts.Params('TEST', '1Sec', 'TICK', start=0)
+
+    for page_rows in (1, 2, 3, 4, 20):
+        # --- when ---
+        pages = list(c.query_iter(p, page_rows=page_rows))
+
+        # --- then ---
+        prices = np.concatenate([page.first().array['Price'] for page in pages])
+        assert list(prices) == list(data['Price'])
+        assert all(len(page.first()) <= page_rows for page in pages)
+
+    pages = list(c.query_iter(p.copy(end=4), page_rows=None, page_span='2s'))
+    assert len(pages) == 3
+    prices = np.concatenate([page.first().array['Price'] for page in pages])
+    assert list(prices) == list(data['Price'])
+
+
+def test_query_since():
+    # --- given ---
+    dtype = [('Epoch', 'i8'), ('Price', 'f8'), ('Nanoseconds', 'i4')]
+    data = np.array([(1, 1.0, 0), (1, 2.0, 5), (2, 3.0, 0), (3, 4.0, 0)], dtype=dtype)
+    c = pymkts.Client()
+    c.client = Mock()
+    c.client.query.side_effect = _fake_query(data, 'TEST/1Sec/TICK')
+    p = pymkts.Params('TEST', '1Sec', 'TICK')
+
+    # --- when ---
+    reply = c.query_since(p, 1, 0)
+
+    # --- then ---
+    assert list(reply.first().array['Price']) == [2.0, 3.0, 4.0]
+
+    # --- when ---
+    dataset = c.query(p.copy(end=1)).first()
+    added = dataset.refresh(c)
+
+    # --- then ---
+    assert added == 3
+    assert list(dataset.array['Price']) == [1.0, 2.0, 3.0, 4.0]
+    assert dataset.refresh(c) == 0
+
+
+def test_refresh_cached():
+    # --- given ---
+    dtype = [('Epoch', 'i8'), ('Price', 'f8'), ('Nanoseconds', 'i4')]
+    data = np.array([(1, 1.0, 0), (2, 2.0, 0), (3, 3.0, 0)], dtype=dtype)
+    c = pymkts.Client(cache=pymkts.QueryCache())
+    c.client = Mock()
+    c.client.query.side_effect = _fake_query(data[:1], 'TEST/1Sec/TICK')
+    reply = c.query(pymkts.Params('TEST', '1Sec', 'TICK'))
+    dataset = reply.first()
+
+    # --- when ---
+    assert reply.refresh(c) == 0
+    assert dataset.refresh(c) == 0
+    c.client.query.side_effect = _fake_query(data, 'TEST/1Sec/TICK')
+
+    # --- then ---
+    # polls without new records are not cached
+    assert reply.refresh(c) == 2
+    assert list(dataset.array['Price']) == [1.0, 2.0, 3.0]
+
+
+def test_refresh_keeps_cached_reply():
+    # --- given ---
+    dtype = [('Epoch', 'i8'), ('Price', 'f8'), ('Nanoseconds', 'i4')]
+    data = np.array([(1, 1.0, 0), (2, 2.0, 0), (3, 3.0, 0)], dtype=dtype)
+    c = pymkts.Client(cache=pymkts.QueryCache())
+    c.client = Mock()
+    c.client.query.side_effect = _fake_query(data, 'TEST/1Sec/TICK')
+    p = pymkts.Params('TEST', '1Sec', 'TICK', end=1)
+    reply = c.query(p)
+    nbytes = c.cache.stats()['bytes']
+
+    # --- when ---
+    added = reply.refresh(c) + c.query(p).first().refresh(c)
+
+    # --- then ---
+    # the refreshed replies are views, and the cached reply still holds the records of the query only
+    assert added == 4
+    assert list(reply.first().array['Epoch']) == [1, 2, 3]
+    assert list(c.query(p).first().array['Epoch']) == [1]
+    assert c.cache.stats()['bytes'] == nbytes
+    assert c.client.query.call_count == 3
@@ -0,0 +1,164 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+import pymarketstore as pymkts
+from pymarketstore.diskcache import DiskCache, Segment
+from pymarketstore.params import isiterable
+from pymarketstore.results import DataSet, QueryReply, QueryResult
+
+try:
+    from unittest.mock import Mock, patch
+except ImportError:
+    from mock import Mock, patch
+
+DAY = 86400
+
+
+def _server(data):
+    """emulate the server side filtering of range queries on `data`"""
+    def query(params):
+        if not isiterable(params):
+            params = [params]
+        results = []
+        for p in params:
+            ts = data['Epoch'] * 10 ** 9
+            mask = ts >= p.start.value
+            if p.end is not None:
+                mask &= ts <= p.end.value
+            results.append(QueryResult({
+                '{}/1D/OHLCV'.format(s): data[mask] for s in p.symbols
+            }, 'UTC'))
+        return QueryReply(results, 'UTC')
+    return Mock(side_effect=query)
+
+
+def test_disk_cache(tmp_path):
+    # --- given ---
+    start = 1577836800  # 2020-01-01
+    data = np.array([(start + i * DAY, float(i)) for i in range(10)], dtype=[('Epoch', 'i8'), ('Close', 'f8')])
+    fetch = _server(data)
+    cache = DiskCache(str(tmp_path))
+
+    def params(first, last, symbols=('AAPL',)):
+        return pymkts.Params(list(symbols), '1D', 'OHLCV', start=start + first * DAY, end=start + last * DAY)
+
+    # --- when / then ---
+    reply = cache.query(params(2, 5), fetch)
+    assert list(reply.first().array['Close']) == [2, 3, 4, 5]
+    assert fetch.call_count == 1
+
+    # served from disk without a server round trip
+    reply = cache.query(params(3, 4), fetch)
+    assert fetch.call_count == 1
+    assert list(reply.first().df()['Close']) == [3, 4]
+
+    # only the edges are fetched
+    reply = cache.query(params(0, 8), fetch)
+    assert list(reply.first().array['Close']) == list(range(9))
+    assert fetch.call_count == 3
+    head, = fetch.call_args_list[1][0][0]
+    tail, = fetch.call_args_list[2][0][0]
+    assert head.end.value == params(2, 2).start.value - 1
+    assert tail.start.value == params(5, 5).end.value + 1
+
+    reply = cache.query(params(0, 8, symbols=['AAPL', 'TSLA']), fetch)
+    assert fetch.call_count == 4
+    assert sorted(reply.keys()) == ['AAPL/1D/OHLCV', 'TSLA/1D/OHLCV']
+    assert list(reply.all()['TSLA/1D/OHLCV'].array['Close']) == list(range(9))
+
+    cache.invalidate('AAPL/1D/OHLCV', since=params(4, 4).start.value)
+    reply = cache.query(params(0, 8), fetch)
+    assert fetch.call_count == 5
+    assert fetch.call_args_list[4][0][0][0].start.value == params(4, 4).start.value
+
+
+def test_disk_cache_recent(tmp_path):
+    # records newer than `settle` are always fetched
+    now = int(pd.Timestamp.now(tz='UTC').value // 10 ** 9)
+    data = np.array([(now - 3 * DAY, 1.0), (now - 1, 2.0)], dtype=[('Epoch', 'i8'), ('Close', 'f8')])
+    fetch = _server(data)
+    cache = DiskCache(str(tmp_path), settle='1D')
+    p = pymkts.Params('AAPL', '1D', 'OHLCV', start=now - 5 * DAY)
+
+    assert len(cache.query(p, fetch).first()) == 2
+    assert len(cache.query(p, fetch).first()) == 2
+    assert fetch.call_count == 2
+    assert fetch.call_args[0][0][0].start.value > (now - 2 * DAY) * 10 ** 9
+
+
+def test_client_disk_cache(tmp_path):
+    c = pymkts.Client(disk_cache=DiskCache(str(tmp_path)))
+    c.client = Mock()
+    data = np.array([(1577836800, 1.0)], dtype=[('Epoch', 'i8'), ('Close', 'f8')])
+    c.client.query = _server(data)
+    p = pymkts.Params('AAPL', '1D', 'OHLCV', start=1577836800, end=1577836800 + DAY)
+
+    c.query(p)
+    c.query(p)
+    assert c.client.query.call_count == 1
+    c.write(data, 'AAPL/1D/OHLCV')
+    c.query(p)
+    assert c.client.query.call_count == 2
+
+
+def test_disk_cache_versions(tmp_path):
+    # --- given ---
+    start = 1577836800
+    data = np.array([(start + i * DAY, float(i)) for i in range(10)], dtype=[('Epoch', 'i8'), ('Close', 'f8')])
+    cache = DiskCache(str(tmp_path))
+    p = pymkts.Params('AAPL', '1D', 'OHLCV', start=start, end=start + 9 * DAY)
+    cache.query(p, _server(data))
+    path = cache._path('AAPL/1D/OHLCV')
+    old = Segment.load(path)
+
+    # --- when ---
+    cache.invalidate('AAPL/1D/OHLCV', since=(start + 5 * DAY) * 10 ** 9)
+
+    # --- then ---
+    # the replaced version stays readable for the readers which loaded it
+    assert Segment.load(path).version != old.version
+    assert len(old.read(old.start, old.end)['Close']) == 10
+    assert len(Segment.load(path).read(old.start, old.end)['Close']) == 5
+
+    with patch.object(Segment, 'GRACE', 0.0):
+        cache.invalidate('AAPL/1D/OHLCV')
+    assert Segment.load(path) is None
+    assert [entry for entry in os.listdir(path) if entry.startswith('v')] == []
+
+
+def test_disk_cache_concurrent_writers(tmp_path):
+    # --- given ---
+    start = 1577836800
+    data = np.array([(start + i * DAY, float(i)) for i in range(10)], dtype=[('Epoch', 'i8'), ('Close', 'f8')])
+    # two caches on the same directory, as in two processes
+    first, second = DiskCache(str(tmp_path)), DiskCache(str(tmp_path))
+    first.query(pymkts.Params('AAPL', '1D', 'OHLCV', start=start + 2 * DAY, end=start + 5 * DAY), _server(data))
+    stale = Segment.load(first._path('AAPL/1D/OHLCV'))
+
+    # --- when ---
+    # the segment is dropped by the other process while this one extends what it read before
+    second.invalidate('AAPL/1D/OHLCV')
+    head = DataSet({name: data[name][:2] for name in data.dtype.names}, 'AAPL/1D/OHLCV', 'UTC')
+    first._write('AAPL/1D/OHLCV', start * 10 ** 9, stale.end, [head, None], stale, 'UTC')
+
+    # --- then ---
+    # the stale merge is not stored over the invalidation
+    assert Segment.load(first._path('AAPL/1D/OHLCV')) is None
+
+
+def test_disk_cache_invalidate_error(tmp_path):
+    # --- given ---
+    start = 1577836800
+    data = np.array([(start + i * DAY, float(i)) for i in range(10)], dtype=[('Epoch', 'i8'), ('Close', 'f8')])
+    cache = DiskCache(str(tmp_path))
+    cache.query(pymkts.Params('AAPL', '1D', 'OHLCV', start=start, end=start + 9 * DAY), _server(data))
+
+    # --- when ---
+    with patch.object(Segment, 'write', side_effect=OSError('disk full')):
+        cache.invalidate('AAPL/1D/OHLCV', since=(start + 5 * DAY) * 10 ** 9)
+
+    # --- then ---
+    # the error is logged rather than raised, and the segment which could not be trimmed is dropped
+    assert Segment.load(cache._path('AAPL/1D/OHLCV')) is None
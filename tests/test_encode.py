@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import pymarketstore as pymkts
+from pymarketstore.encode import columns_from_df, columns_of, pack
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def test_columns_of():
+    # --- given ---
+    recarray = np.array([(1, 1.0), (2, 2.0)], dtype=[('Epoch', 'i8'), ('Ask', 'f4')])
+    columnar = {'Epoch': np.array([1, 2]), 'Ask': np.array([1.0, 2.0], dtype='f4')}
+
+    # --- when ---
+    from_records = columns_of(recarray)
+    from_columns = columns_of(columnar)
+
+    # --- then ---
+    # the fields of a structured array are views on it, copied only once by pack()
+    assert all(np.shares_memory(col, recarray) for col in from_records.values())
+    assert list(from_records['Epoch']) == [1, 2]
+    # contiguous columns are not copied
+    assert from_columns['Epoch'] is columnar['Epoch']
+    with pytest.raises(ValueError):
+        columns_of({'Epoch': np.array([1, 2]), 'Ask': np.array([1.0])})
+
+
+def test_pack_columnar():
+    # --- given ---
+    epochs = np.array([1, 2, 3])
+    asks = np.array([1.0, 2.0, 3.0], dtype='f4')
+    recarray = np.array([(4, 4.0)], dtype=[('Epoch', 'i8'), ('Ask', 'f4')])
+
+    # --- when ---
+    views = pack({'AAPL/1Min/TICK': {'Epoch': epochs, 'Ask': asks}}, as_bytes=False)
+    packed = pack({'AAPL/1Min/TICK': {'Epoch': epochs, 'Ask': asks}, 'TSLA/1Min/TICK': recarray})
+
+    # --- then ---
+    assert len(views) == 1
+    assert np.shares_memory(np.frombuffer(views[0].data[0], dtype='i8'), epochs)
+    assert len(packed) == 1
+    assert packed[0].types == ['i8', 'f4']
+    assert packed[0].lengths == {'AAPL/1Min/TICK': 3, 'TSLA/1Min/TICK': 1}
+    assert list(np.frombuffer(packed[0].data[1], dtype='f4')) == [1.0, 2.0, 3.0, 4.0]
+    # the strided fields of a single structured array are copied straight to bytes
+    single = pack({'TSLA/1Min/TICK': recarray}, as_bytes=False)
+    assert single[0].data == [recarray['Epoch'].tobytes(), recarray['Ask'].tobytes()]
+    # the columns of several time buckets are copied once into one buffer
+    merged = pack({'AAPL/1Min/TICK': {'Epoch': epochs, 'Ask': asks}, 'TSLA/1Min/TICK': recarray}, as_bytes=False)
+    assert [bytes(col) for col in merged[0].data] == packed[0].data
+
+
+@patch('pymarketstore.jsonrpc_client.MsgpackRpcClient')
+def test_write_columnar(MsgpackRpcClient):
+    # --- given ---
+    c = pymkts.Client()
+    columns = {'Epoch': np.array([1, 2]), 'Ask': np.array([1.0, 2.0], dtype='f4')}
+
+    # --- when ---
+    c.write(columns, 'TEST/1Min/TICK')
+
+    # --- then ---
+    _, kwargs = MsgpackRpcClient().call.call_args
+    dataset = kwargs['requests'][0]['dataset']
+    assert dataset['names'] == ['Epoch', 'Ask']
+    assert bytes(dataset['data'][0]) == columns['Epoch'].tobytes()
+
+
+def test_columns_from_df():
+    # --- given ---
+    index = pd.DatetimeIndex(['2020-01-01 00:00:01.5', '2020-01-01 00:00:00', '2020-01-01 00:00:01.5'],
+                             tz='America/New_York')
+    df = pd.DataFrame({'Bid': [1.0, 2.0, 3.0], 'Ask': [4.0, 5.0, 6.0]}, index=index)
+    dtype = [('Epoch', 'i8'), ('Nanoseconds', 'i4'), ('Ask', 'f4'), ('Bid', 'f4')]
+
+    # --- when ---
+    columns = columns_from_df(df, dtype)
+    inferred = columns_from_df(df.iloc[1:2])
+
+    # --- then ---
+    epoch = int(pd.Timestamp('2020-01-01', tz='America/New_York').timestamp())
+    assert list(columns) == ['Epoch', 'Nanoseconds', 'Ask', 'Bid']
+    assert list(columns['Epoch']) == [epoch, epoch + 1]
+    assert list(columns['Nanoseconds']) == [0, 500000000]
+    assert columns['Nanoseconds'].dtype == np.int32
+    assert columns['Ask'].dtype == np.float32
+    # the last row of a duplicated timestamp wins
+    assert list(columns['Bid']) == [2.0, 3.0]
+    assert list(inferred) == ['Epoch', 'Bid', 'Ask']
+    with pytest.raises(ValueError):
+        columns_from_df(df, [('Epoch', 'i8'), ('Close', 'f4')])
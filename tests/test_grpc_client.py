@@ -1,14 +1,18 @@
+from concurrent.futures import Future
+
+import grpc
 import numpy as np
+import pytest
 
 import pymarketstore as pymkts
 
 try:
-    from unittest.mock import patch
+    from unittest.mock import patch, Mock
 except ImportError:
-    from mock import patch
+    from mock import patch, Mock
 
 from pymarketstore.proto import marketstore_pb2_grpc
-from pymarketstore.proto.marketstore_pb2 import MultiQueryRequest, QueryRequest
+from pymarketstore.proto.marketstore_pb2 import MultiQueryRequest, MultiQueryResponse, QueryRequest
 
 
 def test_grpc_client_init():
@@ -29,6 +33,27 @@ def test_query(stub):
     # --- then ---
     assert c.stub.Query.called == 1
 
+
+@patch('pymarketstore.proto.marketstore_pb2_grpc.MarketstoreStub')
+def test_query_future(stub):
+    # --- given ---
+    # a concurrent.futures.Future has the interface of a grpc.Future used here
+    calls = [Future(), Future()]
+    stub().Query.future.side_effect = calls
+    c = pymkts.GRPCClient()
+
+    # --- when ---
+    future = c.query_future(pymkts.Params('BTC', '1Min', 'OHLCV'))
+    calls[0].set_result(MultiQueryResponse(timezone='UTC'))
+    cancelled = c.query_future(pymkts.Params('BTC', '1Min', 'OHLCV'))
+    cancelled.cancel()
+
+    # --- then ---
+    assert future.result().timezone == 'UTC'
+    # cancelling the future cancels the RPC
+    assert calls[1].cancelled()
+
+
 @patch('pymarketstore.proto.marketstore_pb2_grpc.MarketstoreStub')
 def test_sql(stub):
     # --- given ---
@@ -69,6 +94,86 @@ def test_write(stub):
     assert c.stub.Write.called == 1
 
 
+def test_build_write_many():
+    # --- given ---
+    c = pymkts.GRPCClient()
+    ohlc = np.dtype([('Epoch', 'i8'), ('Close', 'f4')])
+    tick = np.dtype([('Epoch', 'i8'), ('Ask', 'f4'), ('Bid', 'f4')])
+    datasets = {
+        'AAPL/1Min/OHLC': np.array([(1, 1.0), (2, 2.0)], dtype=ohlc),
+        'TSLA/1Min/OHLC': np.array([(3, 3.0)], dtype=ohlc),
+        'TSLA/1Min/TICK': np.array([(4, 4.0, 5.0)], dtype=tick),
+    }
+
+    # --- when ---
+    req = c.build_write_many(datasets)
+
+    # --- then ---
+    assert len(req.requests) == 2
+    packed = req.requests[0].data
+    assert packed.data.length == 3
+    assert dict(packed.start_index) == {'AAPL/1Min/OHLC': 0, 'TSLA/1Min/OHLC': 2}
+    assert dict(packed.lengths) == {'AAPL/1Min/OHLC': 2, 'TSLA/1Min/OHLC': 1}
+    assert list(np.frombuffer(packed.data.column_data[0], dtype='i8')) == [1, 2, 3]
+    assert list(req.requests[1].data.data.column_names) == ['Epoch', 'Ask', 'Bid']
+    assert dict(req.requests[1].data.start_index) == {'TSLA/1Min/TICK': 0}
+
+
+@patch('pymarketstore.grpc_client.grpc.insecure_channel')
+def test_compression(insecure_channel):
+    # --- when ---
+    pymkts.GRPCClient(compression='gzip')
+
+    # --- then ---
+    _, kwargs = insecure_channel.call_args
+    assert kwargs['compression'] == grpc.Compression.Gzip
+    with pytest.raises(ValueError):
+        pymkts.GRPCClient(compression='zstd')
+
+
+@patch('pymarketstore.proto.marketstore_pb2_grpc.MarketstoreStub')
+def test_channel_pool(stub):
+    # --- given ---
+    stub.side_effect = lambda channel: Mock(name='stub')
+    c = pymkts.GRPCClient(pool_size=3, keepalive_ms=10000)
+
+    # --- when ---
+    for _ in range(6):
+        c.server_version()
+
+    # --- then ---
+    assert len(c.pool) == 3
+    assert c.stub is c.pool.stubs[0]
+    assert [s.ServerVersion.call_count for s in c.pool.stubs] == [2, 2, 2]
+
+
+@patch('pymarketstore.proto.marketstore_pb2_grpc.MarketstoreStub')
+def test_channel_pool_least_loaded(stub):
+    # --- given ---
+    stub.side_effect = lambda channel: Mock(name='stub')
+    c = pymkts.GRPCClient(pool_size=2, balance='least_loaded')
+    busy = {}
+
+    def record(stub):
+        def call(req):
+            busy[id(stub)] = c.pool.in_flight()
+            return Mock(version='1.0')
+        return call
+
+    for s in c.pool.stubs:
+        s.ServerVersion.side_effect = record(s)
+
+    # --- when ---
+    c.server_version()
+
+    # --- then ---
+    assert c.pool.stubs[0].ServerVersion.call_count == 1
+    assert busy[id(c.pool.stubs[0])] == [1, 0]
+    assert c.pool.in_flight() == [0, 0]
+    with pytest.raises(ValueError):
+        pymkts.GRPCClient(pool_size=2, balance='random')
+
+
 def test_build_query():
     # --- given ---
     c = pymkts.GRPCClient(endpoint="127.0.0.1:5995")
@@ -82,6 +187,24 @@ def test_build_query():
         requests=[QueryRequest(destination="TSLA/1Min/OHLCV", epoch_start=1500000000, epoch_end=4294967296)])
 
 
+def test_build_query_split_shards():
+    # --- given ---
+    c = pymkts.GRPCClient(endpoint="127.0.0.1:5995")
+    p = pymkts.Params('TSLA', '1Min', 'OHLCV', start='2020-01-01', end='2020-01-10 12:00')
+    shards = pymkts.params.split_params(p, chunk_span='1D')
+
+    # --- when ---
+    reqs = [c.build_query(shard).requests[0] for shard in shards]
+
+    # --- then ---
+    # each shard ends 1ns before the next one starts, without overlapping it
+    assert reqs[0].epoch_end == 1577923199 and reqs[0].epoch_end_nanos == 999999999
+    for prev, nxt in zip(reqs, reqs[1:]):
+        end = prev.epoch_end * 10 ** 9 + prev.epoch_end_nanos
+        start = nxt.epoch_start * 10 ** 9 + nxt.epoch_start_nanos
+        assert start - end == 1
+
+
 @patch('pymarketstore.proto.marketstore_pb2_grpc.MarketstoreStub')
 def test_list_symbols(stub):
     # --- given ---
@@ -0,0 +1,132 @@
+import threading
+import time
+from concurrent.futures import Future
+
+import pytest
+import requests
+
+import pymarketstore as pymkts
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+
+def _node(endpoint, delay=0.0, reply=None):
+    node = Mock(spec=pymkts.Client)
+    node.endpoint = endpoint
+
+    def query(params):
+        time.sleep(delay)
+        return reply or endpoint
+
+    node.query.side_effect = query
+    return node
+
+
+def test_latency_histogram():
+    # --- given ---
+    histogram = pymkts.LatencyHistogram()
+
+    # --- when ---
+    for ms in range(1, 101):
+        histogram.record(ms / 1000.0)
+
+    # --- then ---
+    assert histogram.count == 100
+    assert 0.045 <= histogram.percentile(50) <= 0.055
+    assert 0.09 <= histogram.percentile(99) <= 0.11
+    assert histogram.snapshot()['max'] == 0.1
+
+
+def test_hedged_query():
+    # --- given ---
+    slow, fast = _node('slow', delay=0.5), _node('fast')
+    c = pymkts.HedgedClient([slow, fast], policy=pymkts.HedgePolicy(initial_delay=0.02))
+
+    # --- when ---
+    start = time.monotonic()
+    reply = c.query(pymkts.Params('AAPL', '1Min', 'OHLCV'))
+    elapsed = time.monotonic() - start
+
+    # --- then ---
+    assert reply == 'fast'
+    assert elapsed < 0.4
+    assert slow.query.called and fast.query.called
+    assert c.latencies()['fast']['count'] == 1
+
+
+def test_not_hedged():
+    # --- given ---
+    a, b = _node('a'), _node('b')
+    c = pymkts.HedgedClient([a, b], policy=pymkts.HedgePolicy(initial_delay=1.0))
+
+    # --- when ---
+    replies = [c.query(pymkts.Params('AAPL', '1Min', 'OHLCV')) for _ in range(4)]
+
+    # --- then ---
+    # the nodes are used in turn, without duplicates
+    assert replies == ['a', 'b', 'a', 'b']
+    assert a.query.call_count == 2 and b.query.call_count == 2
+    assert c.histogram('a').count == 2
+
+
+def test_hedged_failover():
+    # --- given ---
+    down, up = _node('down'), _node('up')
+    down.query.side_effect = requests.exceptions.ConnectionError('refused')
+    c = pymkts.HedgedClient([down, up], policy=pymkts.HedgePolicy(initial_delay=10.0))
+
+    # --- when ---
+    reply = c.query(pymkts.Params('AAPL', '1Min', 'OHLCV'))
+
+    # --- then ---
+    assert reply == 'up'
+
+    up.query.side_effect = ValueError('bad query')
+    with pytest.raises(ValueError):
+        c.query(pymkts.Params('AAPL', '1Min', 'OHLCV'))
+
+
+def test_sharded_hedged():
+    # --- given ---
+    release = threading.Event()
+    stuck = _node('stuck')
+    stuck.query.side_effect = lambda params: release.wait()
+    replica = _node('replica', reply=pymkts.results.QueryReply([], 'UTC'))
+    c = pymkts.ShardedClient({'a': [stuck, replica]}, hedge=pymkts.HedgePolicy(initial_delay=0.01))
+
+    # --- when ---
+    reply = c.query(pymkts.Params('AAPL', '1Min', 'OHLCV'))
+    release.set()
+
+    # --- then ---
+    assert reply.keys() == []
+    assert 'replica' in c.latencies()
+
+
+def test_hedged_cancel():
+    # --- given ---
+    hedger = pymkts.hedging.Hedger(pymkts.HedgePolicy(initial_delay=0.01))
+    started = {}
+
+    def start(node):
+        started[node] = future = Future()
+        if node == 'fast':
+            threading.Timer(0.05, future.set_result, [node]).start()
+        return future
+
+    # --- when ---
+    reply = hedger.call([('slow', 'slow'), ('fast', 'fast')], call=None, start=start)
+
+    # --- then ---
+    assert reply == 'fast'
+    # the loser is cancelled rather than left running
+    assert started['slow'].cancelled()
+    # the latency is recorded by a callback of the winner, which may run after the reply is returned
+    deadline = time.monotonic() + 1
+    while hedger.histogram('fast').count == 0 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    assert hedger.latencies()['fast']['count'] == 1
+    assert hedger.latencies()['slow']['count'] == 0
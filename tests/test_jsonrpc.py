@@ -1,9 +1,15 @@
+import gzip
+import threading
+
+import msgpack
 import pytest
+import requests
 import six
+import urllib3
 
 from pymarketstore import jsonrpc
 
-from unittest.mock import patch
+from unittest.mock import Mock, patch
 import importlib
 importlib.reload(jsonrpc)
 
@@ -30,3 +36,65 @@ def test_jsonrpc(requests):
     with pytest.raises(Exception) as e:
         cli._rpc_response(resp)
     assert 'Error: something' in str(e)
+
+
+@patch.object(jsonrpc, 'requests')
+def test_jsonrpc_compression(requests):
+    cli = jsonrpc.MsgpackRpcClient('http://localhost:5993/rcp', compression='gzip')
+    cli._rpc_request('DataService.Query', a=1)
+
+    _, kwargs = requests.Session().post.call_args
+    assert kwargs['headers']['Content-Encoding'] == 'gzip'
+    assert kwargs['headers']['Accept-Encoding'] == 'gzip'
+    assert msgpack.loads(gzip.decompress(kwargs['data']))['params'] == {'a': 1}
+
+    with pytest.raises(ValueError):
+        jsonrpc.MsgpackRpcClient('http://localhost:5993/rcp', compression='zstd')
+
+
+@patch.object(jsonrpc, 'requests')
+def test_jsonrpc_threads(requests):
+    # --- given ---
+    cli = jsonrpc.MsgpackRpcClient('http://localhost:5993/rcp', pool_size=4, timeout=5)
+
+    # --- when ---
+    threads = [threading.Thread(target=cli._rpc_request, args=('DataService.Query',)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    cli.head()
+
+    # --- then ---
+    requests.adapters.HTTPAdapter.assert_called_once_with(pool_connections=1, pool_maxsize=4, pool_block=True)
+    requests.Session().mount.assert_any_call('http://', requests.adapters.HTTPAdapter())
+    calls = requests.Session().post.call_args_list
+    assert len({msgpack.loads(kwargs['data'])['id'] for _, kwargs in calls}) == 8
+    assert all(kwargs['timeout'] == 5 for _, kwargs in calls)
+    assert requests.Session().head.call_args[1]['timeout'] == 5
+
+
+def test_read_timeout():
+    # --- given ---
+    http_resp = requests.Response()
+    http_resp.headers['Content-Length'] = '100'
+    http_resp.raw = Mock()
+    http_resp.raw.readinto.side_effect = [10, urllib3.exceptions.ReadTimeoutError(None, None, 'timed out')]
+
+    # --- when ---
+    with pytest.raises(requests.exceptions.Timeout):
+        jsonrpc.MsgpackRpcClient._read(http_resp)
+
+    # --- then ---
+    # the connection is closed rather than reused
+    assert http_resp.raw.close.called
+
+    http_resp.raw.readinto.side_effect = urllib3.exceptions.ProtocolError('connection reset')
+    with pytest.raises(requests.exceptions.ChunkedEncodingError):
+        jsonrpc.MsgpackRpcClient._read(http_resp)
+
+
+def test_loads():
+    body = msgpack.dumps({'result': {'data': [b'\x00' * 8]}})
+    assert isinstance(jsonrpc._loads('DataService.Query', body)['result']['data'][0], memoryview)
+    assert isinstance(jsonrpc._loads('DataService.ListSymbols', body)['result']['data'][0], bytes)
@@ -0,0 +1,56 @@
+import numpy as np
+
+import pymarketstore as pymkts
+from pymarketstore.loader import parse_file
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
+
+def _csv(tmpdir, name, rows):
+    path = tmpdir.join(name)
+    path.write('Time,Close,Volume\n' + ''.join('{},{},{}\n'.format(*row) for row in rows))
+    return str(path)
+
+
+def test_parse_file(tmpdir):
+    # --- given ---
+    path = _csv(tmpdir, 'AAPL.csv', [('2020-01-01 00:01', 2.0, 20), ('2020-01-01 00:00', 1.0, 10)])
+
+    # --- when ---
+    columns = parse_file(path, dtype=[('Epoch', 'i8'), ('Close', 'f4'), ('Volume', 'i4')])
+
+    # --- then ---
+    assert list(columns['Epoch']) == [1577836800, 1577836860]
+    assert columns['Close'].dtype == np.float32
+    assert list(columns['Volume']) == [10, 20]
+
+
+@patch('pymarketstore.loader.Client')
+def test_load(Client, tmpdir):
+    # --- given ---
+    files = [
+        _csv(tmpdir, 'AAPL.csv', [(1577836800 + 60 * i, float(i), i) for i in range(5)]),
+        _csv(tmpdir, 'TSLA.csv', [(1577836800, 1.0, 1)]),
+    ]
+    Client().list_symbols.return_value = ['TSLA/1Min/OHLCV']
+    checkpoint = str(tmpdir.join('checkpoint.json'))
+    loader = pymkts.BulkLoader(processes=1, connections=2, window=2, chunk_rows=2, checkpoint=checkpoint)
+
+    # --- when ---
+    stats = loader.load(files, '{symbol}/1Min/OHLCV')
+
+    # --- then ---
+    assert stats == {'files': 2, 'skipped': 0, 'rows': 6}
+    Client().create.assert_called_once_with(
+        'AAPL/1Min/OHLCV', [('Epoch', 'i8'), ('Close', 'f8'), ('Volume', 'i8')])
+    written = [args for args, _ in Client().write.call_args_list]
+    assert sorted(len(columns['Epoch']) for columns, _ in written) == [1, 1, 2, 2]
+    assert {tbk for _, tbk in written} == {'AAPL/1Min/OHLCV', 'TSLA/1Min/OHLCV'}
+
+    # resumes from the checkpoint
+    resumed = pymkts.BulkLoader(processes=1, checkpoint=checkpoint).load(files, '{symbol}/1Min/OHLCV')
+    assert resumed == {'files': 0, 'skipped': 2, 'rows': 0}
+    assert Client().write.call_count == 4
@@ -0,0 +1,51 @@
+import msgpack
+import numpy as np
+import pytest
+
+from pymarketstore import msgpack_view
+
+
+def test_loads():
+    # --- given ---
+    doc = {
+        'int': [0, 127, 128, 65535, 2 ** 32, -1, -33, -129, -2 ** 40],
+        'float': [1.5, -0.25],
+        'str': ['', 'a' * 40, u'é' * 300],
+        'other': [None, True, False, [], {}],
+        'nested': {'map': {str(i): i for i in range(20)}, 'array': list(range(20))},
+        b'binkey': b'\x00\x01',
+    }
+    buffer = msgpack.packb(doc, use_bin_type=True)
+
+    # --- when ---
+    decoded = msgpack_view.loads(buffer)
+
+    # --- then ---
+    assert isinstance(decoded[b'binkey'], memoryview)
+    decoded[b'binkey'] = decoded[b'binkey'].tobytes()
+    assert decoded == msgpack.unpackb(buffer, raw=False, strict_map_key=False)
+
+
+def test_loads_bin_is_a_view():
+    # --- given ---
+    column = np.arange(100000, dtype='i8')
+    buffer = bytearray(msgpack.packb({'data': [column.tobytes()]}, use_bin_type=True))
+
+    # --- when ---
+    data = msgpack_view.loads(buffer)['data'][0]
+
+    # --- then ---
+    assert isinstance(data, memoryview)
+    assert data.readonly or not hasattr(data, 'toreadonly')
+    assert data.obj is buffer
+    np.testing.assert_array_equal(np.frombuffer(data, dtype='i8'), column)
+
+
+def test_loads_invalid():
+    buffer = msgpack.packb({'data': [b'x' * 100]}, use_bin_type=True)
+    with pytest.raises(ValueError):
+        msgpack_view.loads(buffer[:-10])
+    with pytest.raises(ValueError):
+        msgpack_view.loads(buffer + b'\x00')
+    with pytest.raises(ValueError):
+        msgpack_view.loads(msgpack.packb(msgpack.ExtType(1, b'x')))
@@ -1,5 +1,15 @@
 from ast import literal_eval
+
+import numpy as np
+import pytest
+
+try:
+    from unittest.mock import patch
+except ImportError:
+    from mock import patch
+
 from pymarketstore import results
+from pymarketstore.proto import marketstore_pb2 as proto
 
 testdata1 = literal_eval(r"""
 {'responses': [{'result': {'data': [b'\xf4\xe8^Z\x00\x00\x00\x000\xe9^Z\x00\x00\x00\x00l\xe9^Z\x00\x00\x00\x00\xa8\xe9^Z\x00\x00\x00\x00\xe4\xe9^Z\x00\x00\x00\x00',
@@ -53,3 +63,147 @@ def test_results():
 
     reply = results.QueryReply.from_response(testdata2)
     assert str(reply.first().df().index.tzinfo) == 'America/New_York'
+
+
+def test_concat():
+    reply1 = results.QueryReply.from_response(testdata1)
+    reply2 = results.QueryReply.from_response(testdata2)
+    merged = results.QueryReply.concat([reply1, reply2])
+    assert sorted(merged.keys()) == ['BTC/1Min/OHLCV', 'ETH/1Min/OHLCV']
+    assert merged.all()['BTC/1Min/OHLCV'].array.shape == (10,)
+    assert merged.timezone == 'UTC'
+
+
+def test_results_columnar():
+    reply = results.QueryReply.from_response(testdata2, columnar=True)
+    expected = results.QueryReply.from_response(testdata2)
+
+    btc = reply.all()['BTC/1Min/OHLCV']
+    assert btc.is_columnar
+    assert str(btc) == str(expected.all()['BTC/1Min/OHLCV'])
+    assert list(btc.columns) == ['Epoch', 'Open', 'High', 'Low', 'Close', 'Volume']
+    # columns are views over the received bytes
+    assert not btc.columns['Close'].flags.owndata
+    assert (btc.array == expected.all()['BTC/1Min/OHLCV'].array).all()
+    assert btc.df().equals(expected.all()['BTC/1Min/OHLCV'].df())
+
+
+def test_results_lazy():
+    reply = results.QueryReply.from_response(testdata2, lazy=True)
+    expected = results.QueryReply.from_response(testdata2)
+
+    assert sorted(reply.keys()) == ['BTC/1Min/OHLCV', 'ETH/1Min/OHLCV']
+    assert sorted(reply.symbols()) == ['BTC', 'ETH']
+    assert reply.timeframes() == ['1Min']
+    datasets = reply.by_symbols()
+    assert str(datasets['BTC']) == str(expected.by_symbols()['BTC'])
+    assert not any(ds.is_decoded for ds in datasets.values())
+
+    assert (datasets['BTC'].array == expected.by_symbols()['BTC'].array).all()
+    assert datasets['BTC'].is_decoded
+    assert not datasets['ETH'].is_decoded
+
+
+def test_grpc_results_lazy_columnar():
+    packed = testdata2['responses'][0]['result']
+    resp = proto.MultiQueryResponse(responses=[proto.QueryResponse(result=proto.NumpyMultiDataset(
+        data=proto.NumpyDataset(column_names=packed['names'], column_types=packed['types'],
+                                column_data=packed['data'], length=packed['length']),
+        start_index=packed['startindex'], lengths=packed['lengths'],
+    ))], timezone='America/New_York')
+
+    reply = results.QueryReply.from_grpc_response(resp, columnar=True, lazy=True)
+    expected = results.QueryReply.from_response(testdata2)
+
+    eth = reply.all()['ETH/1Min/OHLCV']
+    assert not eth.is_decoded
+    assert eth.is_columnar
+    assert (eth.columns['Close'] == expected.all()['ETH/1Min/OHLCV'].array['Close']).all()
+    assert eth.df().equals(expected.all()['ETH/1Min/OHLCV'].df())
+
+
+def test_append():
+    for columnar in (False, True):
+        reply = results.QueryReply.from_response(testdata1, columnar=columnar)
+        expected = results.QueryReply.from_response(testdata2).all()['BTC/1Min/OHLCV'].array
+        ds = reply.first()
+        assert ds.append(expected) == 5
+        assert ds.append(ds.slice(0, 0)) == 0
+        assert len(ds) == 10
+        assert ds.is_columnar == columnar
+        assert (ds.array[5:] == expected).all()
+        assert ds.df().shape == (10, 5)
+
+
+def test_df_nanoseconds():
+    array = np.array([(1500000000, 1.0, 0), (1500000000, 2.0, 5)],
+                     dtype=[('Epoch', 'i8'), ('Price', 'f4'), ('Nanoseconds', 'i4')])
+    df = results.DataSet(array, 'TEST/1Sec/TICK', 'America/New_York').df()
+    assert df.index.name == 'Epoch'
+    assert str(df.index.tzinfo) == 'America/New_York'
+    assert list(df.index.asi8) == [1500000000 * 10 ** 9, 1500000000 * 10 ** 9 + 5]
+    assert list(df.columns) == ['Price', 'Nanoseconds']
+
+
+def test_df_copy():
+    array = np.array([(1500000000, 1.0), (1500000060, 2.0)], dtype=[('Epoch', 'i8'), ('Price', 'f4')])
+    ds = results.DataSet(array, 'TEST/1Min/TICK', 'UTC')
+
+    df = ds.df()
+    df.iloc[0, 0] = 999
+    assert list(ds.array['Price']) == [1.0, 2.0]
+
+    assert np.shares_memory(ds.df(copy=False)['Price'].to_numpy(), array)
+
+
+def test_to_arrow():
+    pa = pytest.importorskip('pyarrow')
+    reply = results.QueryReply.from_response(testdata2, columnar=True)
+
+    btc = reply.all()['BTC/1Min/OHLCV']
+    table = btc.to_arrow()
+    assert table.column_names == ['Epoch', 'Open', 'High', 'Low', 'Close', 'Volume']
+    assert table.schema.field('Epoch').type == pa.timestamp('ns', tz='America/New_York')
+    # columnar buffers are wrapped without copy
+    assert table.column('Close').chunk(0).buffers()[1].address == btc.columns['Close'].ctypes.data
+    assert table.to_pandas().equals(btc.df().reset_index())
+
+    table = reply.to_arrow_table()
+    assert table.num_rows == 10
+    assert sorted(set(table.column('Symbol').to_pylist())) == ['BTC', 'ETH']
+    table = reply.to_arrow_table(key='tbk')
+    assert set(table.column('Symbol').to_pylist()) == {'BTC/1Min/OHLCV', 'ETH/1Min/OHLCV'}
+
+
+def test_to_arrow_table_old_pyarrow():
+    pa = pytest.importorskip('pyarrow')
+    reply = results.QueryReply.from_response(testdata2, columnar=True)
+    concat_tables = pa.concat_tables
+
+    def old_concat_tables(tables, promote=False):
+        # the signature of pyarrow < 14
+        return concat_tables(tables, promote_options='default' if promote else 'none')
+
+    with patch.object(pa, 'concat_tables', old_concat_tables):
+        assert reply.to_arrow_table().num_rows == 10
+
+
+def test_panel():
+    dtype = [('Epoch', 'i8'), ('Close', 'f4')]
+    reply = results.QueryReply([results.QueryResult({
+        'AAPL/1Min/OHLCV': np.array([(60, 1.0), (120, 2.0), (180, 3.0)], dtype=dtype),
+        'TSLA/1Min/OHLCV': np.array([(120, 20.0), (240, 40.0)], dtype=dtype),
+    }, 'UTC')], 'UTC')
+
+    panel = reply.panel('Close')
+    assert list(panel.columns) == ['AAPL', 'TSLA']
+    assert list(panel.index.asi8 // 10 ** 9) == [60, 120, 180, 240]
+    assert panel.to_numpy().dtype == np.float32
+    np.testing.assert_array_equal(panel.to_numpy(), [[1, np.nan], [2, 20], [3, np.nan], [np.nan, 40]])
+
+    panel = reply.panel('Close', how='inner', key='tbk')
+    assert list(panel.columns) == ['AAPL/1Min/OHLCV', 'TSLA/1Min/OHLCV']
+    np.testing.assert_array_equal(panel.to_numpy(), [[2, 20]])
+
+    panel = reply.panel('Close', fill=0)
+    assert panel.iloc[0, 1] == 0
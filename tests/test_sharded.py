@@ -0,0 +1,94 @@
+import numpy as np
+import pytest
+import requests
+
+import pymarketstore as pymkts
+from pymarketstore.results import QueryReply, QueryResult
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+dtype = [('Epoch', 'i8'), ('Close', 'f4')]
+
+
+def _node(name):
+    node = Mock(spec=pymkts.Client)
+
+    def query(params):
+        datasets = {
+            '{}/{}/{}'.format(symbol, p.timeframe, p.attrgroup): np.array([(1, 1.0)], dtype=dtype)
+            for p in params for symbol in p.symbols
+        }
+        return QueryReply([QueryResult(datasets, 'UTC')], 'UTC')
+
+    node.query.side_effect = query
+    node.name = name
+    return node
+
+
+def test_hash_ring():
+    # --- given ---
+    symbols = ['SYM{}'.format(i) for i in range(1000)]
+    ring = pymkts.HashRing(['a', 'b', 'c'])
+
+    # --- when ---
+    placed = {symbol: ring.get(symbol) for symbol in symbols}
+    grown = pymkts.HashRing(['a', 'b', 'c', 'd'])
+
+    # --- then ---
+    assert set(placed.values()) == {'a', 'b', 'c'}
+    # only the symbols taken over by the new shard move
+    moved = [symbol for symbol in symbols if grown.get(symbol) != placed[symbol]]
+    assert all(grown.get(symbol) == 'd' for symbol in moved)
+    assert len(moved) < len(symbols) / 2
+
+
+def test_query():
+    # --- given ---
+    a, b = _node('a'), _node('b')
+    c = pymkts.ShardedClient({'a': [a], 'b': [b]}, shard_map={'AAPL': 'a', 'TSLA': 'b', 'FORD': 'b'})
+
+    # --- when ---
+    reply = c.query(pymkts.Params(['AAPL', 'TSLA', 'FORD'], '1Min', 'OHLCV'))
+
+    # --- then ---
+    assert a.query.call_args[0][0][0].symbols == ['AAPL']
+    assert b.query.call_args[0][0][0].symbols == ['TSLA', 'FORD']
+    assert sorted(reply.keys()) == ['AAPL/1Min/OHLCV', 'FORD/1Min/OHLCV', 'TSLA/1Min/OHLCV']
+
+
+def test_query_failover():
+    # --- given ---
+    primary, replica = _node('primary'), _node('replica')
+    primary.query.side_effect = requests.exceptions.ConnectionError('refused')
+    c = pymkts.ShardedClient({'a': [primary, replica]})
+
+    # --- when ---
+    replies = [c.query(pymkts.Params('AAPL', '1Min', 'OHLCV')) for _ in range(4)]
+
+    # --- then ---
+    assert all(reply.keys() == ['AAPL/1Min/OHLCV'] for reply in replies)
+    # the unavailable node is skipped during its cooldown
+    assert primary.query.call_count == 1
+    assert replica.query.call_count == 4
+
+    replica.query.side_effect = ValueError('bad query')
+    with pytest.raises(ValueError):
+        c.query(pymkts.Params('AAPL', '1Min', 'OHLCV'))
+
+
+def test_write_many():
+    # --- given ---
+    a, b, b_replica = _node('a'), _node('b'), _node('b2')
+    c = pymkts.ShardedClient({'a': [a], 'b': [b, b_replica]}, shard_map={'AAPL': 'a', 'TSLA': 'b'})
+    data = np.array([(1, 1.0)], dtype=dtype)
+
+    # --- when ---
+    c.write_many({'AAPL/1Min/OHLCV': data, 'TSLA/1Min/OHLCV': data, 'TSLA/1Min/TICK': data})
+
+    # --- then ---
+    assert list(a.write_many.call_args[0][0]) == ['AAPL/1Min/OHLCV']
+    assert list(b.write_many.call_args[0][0]) == ['TSLA/1Min/OHLCV', 'TSLA/1Min/TICK']
+    assert not b_replica.write_many.called
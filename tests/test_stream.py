@@ -0,0 +1,99 @@
+import re
+
+import pytest
+
+import pymarketstore as pymkts
+
+
+def test_dispatch():
+    # --- given ---
+    conn = pymkts.StreamConn('ws://localhost:5993/ws')
+    received = []
+    conn.register(r'^BTC/', lambda c, msg: received.append(('btc', msg['key'])))
+
+    @conn.on(r'.*/1Min/')
+    def on_1min(c, msg):
+        received.append(('1min', msg['key']))
+
+    # --- when ---
+    conn._dispatch('BTC/1Min/OHLCV', {'key': 'BTC/1Min/OHLCV'})
+    conn._dispatch('ETH/1Min/OHLCV', {'key': 'ETH/1Min/OHLCV'})
+    conn.deregister(r'^BTC/')
+    conn._dispatch('BTC/1Sec/OHLCV', {'key': 'BTC/1Sec/OHLCV'})
+
+    # --- then ---
+    assert received == [('btc', 'BTC/1Min/OHLCV'), ('1min', 'BTC/1Min/OHLCV'), ('1min', 'ETH/1Min/OHLCV')]
+
+
+def test_dispatch_index():
+    # --- given ---
+    conn = pymkts.StreamConn('ws://localhost:5993/ws')
+    received = []
+
+    def handler(name):
+        return lambda c, msg: received.append(name)
+
+    conn.register(r'^BTC/1Min/OHLCV$', handler('exact'))
+    conn.register(r'^BTC/', handler('prefix'))
+    conn.register(r'^(BTC|ETH)/1Min/', handler('regex'))
+    conn.register(r'^btc/', handler('nomatch'))
+    conn.register(r'^BTC/', handler('prefix2'))
+
+    # --- when ---
+    conn._dispatch('BTC/1Min/OHLCV', {})
+    conn._dispatch('BTC/1Min/OHLCV', {})
+    conn._dispatch('BTC/1Min/OHLCVX', {})
+    conn._dispatch('ETH/1Min/OHLCV', {})
+    conn._dispatch('XRP/1Min/OHLCV', {})
+
+    # --- then ---
+    # several handlers of a pattern are kept, and all of them are called in the order they were registered
+    assert received == ['exact', 'prefix', 'regex', 'prefix2'] * 2 + ['prefix', 'regex', 'prefix2'] + ['regex']
+
+
+def test_deregister():
+    # --- given ---
+    conn = pymkts.StreamConn('ws://localhost:5993/ws')
+    received = []
+
+    def first(c, msg):
+        received.append('first')
+
+    def second(c, msg):
+        received.append('second')
+
+    conn.register(r'^BTC/', first)
+    conn.register(r'^BTC/', second)
+    conn._dispatch('BTC/1Min/OHLCV', {})
+
+    # --- when ---
+    conn.deregister(r'^BTC/', first)
+    conn._dispatch('BTC/1Min/OHLCV', {})
+    conn.deregister(r'^BTC/')
+    conn._dispatch('BTC/1Min/OHLCV', {})
+
+    # --- then ---
+    # the cached handlers of the key are invalidated
+    assert received == ['first', 'second', 'second']
+    with pytest.raises(KeyError):
+        conn.deregister(r'^BTC/', first)
+
+
+def test_dispatch_index_anchors():
+    # --- given ---
+    conn = pymkts.StreamConn('ws://localhost:5993/ws')
+    patterns = [r'^BTC/1Min/OHLCV$', r'BTC/1Min/OHLCV\Z', r'^BTC/', r'\ABTC/1Min/OHLCV']
+    received = []
+    for pat in patterns:
+        conn.register(pat, lambda c, msg, pat=pat: received.append((msg['key'], pat)))
+    keys = ['BTC/1Min/OHLCV', 'BTC/1Min/OHLCV\n', 'BTC/1Min/OHLCVX', 'BTC/1Min/OHLC', 'ETH/1Min/OHLCV']
+
+    # --- when ---
+    for key in keys:
+        conn._dispatch(key, {'key': key})
+
+    # --- then ---
+    # the index matches the keys like re.match
+    assert received == [(key, pat) for key in keys for pat in patterns if re.match(pat, key)]
+    assert ('BTC/1Min/OHLCV\n', r'^BTC/1Min/OHLCV$') in received
+    assert ('BTC/1Min/OHLCV\n', r'BTC/1Min/OHLCV\Z') not in received
@@ -0,0 +1,95 @@
+import time
+
+import numpy as np
+import pytest
+
+import pymarketstore as pymkts
+
+try:
+    from unittest.mock import Mock
+except ImportError:
+    from mock import Mock
+
+dtype = np.dtype([('Epoch', 'i8'), ('Price', 'f4')])
+
+
+def _written(client):
+    written = {}
+    for args, _ in client.write_many.call_args_list:
+        for tbk, records in args[0].items():
+            written.setdefault(tbk, []).append(records)
+    return {
+        tbk: {name: np.concatenate([chunk[name] for chunk in chunks]) for name in dtype.names}
+        for tbk, chunks in written.items()
+    }
+
+
+def test_flush_on_max_rows():
+    client = Mock()
+    writer = pymkts.BufferedWriter(client, max_rows=10, max_latency_ms=60000)
+
+    writer.append('AAPL/1Min/OHLCV', (1, 1.0), dtype=dtype)
+    for i in range(2, 10):
+        writer.append('AAPL/1Min/OHLCV', (i, float(i)))
+    writer.append('TSLA/1Min/OHLCV', np.array([(1, 1.0)], dtype=dtype)[0])
+    for _ in range(100):
+        if client.write_many.called:
+            break
+        time.sleep(0.01)
+    assert client.write_many.call_count == 1
+
+    writer.append('TSLA/1Min/OHLCV', np.array([(2, 2.0), (3, 3.0)], dtype=dtype))
+    writer.close()
+    written = _written(client)
+    assert list(written['AAPL/1Min/OHLCV']['Epoch']) == list(range(1, 10))
+    assert list(written['TSLA/1Min/OHLCV']['Epoch']) == [1, 2, 3]
+
+
+def test_flush_on_latency():
+    client = Mock()
+    with pymkts.BufferedWriter(client, max_rows=1000, max_latency_ms=10) as writer:
+        writer.append('AAPL/1Min/OHLCV', (1, 1.0), dtype=dtype)
+        for _ in range(100):
+            if client.write_many.called:
+                break
+            time.sleep(0.01)
+        assert client.write_many.call_count == 1
+        assert writer.pending == 0
+
+
+def test_write_error():
+    client = Mock()
+    client.write_many.side_effect = IOError('connection refused')
+    writer = pymkts.BufferedWriter(client, max_rows=1000, max_latency_ms=60000)
+    writer.append('AAPL/1Min/OHLCV', (1, 1.0), dtype=dtype)
+    with pytest.raises(IOError):
+        writer.flush()
+    # the failed records are still pending, and close() fails to write them again
+    with pytest.raises(IOError):
+        writer.close()
+    assert writer.pending == 1
+    with pytest.raises(ValueError):
+        writer.append('AAPL/1Min/OHLCV', (2, 2.0))
+
+
+def test_write_error_keeps_records():
+    # --- given ---
+    client = Mock()
+    client.write_many.side_effect = [IOError('connection refused'), None]
+    writer = pymkts.BufferedWriter(client, max_rows=1000, max_latency_ms=60000)
+    writer.append('AAPL/1Min/OHLCV', np.array([(1, 1.0), (2, 2.0)], dtype=dtype))
+
+    # --- when ---
+    with pytest.raises(IOError):
+        writer.flush()
+    writer.append('AAPL/1Min/OHLCV', (3, 3.0))
+    writer.append('TSLA/1Min/OHLCV', (1, 1.0), dtype=dtype)
+    writer.close()
+
+    # --- then ---
+    # the failed records are written again, ahead of the ones appended after the failure
+    assert client.write_many.call_count == 2
+    written = client.write_many.call_args[0][0]
+    assert list(written['AAPL/1Min/OHLCV']['Epoch']) == [1, 2, 3]
+    assert list(written['TSLA/1Min/OHLCV']['Epoch']) == [1]
+    assert writer.pending == 0